@@ -2,7 +2,7 @@ from .runner import Runner
 from .declarations import (
     requires,
     returns_result_type, returns_mapping, returns_sequence, returns,
-    optional, attr, item, nothing
+    streams, optional, attr, item, nothing
 )
 from .plug import Plug
 
@@ -10,5 +10,5 @@ __all__ = [
     'Runner',
     'requires', 'optional',
     'returns_result_type', 'returns_mapping', 'returns_sequence', 'returns',
-    'attr', 'item', 'Plug', 'nothing'
+    'streams', 'attr', 'item', 'Plug', 'nothing'
 ]
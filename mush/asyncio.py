@@ -0,0 +1,335 @@
+"""
+.. currentmodule:: mush
+
+Support for running callables that are coroutines, or that return other
+awaitables, along with asynchronous context managers.
+"""
+from asyncio import ensure_future, get_event_loop, shield, wrap_future
+from functools import partial
+from inspect import isawaitable, iscoroutinefunction
+
+from .batching import Batched
+from .compat import perf_counter
+from .context import Context, ContextError
+from .factory import Factory
+from .plan import (
+    FactoryStep, ProcessStep, Requirement, arguments, release
+)
+from .runner import Runner
+from .tracing import Traced, skipping, span
+from .validation import validate
+
+
+def flight_key(args, kw):
+    """
+    Return a key identifying calls made with the supplied arguments and
+    keyword parameters, or a new object if they cannot be hashed.
+    """
+    try:
+        key = tuple(args), frozenset(kw.items())
+        hash(key)
+    except TypeError:
+        key = object()
+    return key
+
+
+def single_flight(obj, flights, args, kw):
+    """
+    Call the supplied callable, unless a call with equal parameters is
+    already in the supplied flights, returning an awaitable for the result
+    that is shared by all calls made before it completes.
+    """
+    key = flight_key(args, kw)
+    future = flights.get(key)
+    if future is None:
+        result = obj(*args, **kw)
+        if not isawaitable(result):
+            return result
+        future = flights[key] = ensure_future(result)
+        future.add_done_callback(lambda future: flights.pop(key, None))
+    return shield(future)
+
+
+class Tick(object):
+    """
+    The calls to a batched coroutine function collected in a single tick of
+    an event loop, with one future for each distinct call.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.futures = {}
+        self.calls = []
+
+
+def load(obj, batcher, args, kw):
+    """
+    Add a call to the supplied batched coroutine function to the calls
+    collected in the current tick of the event loop, returning an awaitable
+    for its result.
+    """
+    loop = get_event_loop()
+    tick = batcher.tick
+    if (tick is None or tick.loop is not loop or
+            len(tick.calls) >= batcher.max_size):
+        tick = batcher.tick = Tick(loop)
+        loop.create_task(dispatch(obj, batcher, tick))
+    key = flight_key(args, kw)
+    future = tick.futures.get(key)
+    if future is None:
+        future = tick.futures[key] = loop.create_future()
+        tick.calls.append((args, kw, future))
+    return shield(future)
+
+
+async def dispatch(obj, batcher, tick):
+    """
+    Await the supplied batched coroutine function for the calls collected in
+    the supplied tick, setting the result of each call's future.
+    """
+    if batcher.tick is tick:
+        batcher.tick = None
+    calls = [(args, kw) for args, kw, _ in tick.calls]
+    futures = [future for _, _, future in tick.calls]
+    results = [None] * len(calls)
+    try:
+        for indexes, args, kw in batcher.groups(calls):
+            batcher.distribute(obj, results, indexes, await obj(*args, **kw))
+    except Exception as e:
+        for future in futures:
+            if not future.done():
+                future.set_exception(e)
+    else:
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+
+def call(obj, args, kw):
+    """
+    Call the supplied callable, or an equivalent, returning either the
+    result or an awaitable for it.
+    """
+    if isinstance(obj, Traced):
+        if not skipping.get():
+            return traced(obj, args, kw)
+        obj = obj.__wrapped__
+    if isinstance(obj, Batched):
+        if iscoroutinefunction(obj.__wrapped__):
+            return load(obj.__wrapped__, obj.batcher, args, kw)
+        # wait for the batch without blocking the event loop:
+        return get_event_loop().run_in_executor(None, partial(obj, *args, **kw))
+    flights = getattr(obj, '__mush_single_flight__', None)
+    if flights is not None:
+        return single_flight(obj, flights, args, kw)
+    return obj(*args, **kw)
+
+
+async def traced(obj, args, kw):
+    """
+    Call the callable wrapped by the supplied :class:`~.tracing.Traced`,
+    awaiting its result if needed, calling the hooks of its tracer around
+    both.
+    """
+    tracer = obj.tracer
+    point = obj.point
+    tracer.point_start(point)
+    start = perf_counter()
+    try:
+        result = call(obj.__wrapped__, args, kw)
+        if isawaitable(result):
+            result = await result
+    except Exception as e:
+        tracer.point_end(point, start, perf_counter() - start, e)
+        raise
+    tracer.point_end(point, start, perf_counter() - start, None)
+    return result
+
+
+async def resolve_factories(context, requirements):
+    """
+    Call and, if needed, await the callable of any
+    :class:`~.factory.Factory` that is needed by the supplied
+    requirements, replacing the factory with the result in the context.
+    """
+    for requirement in requirements:
+        key = requirement.key
+        o = context.get(key)
+        if isinstance(o, Factory):
+            factory_requirements = [
+                Requirement(name, required)
+                for name, required in o.requires
+            ]
+            await resolve_factories(context, factory_requirements)
+            args, kw = arguments(factory_requirements, context)
+            o = call(o.__wrapped__, args, kw)
+            if isawaitable(o):
+                o = await o
+            context[key] = o
+
+
+async def run(plan, context, steps, result=None):
+    """
+    Execute the supplied steps of a :class:`~.plan.Plan` in the supplied
+    context, awaiting results and entering asynchronous context managers
+    as needed.
+    """
+    for step in steps:
+
+        try:
+            await resolve_factories(context, step.requirements)
+            args, kw = step.arguments(context)
+            if (context.process_executor is not None and
+                    isinstance(step, ProcessStep)):
+                result = wrap_future(step.submit(context, None, args, kw))
+            elif isinstance(step, FactoryStep):
+                result = step.call(args, kw)
+            else:
+                result = call(step.obj, args, kw)
+            if isawaitable(result):
+                result = await result
+            step.add(context, result)
+        except ContextError as e:
+            raise ContextError(str(e), step.point, context)
+
+        if step.releases:
+            release(context, step.releases)
+
+        if step.streams is not None:
+            return await run_each(plan, context, step, result, steps)
+
+        if getattr(result, '__aenter__', None):
+            result = await enter_async(plan, context, result, steps)
+        elif getattr(result, '__enter__', None):
+            result = await enter(plan, context, result, steps)
+
+    return result
+
+
+async def run_each(plan, context, step, items, steps):
+    """
+    Execute the remaining steps once for each of the supplied items, which
+    may be an asynchronous iterable, returning the result for the last item.
+    """
+    remaining = tuple(steps)
+    result = None
+    if getattr(items, '__aiter__', None):
+        async for item in items:
+            result = await run_item(plan, context, step, item, remaining)
+    else:
+        for item in items:
+            result = await run_item(plan, context, step, item, remaining)
+    return result
+
+
+async def run_item(plan, context, step, item, remaining):
+    return await run(plan, plan.child(context, step, item), iter(remaining))
+
+
+async def enter(plan, context, result, steps):
+    with plan.entered(context, result):
+        result = None
+        result = await run(plan, context, steps)
+    return result
+
+
+async def enter_async(plan, context, result, steps):
+    with span(plan.tracer, result):
+        async with result as manager:
+            if manager not in (None, result):
+                context.add(manager, manager.__class__)
+            result = None
+            result = await run(plan, context, steps)
+    return result
+
+
+class AsyncRunner(Runner):
+    """
+    A :class:`Runner` that must be awaited when called.
+
+    Results that are awaitable, such as those returned by coroutine functions,
+    are awaited before being added to the context. Results that are
+    asynchronous context managers are entered in the same way as
+    context managers, with the remaining callables being called within them.
+    Lazy callables may also be coroutine functions.
+    Callables declared using :class:`~.declarations.batched` are called in
+    the event loop's default executor so that concurrent runs can be
+    batched together, unless they are coroutine functions, in which case
+    the calls made in each tick of the event loop are combined.
+    Calls to callables declared using
+    :func:`~.declarations.single_flight` share the result of any call with
+    equal parameters that is still being awaited.
+    Callables with a :class:`~.declarations.scope` are not supported.
+    """
+
+    async def __call__(self, context=None, process_executor=None,
+                       resources=None):
+        """
+        Execute the callables in this runner as described in
+        :meth:`Runner.__call__`, awaiting where required.
+        Callables declared to run in ``'process'`` are awaited without
+        blocking the event loop.
+        """
+        plan = self.compile()
+        if plan.scoped:
+            raise TypeError('scoped callables are not supported by AsyncRunner')
+        if context is None:
+            context = Context()
+        if resources:
+            for key, resource in resources.items():
+                context.add(resource, key)
+        if process_executor is not None:
+            context.process_executor = process_executor
+        if self.validate_on_call and plan.validation is None:
+            plan.validation = validate(plan, context)
+        tracer = plan.tracer
+        if tracer is None:
+            return await run(plan, context, iter(plan.steps))
+        token = skipping.set(tracer.run_start(context) is False)
+        start = perf_counter()
+        try:
+            result = await run(plan, context, iter(plan.steps))
+        except Exception as e:
+            tracer.run_end(context, start, perf_counter() - start, e)
+            raise
+        else:
+            tracer.run_end(context, start, perf_counter() - start, None)
+        finally:
+            skipping.reset(token)
+        return result
+
+    def generate(self):
+        """
+        Not supported for asynchronous runners.
+        """
+        raise TypeError('generated functions are not supported by AsyncRunner')
+
+    def source(self):
+        """
+        Not supported for asynchronous runners.
+        """
+        raise TypeError('generated functions are not supported by AsyncRunner')
+
+    def stream(self, *args, **kw):
+        """
+        Not supported for asynchronous runners.
+        """
+        raise TypeError('stream() is not supported by AsyncRunner')
+
+    def pipeline(self, *args, **kw):
+        """
+        Not supported for asynchronous runners.
+        """
+        raise TypeError('pipeline() is not supported by AsyncRunner')
+
+    def map(self, *args, **kw):
+        """
+        Not supported for asynchronous runners.
+        """
+        raise TypeError('map() is not supported by AsyncRunner')
+
+    def batch(self):
+        """
+        Not supported for asynchronous runners.
+        """
+        raise TypeError('batch() is not supported by AsyncRunner')
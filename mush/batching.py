@@ -0,0 +1,168 @@
+"""
+.. currentmodule:: mush
+
+Combining the calls made to a callable declared using
+:class:`~.declarations.batched` by concurrent runs into a single call.
+"""
+from collections import OrderedDict
+from threading import Event, Lock
+
+
+class Pending(object):
+    """
+    The calls collected for a single call to a batched callable.
+    """
+
+    results = None
+    error = None
+
+    def __init__(self):
+        self.calls = []
+        self.full = Event()
+        self.done = Event()
+
+
+class Batcher(object):
+    """
+    Collects the calls made to a batched callable, from any thread, into
+    batches. The first call in a batch waits for up to ``max_wait`` seconds,
+    or until ``max_size`` calls have been collected, before calling the
+    callable on behalf of all of them.
+
+    :param max_size: The maximum number of calls in each batch.
+
+    :param max_wait: The maximum number of seconds to wait for further calls
+                     before a batch is called.
+    """
+
+    #: The number of times the batched callable has been called.
+    batches = 0
+
+    #: The number of calls that have been included in those batches.
+    calls = 0
+
+    #: The calls collected in the current tick of an event loop, when the
+    #: batched callable is a coroutine function called by an
+    #: :class:`~.asyncio.AsyncRunner`.
+    tick = None
+
+    def __init__(self, max_size=100, max_wait=0.01):
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.lock = Lock()
+        self.pending = None
+
+    def call(self, obj, args, kw):
+        """
+        Add a call with the supplied arguments and keyword parameters to the
+        current batch, returning the result for that call once the batch
+        has been called.
+        """
+        with self.lock:
+            pending = self.pending
+            leader = pending is None
+            if leader:
+                pending = self.pending = Pending()
+            index = len(pending.calls)
+            pending.calls.append((args, kw))
+            if len(pending.calls) >= self.max_size:
+                self.pending = None
+                pending.full.set()
+
+        if leader:
+            pending.full.wait(self.max_wait)
+            with self.lock:
+                if self.pending is pending:
+                    self.pending = None
+            try:
+                pending.results = self.execute(obj, pending.calls)
+            except Exception as e:
+                pending.error = e
+            pending.done.set()
+        else:
+            pending.done.wait()
+
+        if pending.error is not None:
+            raise pending.error
+        return pending.results[index]
+
+    def groups(self, calls):
+        """
+        Yield the indexes of each group of the supplied calls that pass the
+        same arguments and keyword parameters, along with the arguments and
+        keyword parameters with which the batched callable should be called
+        for that group. Each of these is a list of the values passed by the
+        calls in the group.
+        """
+        groups = OrderedDict()
+        for index, (args, kw) in enumerate(calls):
+            shape = len(args), tuple(sorted(kw))
+            groups.setdefault(shape, []).append(index)
+
+        for (count, names), indexes in groups.items():
+            batch_args = [[calls[index][0][position] for index in indexes]
+                          for position in range(count)]
+            batch_kw = dict((name, [calls[index][1][name] for index in indexes])
+                            for name in names)
+            yield indexes, batch_args, batch_kw
+
+    def distribute(self, obj, results, indexes, batch_results):
+        """
+        Store the results returned by a call to the supplied callable for the
+        calls with the supplied indexes.
+        """
+        batch_results = list(batch_results)
+        if len(batch_results) != len(indexes):
+            raise ValueError('%r returned %i results for %i calls' % (
+                obj, len(batch_results), len(indexes)
+            ))
+        for index, result in zip(indexes, batch_results):
+            results[index] = result
+        with self.lock:
+            self.batches += 1
+            self.calls += len(indexes)
+
+    def execute(self, obj, calls):
+        """
+        Call the supplied callable once for each of the :meth:`groups` of the
+        supplied calls and return a list of results in the order of the
+        calls.
+        """
+        results = [None] * len(calls)
+        for indexes, args, kw in self.groups(calls):
+            self.distribute(obj, results, indexes, obj(*args, **kw))
+        return results
+
+    def __repr__(self):
+        return '<Batcher: max_size=%i, max_wait=%r, batches=%i, calls=%i>' % (
+            self.max_size, self.max_wait, self.batches, self.calls
+        )
+
+
+class Batched(object):
+    """
+    A callable that adds each call to the current batch of calls to the
+    wrapped callable.
+    """
+
+    def __init__(self, obj, batcher):
+        self.__wrapped__ = obj
+        self.batcher = batcher
+
+    def __call__(self, *args, **kw):
+        return self.batcher.call(self.__wrapped__, args, kw)
+
+    def __repr__(self):
+        return repr(self.__wrapped__)
+
+
+def batching(obj):
+    """
+    Return a :class:`Batched` for the supplied callable if it has been
+    declared using :class:`~.declarations.batched`, otherwise return the
+    callable unchanged.
+    """
+    batcher = getattr(obj, '__mush_batched__', None)
+    if batcher is None:
+        return obj
+    return Batched(obj, batcher)
@@ -1,27 +1,64 @@
-from .declarations import result_type, nothing, extract_declarations
+from .declarations import (
+    result_type, nothing, extract_declarations, intern_declaration,
+    runs_in as runs_in_declaration, scope as scope_declaration
+)
+from .batching import batching
 from .factory import Factory
+from .memo import memoized
+
+
+#: The labels of a callpoint that has none, shared by all such callpoints.
+no_labels = frozenset()
 
 
 class CallPoint(object):
 
-    next = None
-    previous = None
-    requires = nothing
-    returns = result_type
+    __slots__ = ('obj', 'requires', 'returns', 'runs_in', 'scope',
+                 'labels', 'added_using', 'next', 'previous', '__weakref__')
 
-    def __init__(self, obj, requires=None, returns=None, lazy=None):
+    def __init__(self, obj, requires=None, returns=None, lazy=None,
+                 runs_in=None, scope=None):
         requires, returns = extract_declarations(obj, requires, returns)
         lazy = lazy or getattr(obj, '__mush_lazy__', False)
-        requires = requires or nothing
-        returns = returns or result_type
+        runs_in = runs_in or getattr(obj, '__mush_runs_in__', None)
+        scope = scope or getattr(obj, '__mush_scope__', None)
+        requires = intern_declaration(requires or nothing)
+        returns = intern_declaration(returns or result_type)
+        self.next = self.previous = self.runs_in = self.scope = None
+        if getattr(obj, '__mush_batched__', None) is not None:
+            if getattr(obj, '__mush_memoize__', None) is not None:
+                raise TypeError('memoized callables cannot be batched')
+            if runs_in is not None:
+                raise TypeError('batched callables cannot be run in %r' % (
+                    runs_in,
+                ))
+        if runs_in is not None:
+            if lazy:
+                raise TypeError('lazy callables cannot be run in %r' % (
+                    runs_in,
+                ))
+            if getattr(obj, '__mush_memoize__', None) is not None:
+                raise TypeError('memoized callables cannot be run in %r' % (
+                    runs_in,
+                ))
+            self.runs_in = runs_in_declaration(runs_in).place
+        if scope is not None and scope_declaration(scope).name != 'run':
+            if self.runs_in is not None:
+                raise TypeError('callables scoped to %r cannot be run in %r' % (
+                    scope, self.runs_in
+                ))
+            self.scope = scope
         if lazy:
-            obj = Factory(obj, requires, returns)
+            obj = Factory(batching(memoized(obj)), requires, returns)
             requires = returns = nothing
         self.obj = obj
         self.requires = requires
         self.returns = returns
-        self.labels = set()
-        self.added_using = set()
+        #: The labels of this callpoint, which are replaced rather than
+        #: modified so that callpoints can share them.
+        self.labels = no_labels
+        #: The labels that were used to add this callpoint.
+        self.added_using = no_labels
 
     def __call__(self, context):
         return context.extract(self.obj, self.requires, self.returns)
@@ -0,0 +1,338 @@
+"""
+.. currentmodule:: mush
+
+Generation of a single Python function that does the same work as a
+:class:`~.plan.Plan`.
+"""
+import linecache
+import re
+from functools import partial
+from itertools import count
+from keyword import iskeyword
+from weakref import ref
+
+from .context import Context, ContextError
+from .declarations import attr, item, nothing, optional, how
+from .factory import Factory
+from .markers import missing
+from .plan import (
+    AddAs, Cursor, FactoryStep, Step, add_by_type, add_nothing, release,
+    resolve, is_context_manager_class
+)
+from .tracing import trace_run
+
+identifier = re.compile('[A-Za-z_][A-Za-z0-9_]*$')
+generated_count = count()
+# weak references to generated functions, keyed by the filename of their
+# source in the linecache, used to remove the source when they are
+# discarded:
+generated_refs = {}
+
+
+def is_identifier(name):
+    return (isinstance(name, str) and
+            identifier.match(name) is not None and
+            not iskeyword(name))
+
+
+def call_without_nothing(obj, args, kw):
+    """
+    Call ``obj`` omitting any arguments or keyword parameters that
+    are :data:`~mush.declarations.nothing`.
+    """
+    return obj(*[a for a in args if a is not nothing],
+               **dict((k, v) for k, v in kw.items() if v is not nothing))
+
+
+def hows_for(required):
+    hows = []
+    while isinstance(required, how):
+        hows.append(required)
+        required = required.type
+    hows.reverse()
+    return hows
+
+
+class Source(object):
+    """
+    Python source code, along with the namespace in which it should
+    be executed, for the steps of a :class:`~.plan.Plan`.
+    """
+
+    def __init__(self, plan):
+        self.lines = []
+        self.namespace = dict(
+            Context=Context,
+            ContextError=ContextError,
+            Cursor=Cursor,
+            Factory=Factory,
+            call_without_nothing=call_without_nothing,
+            missing=missing,
+            nothing=nothing,
+            release=release,
+            resolve=resolve,
+            steps=plan.steps,
+            plan_run=plan.run,
+            plan_enter=plan.enter,
+            plan_run_each=plan.run_each,
+        )
+        self.keys = {}
+        self.locals = {}
+        self.scopes = []
+
+        self.line(0, 'def run(context=None):')
+        self.line(1, 'if context is None:')
+        self.line(2, 'context = Context()')
+        self.line(1, 'context_add = context.add')
+        self.line(1, 'context_get = context.get')
+        self.line(1, 'result = None')
+        indent = 1
+        for index, step in enumerate(plan.steps):
+            indent = self.step(indent, index, step)
+            if step.streams is not None:
+                # the remaining steps are executed for each item:
+                break
+        for indent, finished in reversed(self.scopes):
+            self.line(indent + 1, finished + ' = True')
+            self.line(indent, 'if not %s:' % finished)
+            self.line(indent + 1, 'result = plan_run(context, cursor)')
+        self.line(1, 'return result')
+
+    @property
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+    def line(self, indent, text):
+        self.lines.append('    ' * indent + text)
+
+    def bind(self, prefix, index, obj):
+        name = '%s_%i' % (prefix, index)
+        self.namespace[name] = obj
+        return name
+
+    def key(self, key):
+        name = self.keys.get(key)
+        if name is None:
+            name = self.keys[key] = self.bind('key', len(self.keys), key)
+        return name
+
+    def constant(self, obj):
+        if type(obj) in (str, int):
+            return repr(obj)
+        return self.bind('constant', len(self.namespace), obj)
+
+    def step(self, indent, index, step):
+        self.line(indent, '# ' + repr(step.point).replace('\n', ' '))
+        if self.scopes:
+            self.line(indent, 'cursor.index = %i' % (index + 1))
+
+        self.line(indent, 'try:')
+        temporaries = ()
+        if type(step) is FactoryStep:
+            self.line(indent + 1, 'context_add(%s, %s)' % (
+                self.bind('factory', index, step.obj), self.key(step.key)
+            ))
+        elif type(step) is Step:
+            temporaries = self.call(indent + 1, index, step)
+            self.returns(indent + 1, index, step)
+        else:
+            self.line(indent + 1, 'result = %s(context)' % (
+                self.bind('step', index, step)
+            ))
+        self.line(indent, 'except ContextError as e:')
+        self.line(indent + 1, 'raise ContextError(str(e), %s, context)' % (
+            self.bind('point', index, step.point)
+        ))
+
+        if step.releases:
+            self.release(indent, index, step, temporaries)
+
+        if type(step) is FactoryStep:
+            self.line(indent, 'result = None')
+        elif step.streams is not None:
+            if not self.scopes:
+                self.line(indent, 'cursor = Cursor(steps, %i)' % (index + 1))
+            self.line(indent, 'return plan_run_each(context, %s, result, '
+                              'cursor)' % self.bind('step', index, step))
+        elif is_context_manager_class(step.obj) and step.scope is None:
+            if not self.scopes:
+                self.line(indent, 'cursor = Cursor(steps, %i)' % (index + 1))
+            finished = 'finished_%i' % index
+            self.scopes.append((indent, finished))
+            self.line(indent, finished + ' = False')
+            self.line(indent, 'with result as manager:')
+            indent += 1
+            self.line(indent, 'if manager not in (None, result):')
+            self.line(indent + 1, 'context_add(manager, manager.__class__)')
+            self.line(indent, 'result = None')
+        else:
+            self.line(indent, "if getattr(result, '__enter__', None):")
+            if not self.scopes:
+                self.line(indent + 1,
+                          'cursor = Cursor(steps, %i)' % (index + 1))
+            self.line(indent + 1, 'return plan_run('
+                                  'context, cursor, '
+                                  'plan_enter(context, result, cursor))')
+        return indent
+
+    def requirement(self, indent, requirement, name):
+        local = self.locals.get(requirement.key)
+        hows = hows_for(requirement.required)
+
+        if local is not None:
+            if not hows:
+                return local
+            self.line(indent, '%s = %s' % (name, local))
+        else:
+            key = self.key(requirement.key)
+            self.line(indent, '%s = context_get(%s, missing)' % (name, key))
+            self.line(indent, 'if isinstance(%s, Factory):' % name)
+            self.line(indent + 1, '%s = resolve(context, %s, %s)' % (
+                name, key, name
+            ))
+
+        level = indent
+        for position, how_ in enumerate(hows):
+            if position:
+                self.line(level, 'if %s is not nothing:' % name)
+                level += 1
+            how_type = type(how_)
+            if how_type is optional:
+                self.line(level, 'if %s is missing:' % name)
+                self.line(level + 1, '%s = nothing' % name)
+            elif how_type in (attr, item):
+                expression = name
+                for part in how_.names:
+                    if how_type is item:
+                        expression += '[%s]' % self.constant(part)
+                    elif is_identifier(part):
+                        expression += '.' + part
+                    else:
+                        expression = 'getattr(%s, %s)' % (
+                            expression, self.constant(part)
+                        )
+                self.line(level, 'if %s is not missing:' % name)
+                self.line(level + 1, 'try:')
+                self.line(level + 2, '%s = %s' % (name, expression))
+                self.line(level + 1, 'except %s:' % (
+                    'KeyError' if how_type is item else 'AttributeError'
+                ))
+                self.line(level + 2, '%s = missing' % name)
+            else:
+                self.line(level, '%s = %s(%s)' % (
+                    name, self.constant(how_.process), name
+                ))
+
+        if not (hows and type(hows[-1]) is optional):
+            self.line(indent, 'if %s is missing:' % name)
+            self.line(indent + 1, 'raise ContextError(%r)' % (
+                'No %s in context' % repr(requirement.required)
+            ))
+        return name
+
+    def call(self, indent, index, step):
+        obj = self.bind('obj', index, step.obj)
+        names = []
+        args = []
+        kw = []
+        for position, requirement in enumerate(step.requirements):
+            name = self.requirement(indent, requirement, 'a%i' % position)
+            names.append(name)
+            if requirement.name is None:
+                args.append(name)
+            else:
+                kw.append((requirement.name, name))
+
+        parameters = list(args)
+        extra = []
+        for key, name in kw:
+            if is_identifier(key):
+                parameters.append('%s=%s' % (key, name))
+            else:
+                extra.append('%r: %s' % (key, name))
+        if extra:
+            parameters.append('**{%s}' % ', '.join(extra))
+        direct = 'result = %s(%s)' % (obj, ', '.join(parameters))
+
+        if names:
+            self.line(indent, 'if %s:' % ' or '.join(
+                '%s is nothing' % name for name in names
+            ))
+            self.line(indent + 1, 'result = call_without_nothing(%s, %s, %s)' % (
+                obj,
+                '(%s%s)' % (', '.join(args), ',' if len(args) == 1 else ''),
+                '{%s}' % ', '.join('%r: %s' % pair for pair in kw)
+            ))
+            self.line(indent, 'else:')
+            self.line(indent + 1, direct)
+        else:
+            self.line(indent, direct)
+        return tuple(name for name in names if name.startswith('a'))
+
+    def release(self, indent, index, step, temporaries):
+        self.line(indent, 'release(context, %s)' % (
+            self.bind('releases', index, step.releases)
+        ))
+        names = list(temporaries)
+        for key in step.releases:
+            name = self.locals.pop(key, None)
+            if name is not None:
+                names.append(name)
+        if names:
+            self.line(indent, 'del ' + ', '.join(names))
+
+    def returns(self, indent, index, step):
+        handler = step.add
+        if handler is add_nothing:
+            pass
+        elif handler is add_by_type:
+            self.line(indent, 'if result is not None:')
+            self.line(indent + 1, 'context_add(result, result.__class__)')
+        elif type(handler) is AddAs:
+            self.line(indent, 'context_add(result, %s)' % self.key(handler.key))
+            if handler.key not in self.locals:
+                name = self.locals[handler.key] = 'r%i' % index
+                self.line(indent, name + ' = result')
+        else:
+            self.line(indent, '%s(context, result)' % (
+                self.bind('add', index, handler)
+            ))
+
+
+def forget_source(filename, ref):
+    generated_refs.pop(filename, None)
+    linecache.cache.pop(filename, None)
+
+
+def traced_run(tracer, run):
+    """
+    Wrap a generated function so that the run hooks of the supplied
+    tracer are called around each call of it.
+    """
+    def traced(context=None):
+        if context is None:
+            context = Context()
+        return trace_run(tracer, context, run, context)
+    return traced
+
+
+def generate(plan):
+    """
+    Return a function that executes the steps in the supplied
+    :class:`~.plan.Plan`. The function takes an optional
+    :class:`~.context.Context` and the source code of the function
+    is available in its ``source`` attribute.
+    """
+    source = Source(plan)
+    text = source.text
+    filename = '<mush generated %i>' % next(generated_count)
+    linecache.cache[filename] = (
+        len(text), None, text.splitlines(True), filename
+    )
+    exec(compile(text, filename, 'exec'), source.namespace)
+    function = source.namespace['run']
+    if plan.tracer is not None:
+        function = traced_run(plan.tracer, function)
+    function.source = text
+    generated_refs[filename] = ref(function, partial(forget_source, filename))
+    return function
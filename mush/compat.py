@@ -6,8 +6,13 @@ from .markers import Marker
 
 if sys.version_info[:2] < (3, 0):
     PY2 = True
+    from Queue import Empty, Full, Queue
     from functools import partial
     from inspect import getargspec, ismethod, isclass, isfunction
+    from time import time as monotonic, time as perf_counter
+
+    def iscoroutinefunction(obj):
+        return False
 
     class Parameter(object):
         POSITIONAL_ONLY = Marker('POSITIONAL_ONLY')
@@ -65,6 +70,8 @@ if sys.version_info[:2] < (3, 0):
 
 else:
     PY2 = False
-    from inspect import signature
+    from inspect import iscoroutinefunction, signature
+    from queue import Empty, Full, Queue
+    from time import monotonic, perf_counter
 
 NoneType = type(None)
@@ -61,6 +61,15 @@ def type_key(type_tuple):
 class Context(dict):
     "Stores resources for a particular run."
 
+    #: The :class:`~concurrent.futures.Executor` used to call callables
+    #: declared to run in ``'process'``, if any.
+    process_executor = None
+
+    #: A mapping of scope name to the :class:`~.plan.Scope` in which
+    #: callables with that :class:`~.declarations.scope` keep their
+    #: resources. If ``None``, all callables are called in every run.
+    scopes = None
+
     def add(self, it, type):
         """
         Add a resource to the context.
@@ -77,6 +86,14 @@ class Context(dict):
                     ))
         self[type] = it
 
+    def copy(self):
+        """
+        Return a new context containing the same resources as this one.
+        """
+        context = Context(self)
+        context.__dict__.update(self.__dict__)
+        return context
+
     def __repr__(self):
         bits = []
         for type, value in sorted(self.items(), key=type_key):
@@ -128,3 +145,160 @@ class Context(dict):
                 kw[name] = o
 
         return obj(*args, **kw)
+
+
+class SlotContext(Context):
+    """
+    A :class:`Context` in which resources whose keys are known in advance
+    are stored in a list, at the index of the slot allocated to each key,
+    rather than in the dictionary itself.
+
+    The dictionary API behaves as it does for :class:`Context`, with the
+    exception of any C-level access to the underlying dictionary, such as
+    passing the context to :class:`dict`, which will only see resources
+    whose keys have not been allocated slots.
+
+    :param slots: A mapping of resource key to slot index.
+    """
+
+    def __init__(self, slots):
+        super(SlotContext, self).__init__()
+        self.slots = slots
+        self.slotted = [missing] * len(slots)
+
+    def add(self, it, type):
+        slot = self.slots.get(type)
+        if slot is None:
+            return super(SlotContext, self).add(it, type)
+        if self.slotted[slot] is not missing:
+            raise ContextError('Context already contains %r' % (
+                    type
+                    ))
+        self.slotted[slot] = it
+
+    def copy(self):
+        context = SlotContext(self.slots)
+        dict.update(context, dict.items(self))
+        context.__dict__.update(self.__dict__)
+        context.slotted = list(self.slotted)
+        return context
+
+    def __reduce__(self):
+        # the default for dictionaries would add the unslotted resources
+        # before the slots are restored, and the missing marker would not
+        # survive being pickled:
+        attributes = dict(self.__dict__)
+        del attributes['slots'], attributes['slotted']
+        slotted = [(slot, o) for slot, o in enumerate(self.slotted)
+                   if o is not missing]
+        return (SlotContext, (self.slots,),
+                (attributes, slotted, list(dict.items(self))))
+
+    def __setstate__(self, state):
+        attributes, slotted, items = state
+        self.__dict__.update(attributes)
+        for slot, o in slotted:
+            self.slotted[slot] = o
+        dict.update(self, items)
+
+    def get(self, key, default=None):
+        slot = self.slots.get(key)
+        if slot is None:
+            return super(SlotContext, self).get(key, default)
+        o = self.slotted[slot]
+        if o is missing:
+            return default
+        return o
+
+    def __getitem__(self, key):
+        o = self.get(key, missing)
+        if o is missing:
+            raise KeyError(key)
+        return o
+
+    def __setitem__(self, key, value):
+        slot = self.slots.get(key)
+        if slot is None:
+            super(SlotContext, self).__setitem__(key, value)
+        else:
+            self.slotted[slot] = value
+
+    def __delitem__(self, key):
+        slot = self.slots.get(key)
+        if slot is None:
+            super(SlotContext, self).__delitem__(key)
+        elif self.slotted[slot] is missing:
+            raise KeyError(key)
+        else:
+            self.slotted[slot] = missing
+
+    def __contains__(self, key):
+        return self.get(key, missing) is not missing
+
+    def setdefault(self, key, default=None):
+        o = self.get(key, missing)
+        if o is missing:
+            self[key] = o = default
+        return o
+
+    def pop(self, key, default=missing):
+        o = self.get(key, missing)
+        if o is missing:
+            if default is missing:
+                raise KeyError(key)
+            return default
+        del self[key]
+        return o
+
+    def popitem(self):
+        for key, slot in self.slots.items():
+            o = self.slotted[slot]
+            if o is not missing:
+                self.slotted[slot] = missing
+                return key, o
+        return super(SlotContext, self).popitem()
+
+    def update(self, *args, **kw):
+        if len(args) > 1:
+            raise TypeError(
+                'update expected at most 1 argument, got %i' % len(args)
+            )
+        if args:
+            other = args[0]
+            if hasattr(other, 'keys'):
+                other = [(key, other[key]) for key in other.keys()]
+            for key, value in other:
+                self[key] = value
+        for key, value in kw.items():
+            self[key] = value
+
+    def clear(self):
+        self.slotted = [missing] * len(self.slots)
+        super(SlotContext, self).clear()
+
+    def items(self):
+        items = [(key, self.slotted[slot])
+                 for key, slot in self.slots.items()
+                 if self.slotted[slot] is not missing]
+        items.extend(super(SlotContext, self).items())
+        return items
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.items())
+
+    def __eq__(self, other):
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
@@ -4,16 +4,34 @@ from functools import (
     WRAPPER_UPDATES,
     WRAPPER_ASSIGNMENTS as FUNCTOOLS_ASSIGNMENTS
 )
+from functools import partial
 from inspect import isclass, isfunction
-from .compat import NoneType, signature
+from weakref import WeakValueDictionary, ref
+from .compat import NoneType, iscoroutinefunction, signature
+from .batching import Batcher
 from .markers import missing, not_specified
+from .memo import Cache
 
 
 def name_or_repr(obj):
     return getattr(obj, '__name__', None) or repr(obj)
 
 
-class requires(object):
+#: The keyword parameters of :class:`requires` declarations that have none,
+#: shared between them so must never be modified.
+no_kw = {}
+
+
+class Declaration(object):
+    """
+    The base class for :class:`requires` and :class:`ReturnsType`, which
+    provides the storage for the types and names a declaration is made from.
+    """
+
+    __slots__ = ('args', '__weakref__')
+
+
+class requires(Declaration):
     """
     Represents requirements for a particular callable.
 
@@ -25,11 +43,13 @@ class requires(object):
     returning those resources is configured to return the named resource.
     """
 
+    __slots__ = ('kw',)
+
     def __init__(self, *args, **kw):
         check_type(*args)
         check_type(*kw.values())
         self.args = args
-        self.kw = kw
+        self.kw = kw or no_kw
 
     def __iter__(self):
         """
@@ -59,7 +79,9 @@ class requires(object):
         return obj
 
 
-class ReturnsType(object):
+class ReturnsType(Declaration):
+
+    __slots__ = ()
 
     def __call__(self, obj):
         obj.__mush_returns__ = self
@@ -77,6 +99,8 @@ class returns_result_type(ReturnsType):
     ``None`` is ignored as a return value.
     """
 
+    __slots__ = ()
+
     def process(self, obj):
         if obj is not None:
             yield obj.__class__, obj
@@ -88,6 +112,8 @@ class returns_mapping(ReturnsType):
     to resource.
     """
 
+    __slots__ = ()
+
     def process(self, mapping):
         return mapping.items()
 
@@ -100,6 +126,8 @@ class returns_sequence(returns_result_type):
     Any ``None`` values in the sequence are ignored.
     """
 
+    __slots__ = ()
+
     def process(self, sequence):
         super_process = super(returns_sequence, self).process
         for obj in sequence:
@@ -118,6 +146,8 @@ class returns(returns_result_type):
     type overridden.
     """
 
+    __slots__ = ()
+
     def __init__(self, *args):
         check_type(*args)
         self.args = args
@@ -134,6 +164,27 @@ class returns(returns_result_type):
         return self.__class__.__name__ + '(' + args_repr + ')'
 
 
+class streams(ReturnsType):
+    """
+    Declaration that indicates a callable returns an iterable, such as a
+    generator, and that the callables after it should be called once for
+    each item it yields. Each item is added, with the supplied type or name,
+    to a copy of the context containing the resources added so far.
+    """
+
+    __slots__ = ('type',)
+
+    def __init__(self, type):
+        check_type(type)
+        self.type = type
+
+    def process(self, iterable):
+        return ()
+
+    def __repr__(self):
+        return 'streams(%s)' % name_or_repr(self.type)
+
+
 def lazy(obj):
     """
     Declaration that specifies the callable should only be called the first time
@@ -143,6 +194,155 @@ def lazy(obj):
     return obj
 
 
+class memoize(object):
+    """
+    Declaration that specifies the results of calling the callable may be
+    re-used, across calls to any runner, whenever it is called with the
+    same resources. This should only be used for callables that always
+    return the same result for the same parameters and that have no
+    side effects.
+
+    The results are kept in a :class:`~mush.memo.Cache` that is available
+    as the ``__mush_memoize__`` attribute of the decorated callable.
+
+    :param max_size: The maximum number of results to keep. Once this is
+                     reached, the least recently used result is discarded.
+
+    :param ttl: If specified, the number of seconds after which a result
+                will no longer be used.
+    """
+
+    def __init__(self, max_size=128, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+
+    def __call__(self, obj):
+        if iscoroutinefunction(obj):
+            raise TypeError('coroutine functions cannot be memoized')
+        obj.__mush_memoize__ = Cache(self.max_size, self.ttl)
+        return obj
+
+    def __repr__(self):
+        return 'memoize(max_size=%r, ttl=%r)' % (self.max_size, self.ttl)
+
+
+class batched(object):
+    """
+    Declaration that specifies the calls made to the callable by runs taking
+    place concurrently in different threads should be combined into a single
+    call. The callable is passed a list of values for each of its parameters,
+    one value for each run, and must return a sequence containing one result
+    for each run, in the same order.
+
+    The calls are collected by a :class:`~mush.batching.Batcher` that is
+    available as the ``__mush_batched__`` attribute of the decorated callable.
+
+    If the callable is a coroutine function, it can only be used with an
+    :class:`~mush.asyncio.AsyncRunner` and the calls made in the same tick of
+    the event loop are combined, with calls passing equal parameters only
+    being included once.
+
+    :param max_size: The maximum number of calls to combine.
+
+    :param max_wait: The maximum number of seconds the first call in a batch
+                     will wait for further calls. Not used for coroutine
+                     functions.
+    """
+
+    def __init__(self, max_size=100, max_wait=0.01):
+        self.max_size = max_size
+        self.max_wait = max_wait
+
+    def __call__(self, obj):
+        obj.__mush_batched__ = Batcher(self.max_size, self.max_wait)
+        return obj
+
+    def __repr__(self):
+        return 'batched(max_size=%r, max_wait=%r)' % (
+            self.max_size, self.max_wait
+        )
+
+
+def single_flight(obj):
+    """
+    Declaration that specifies that, when called by an
+    :class:`~mush.asyncio.AsyncRunner`, calls to the callable with equal
+    parameters made while an earlier call is still being awaited should
+    share the result of that call rather than calling the callable again.
+    This is ignored by :class:`~mush.Runner`.
+
+    The calls in flight are kept in a dictionary that is available as the
+    ``__mush_single_flight__`` attribute of the decorated callable.
+    """
+    obj.__mush_single_flight__ = {}
+    return obj
+
+
+def side_effects(obj):
+    """
+    Declaration that specifies the callable has side effects and so should
+    be kept when a runner is reduced using :meth:`~mush.Runner.slice`, even if
+    none of its resources are needed.
+    """
+    obj.__mush_side_effects__ = True
+    return obj
+
+
+class runs_in(object):
+    """
+    Declaration that specifies where the callable should be called.
+
+    The only place currently supported is ``'process'``, which means the
+    callable will be called in another process when the runner is called
+    with a ``process_executor``. The callable, along with its parameters and
+    return value, must be able to be pickled.
+    """
+
+    places = ('process',)
+
+    def __init__(self, place):
+        if place not in self.places:
+            raise ValueError('%r is not a place callables can run in' % (
+                place,
+            ))
+        self.place = place
+
+    def __call__(self, obj):
+        obj.__mush_runs_in__ = self.place
+        return obj
+
+    def __repr__(self):
+        return 'runs_in(%r)' % self.place
+
+
+class scope(object):
+    """
+    Declaration that specifies how long the resources returned by the
+    callable should be kept.
+
+    ``'run'``, the default, means the callable is called every time the
+    runner is called. ``'batch'`` means it is called once for each batch of
+    calls made using :meth:`~mush.Runner.batch`, while ``'process'`` means
+    it is called once until :meth:`~mush.Runner.close` is called.
+    Context managers are exited when their scope ends rather than at the end
+    of each call.
+    """
+
+    names = ('run', 'batch', 'process')
+
+    def __init__(self, name):
+        if name not in self.names:
+            raise ValueError('%r is not a scope' % (name,))
+        self.name = name
+
+    def __call__(self, obj):
+        obj.__mush_scope__ = self.name
+        return obj
+
+    def __repr__(self):
+        return 'scope(%r)' % self.name
+
+
 class how(object):
     """
     The base class for type decorators that indicate which part of a
@@ -242,6 +442,8 @@ def check_type(*objs):
 
 class Nothing(requires, returns):
 
+    __slots__ = ()
+
     def process(self, result):
         return ()
 
@@ -255,6 +457,53 @@ nothing = Nothing()
 result_type = returns_result_type()
 
 
+#: The declarations returned by :func:`intern_declaration`, keyed by what
+#: they are made from, for as long as they are in use.
+interned_declarations = WeakValueDictionary()
+
+
+def type_key(type):
+    if type.__class__ in (optional, attr, item):
+        return (type.__class__, type_key(type.type), type.names)
+    if isinstance(type, how):
+        # other hows may have state that cannot be compared:
+        return how, id(type)
+    return type
+
+
+def declaration_key(declaration):
+    declaration_type = type(declaration)
+    if declaration_type is requires:
+        return (declaration_type,
+                tuple(type_key(arg) for arg in declaration.args),
+                tuple(sorted((name, type_key(type))
+                             for name, type in declaration.kw.items())))
+    if declaration_type is returns:
+        return (declaration_type,
+                tuple(type_key(arg) for arg in declaration.args))
+    if declaration_type is streams:
+        return declaration_type, type_key(declaration.type)
+    if declaration_type in (returns_result_type, returns_mapping,
+                            returns_sequence):
+        return declaration_type,
+
+
+def intern_declaration(declaration):
+    """
+    Return a declaration equal to the supplied one, re-using any equal
+    declaration already in use so that many callpoints can share it.
+    Declarations of types that cannot be compared are returned unchanged.
+    """
+    key = declaration_key(declaration)
+    if key is None:
+        return declaration
+    try:
+        return interned_declarations.setdefault(key, declaration)
+    except TypeError:
+        # types or names that cannot be hashed
+        return declaration
+
+
 def maybe_optional(p):
     value = p.name
     if p.default is not p.empty:
@@ -274,35 +523,121 @@ def guess_requirements(obj):
         return requires(*args, **kw)
 
 
-def extract_declarations(obj, explicit_requires, explicit_returns, guess=True):
+def convert_requires(requires_):
+    if isinstance(requires_, (requires, NoneType)):
+        return requires_
+    if isinstance(requires_, (list, tuple)):
+        return requires(*requires_)
+    if isinstance(requires_, dict):
+        return requires(**requires_)
+    return requires(requires_)
+
+
+def convert_returns(returns_):
+    if isinstance(returns_, (ReturnsType, NoneType)):
+        return returns_
+    if isinstance(returns_, (list, tuple)):
+        return returns(*returns_)
+    return returns(returns_)
+
+
+class Declarations(object):
+    """
+    The declarations made by decorating or annotating a callable, along with
+    what they were worked out from so that changes can be spotted.
+    Each declaration is only worked out the first time it is needed.
+    """
+
+    ref = None
+    converted_requires = converted_returns = guessed = not_specified
+
+    def __init__(self, mush_requires, mush_returns, annotations):
+        self.mush_requires = mush_requires
+        self.mush_returns = mush_returns
+        self.annotations = annotations
+
+    def current(self, obj, mush_requires, mush_returns, annotations):
+        return (self.ref() is obj and
+                self.mush_requires is mush_requires and
+                self.mush_returns is mush_returns and
+                self.annotations == annotations)
+
+    def requires(self):
+        if self.converted_requires is not_specified:
+            requires_ = self.mush_requires
+            if not requires_ and self.annotations:
+                requires_ = dict(self.annotations)
+                requires_.pop('return', None)
+            self.converted_requires = convert_requires(requires_ or None)
+        return self.converted_requires
+
+    def returns(self):
+        if self.converted_returns is not_specified:
+            returns_ = self.mush_returns
+            if not returns_ and self.annotations:
+                returns_ = self.annotations.get('return')
+            self.converted_returns = convert_returns(returns_)
+        return self.converted_returns
+
+    def guess(self, obj):
+        if self.guessed is not_specified:
+            self.guessed = guess_requirements(obj)
+        return self.guessed
+
+
+#: The :class:`Declarations` for callables, keyed by :func:`id`, for as long
+#: as those callables exist.
+declarations_cache = {}
+
+
+def forget_declarations(key, ref):
+    declarations = declarations_cache.get(key)
+    if declarations is not None and declarations.ref is ref:
+        del declarations_cache[key]
+
+
+def declarations_for(obj):
+    """
+    Return the :class:`Declarations` for the supplied callable, re-using
+    those previously worked out unless the callable's declarations or
+    annotations have changed since.
+    """
     mush_requires = getattr(obj, '__mush_requires__', None)
     mush_returns = getattr(obj, '__mush_returns__', None)
     annotations = getattr(obj, '__annotations__', None)
-    annotations = {} if annotations is None else annotations.copy()
-    annotation_returns = annotations.pop('return', None)
-    annotation_requires = annotations or None
+    key = id(obj)
+    declarations = declarations_cache.get(key)
+    if declarations is not None and declarations.current(
+        obj, mush_requires, mush_returns, annotations
+    ):
+        return declarations
+    if annotations is not None:
+        annotations = dict(annotations)
+    declarations = Declarations(mush_requires, mush_returns, annotations)
+    try:
+        declarations.ref = ref(obj, partial(forget_declarations, key))
+    except TypeError:
+        # not all callables can be weakly referenced
+        pass
+    else:
+        declarations_cache[key] = declarations
+    return declarations
 
-    requires_ = explicit_requires or mush_requires or annotation_requires
-    returns_ = explicit_returns or mush_returns or annotation_returns
 
-    if isinstance(requires_, requires):
-        pass
-    elif isinstance(requires_, NoneType):
-        if guess:
-            requires_ = guess_requirements(obj)
-    elif isinstance(requires_, (list, tuple)):
-        requires_ = requires(*requires_)
-    elif isinstance(requires_, dict):
-        requires_ = requires(**requires_)
+def extract_declarations(obj, explicit_requires, explicit_returns, guess=True):
+    declarations = declarations_for(obj)
+
+    if explicit_requires:
+        requires_ = convert_requires(explicit_requires)
     else:
-        requires_ = requires(requires_)
+        requires_ = declarations.requires()
+        if requires_ is None and guess:
+            requires_ = declarations.guess(obj)
 
-    if isinstance(returns_, (ReturnsType, NoneType)):
-        pass
-    elif isinstance(returns_, (list, tuple)):
-        returns_ = returns(*returns_)
+    if explicit_returns:
+        returns_ = convert_returns(explicit_returns)
     else:
-        returns_ = returns(returns_)
+        returns_ = declarations.returns()
 
     return requires_, returns_
 
@@ -0,0 +1,123 @@
+"""
+.. currentmodule:: mush
+
+Caching of the results of calling callables declared using
+:class:`~.declarations.memoize`.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+from .compat import monotonic
+from .markers import missing
+
+
+class Cache(object):
+    """
+    A cache of results keyed by the arguments and keyword parameters used to
+    obtain them, from which the least recently used results are evicted.
+
+    :param max_size: The maximum number of results to keep.
+
+    :param ttl: If specified, the number of seconds after which a result
+                will no longer be used.
+    """
+
+    #: The number of times a result has been found in this cache.
+    hits = 0
+
+    #: The number of times a result has not been found in this cache.
+    misses = 0
+
+    def __init__(self, max_size=128, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.results = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        """
+        Return the result cached for the supplied key or
+        :data:`~.markers.missing` if there is none.
+        """
+        with self.lock:
+            entry = self.results.get(key)
+            if entry is not None:
+                expires, result = entry
+                if expires is None or expires > monotonic():
+                    # move to the most recently used end:
+                    del self.results[key]
+                    self.results[key] = entry
+                    self.hits += 1
+                    return result
+                del self.results[key]
+            self.misses += 1
+            return missing
+
+    def set(self, key, result):
+        """
+        Cache the supplied result for the supplied key, evicting the least
+        recently used result if this cache is full.
+        """
+        expires = None if self.ttl is None else monotonic() + self.ttl
+        with self.lock:
+            self.results.pop(key, None)
+            self.results[key] = expires, result
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all results from this cache and reset its counters.
+        """
+        with self.lock:
+            self.results.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return '<Cache: %i of %i, hits=%i, misses=%i>' % (
+            len(self.results), self.max_size, self.hits, self.misses
+        )
+
+
+class Memoized(object):
+    """
+    A callable that calls the wrapped callable only when no result is
+    cached for the arguments and keyword parameters it is called with.
+    Calls with parameters that cannot be hashed are never cached.
+    """
+
+    def __init__(self, obj, cache):
+        self.__wrapped__ = obj
+        self.cache = cache
+
+    def __call__(self, *args, **kw):
+        try:
+            key = args, frozenset(kw.items())
+            hash(key)
+        except TypeError:
+            with self.cache.lock:
+                self.cache.misses += 1
+            return self.__wrapped__(*args, **kw)
+        result = self.cache.get(key)
+        if result is missing:
+            result = self.__wrapped__(*args, **kw)
+            self.cache.set(key, result)
+        return result
+
+    def __repr__(self):
+        return repr(self.__wrapped__)
+
+
+def memoized(obj):
+    """
+    Return a :class:`Memoized` for the supplied callable if it has been
+    declared using :class:`~.declarations.memoize`, otherwise return the
+    callable unchanged.
+    """
+    cache = getattr(obj, '__mush_memoize__', None)
+    if cache is None:
+        return obj
+    return Memoized(obj, cache)
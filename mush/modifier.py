@@ -19,7 +19,8 @@ class Modifier(object):
         else:
             self.labels = {label}
 
-    def add(self, obj, requires=None, returns=None, label=None, lazy=False):
+    def add(self, obj, requires=None, returns=None, label=None, lazy=False,
+            runs_in=None, scope=None):
         """
         :param obj: The callable to be added.
 
@@ -40,6 +41,14 @@ class Modifier(object):
         :param lazy: If true, ``obj`` will only be called the first time it
                      is needed.
 
+        :param runs_in: If specified, this is a string naming where ``obj``
+                        should be called. See
+                        :class:`~.declarations.runs_in`.
+
+        :param scope: If specified, this is a string naming how long the
+                      resources returned by ``obj`` should be kept. See
+                      :class:`~.declarations.scope`.
+
         If no label is specified but the point which this
         :class:`~.modifier.Modifier` represents has any labels, those labels
         will be moved to the newly inserted point.
@@ -48,7 +57,8 @@ class Modifier(object):
             raise ValueError('%r already points to %r' % (
                 label, self.runner.labels[label]
             ))
-        callpoint = CallPoint(obj, requires, returns, lazy)
+        callpoint = CallPoint(obj, requires, returns, lazy, runs_in, scope)
+        self.runner._plan = None
 
         if label:
             self.add_label(label, callpoint)
@@ -65,7 +75,7 @@ class Modifier(object):
             if not label:
                 for label in self.labels:
                     self.add_label(label, callpoint)
-                    callpoint.added_using.add(label)
+                    callpoint.added_using |= frozenset((label,))
         else:
             self.runner.start = callpoint
 
@@ -82,9 +92,9 @@ class Modifier(object):
         :param callpoint: For internal use only.
         """
         callpoint = callpoint or self.callpoint
-        callpoint.labels.add(label)
+        callpoint.labels |= frozenset((label,))
         old_callpoint = self.runner.labels.get(label)
         if old_callpoint:
-            old_callpoint.labels.remove(label)
+            old_callpoint.labels -= frozenset((label,))
         self.runner.labels[label] = callpoint
         self.labels.add(label)
@@ -0,0 +1,247 @@
+"""
+.. currentmodule:: mush
+
+Execution of the steps in a :class:`~.plan.Plan` using an executor, such as a
+:class:`~concurrent.futures.ThreadPoolExecutor`, so that steps with no
+dependencies between them can be run concurrently.
+"""
+from collections import deque
+
+from .compat import Queue
+from .context import ContextError
+from .plan import (
+    expand_needs, is_context_manager_class, lazy_needs, release
+)
+from .pool import Pool
+
+
+def is_barrier(step):
+    return (step.provides is None or
+            step.scope is not None or
+            step.streams is not None or
+            is_context_manager_class(step.point.obj) or
+            isinstance(step.point.obj, Pool))
+
+
+class Schedule(object):
+    """
+    The dependencies between the steps of a :class:`~.plan.Plan`.
+
+    Steps that may add resources that cannot be known in advance to the
+    context, along with steps that are context managers or pools, that
+    stream or that have a :class:`~.declarations.scope`, are barriers.
+    They are run on their own, once all earlier steps have completed
+    and before any later steps are started.
+
+    Between barriers, a step depends on each earlier step that requires or
+    provides any of the same resources. A resource required by a lazy
+    callable is treated as being required by every step that requires the
+    resource the lazy callable returns.
+    """
+
+    def __init__(self, plan):
+        self.barriers = set()
+        self.dependencies = {}
+        factories = lazy_needs(plan)
+        segment = []
+        for step in plan.steps:
+            if is_barrier(step):
+                self.barriers.add(step)
+                segment = []
+            else:
+                keys = expand_needs(step.needs, factories) | step.provides
+                self.dependencies[step] = tuple(
+                    earlier for earlier, earlier_keys in segment
+                    if keys & earlier_keys
+                )
+                segment.append((step, keys))
+
+
+class Steps(object):
+    """
+    An iterator over steps to which steps that have been taken but not run
+    can be returned.
+    """
+
+    def __init__(self, steps):
+        self.steps = iter(steps)
+        self.returned = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.returned:
+            return self.returned.pop(0)
+        return next(self.steps)
+
+    next = __next__
+
+
+def run(plan, context, steps, executor, result=None):
+    """
+    Execute the supplied steps of a :class:`~.plan.Plan` in the supplied
+    context, submitting each step that is not a barrier to the supplied
+    executor once the steps it depends on have completed.
+
+    All interaction with the context takes place in the calling thread;
+    only the calling of the callables takes place in the executor.
+    """
+    schedule = plan.schedule
+    if schedule is None:
+        schedule = plan.schedule = Schedule(plan)
+    if not isinstance(steps, Steps):
+        steps = Steps(steps)
+
+    segment = []
+    for step in steps:
+
+        if step not in schedule.barriers:
+            segment.append(step)
+            continue
+
+        if segment:
+            result = run_segment(schedule, context, segment, executor, steps)
+            segment = []
+
+        result = plan.execute(step, context)
+
+        if step.streams is not None:
+            return run_each(plan, context, step, result, steps, executor)
+
+        if getattr(result, '__enter__', None):
+            with plan.entered(context, result):
+                result = None
+                result = run(plan, context, steps, executor)
+
+    if segment:
+        result = run_segment(schedule, context, segment, executor, steps)
+
+    return result
+
+
+def run_each(plan, context, step, items, steps, executor):
+    """
+    Execute the remaining steps once for each of the supplied items, in a
+    copy of the supplied context to which the item has been added,
+    returning the result for the last item.
+    """
+    remaining = tuple(steps)
+    result = None
+    for item in items:
+        result = run(plan, plan.child(context, step, item), remaining,
+                     executor)
+    return result
+
+
+def run_segment(schedule, context, segment, executor, steps):
+    """
+    Execute a sequence of steps, none of which are barriers, as concurrently
+    as their dependencies allow.
+
+    If a step fails, no steps declared after it are started and those
+    that were not started are returned to ``steps`` before the exception
+    is raised. This means that, if a context manager suppresses the
+    exception, they will be run as they would have been had the
+    steps been executed in order.
+    """
+    positions = dict((step, position) for position, step in enumerate(segment))
+    waiting = list(segment)
+    running = {}
+    finished = set()
+    completed = Queue()
+    results = {}
+    failed = None
+
+    while True:
+
+        for step in list(waiting):
+            position = positions[step]
+            if failed is not None and position > failed[0]:
+                continue
+            for dependency in schedule.dependencies[step]:
+                # dependencies from an earlier segment have either completed
+                # or failed with the exception having been suppressed:
+                if dependency in positions and dependency not in finished:
+                    break
+            else:
+                waiting.remove(step)
+                try:
+                    args, kw = step.arguments(context)
+                    future = step.submit(context, executor, args, kw)
+                except ContextError as e:
+                    error = ContextError(str(e), step.point, context)
+                    if failed is None or position < failed[0]:
+                        failed = position, error
+                    continue
+                running[future] = step
+                future.add_done_callback(completed.put)
+
+        if not running:
+            break
+
+        future = completed.get()
+        step = running.pop(future)
+        error = None
+        try:
+            result = future.result()
+            if getattr(result, '__enter__', None):
+                raise ContextError(
+                    'Context manager returned when run concurrently'
+                )
+            step.add(context, result)
+        except ContextError as e:
+            error = ContextError(str(e), step.point, context)
+        except Exception as e:
+            error = e
+        else:
+            results[step] = result
+            finished.add(step)
+
+        if error is not None:
+            position = positions[step]
+            if failed is None or position < failed[0]:
+                failed = position, error
+
+    if failed is not None:
+        steps.returned[:0] = waiting
+        raise failed[1]
+
+    # resources are only released once the whole segment has completed, as
+    # a lazy callable resolved for a step may require resources that the
+    # step does not depend on:
+    for step in segment:
+        if step.releases:
+            release(context, step.releases)
+
+    return results[segment[-1]]
+
+
+def map_with_executor(call, inputs, executor, ordered, window):
+    """
+    Submit the supplied callable to the supplied executor once for each of
+    the supplied inputs, yielding the results either in the order of the
+    inputs or as they complete.
+    No more than ``window`` calls are submitted before their results are
+    yielded, so that inputs are consumed as results are.
+    """
+    if ordered:
+        pending = deque()
+        for item in inputs:
+            pending.append(executor.submit(call, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    else:
+        completed = Queue()
+        pending = 0
+        for item in inputs:
+            executor.submit(call, item).add_done_callback(completed.put)
+            pending += 1
+            if pending >= window:
+                yield completed.get().result()
+                pending -= 1
+        while pending:
+            yield completed.get().result()
+            pending -= 1
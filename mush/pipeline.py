@@ -0,0 +1,161 @@
+"""
+.. currentmodule:: mush
+
+Execution of the steps in a :class:`~.plan.Plan` as a pipeline of stages,
+each executed in its own thread, connected by bounded queues so that the
+stages of a streaming runner can process different items at the same time.
+"""
+from threading import Event, Thread
+
+from .compat import Empty, Full, Queue
+from .markers import Marker
+from .plan import Cursor
+from .tracing import call_from, origin, skipping
+
+done = Marker('done')
+
+#: The number of seconds between checks, made by threads waiting on a
+#: queue, for whether the pipeline has been stopped.
+poll_interval = 0.1
+
+
+class Failure(object):
+    """
+    An exception raised by a stage, passed along the pipeline so that it can
+    be raised by the consumer.
+    """
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def put(queue, item, stopped):
+    """
+    Put the supplied item on the supplied queue, waiting for space to become
+    available unless the pipeline is stopped, in which case ``False`` is
+    returned.
+    """
+    while not stopped.is_set():
+        try:
+            queue.put(item, timeout=poll_interval)
+        except Full:
+            continue
+        return True
+    return False
+
+
+def get(queue, stopped):
+    """
+    Get the next item from the supplied queue, returning :data:`done` if
+    the pipeline is stopped.
+    """
+    while not stopped.is_set():
+        try:
+            return queue.get(timeout=poll_interval)
+        except Empty:
+            continue
+    return done
+
+
+def work(plan, start, end, source, sink, stopped, skip=False):
+    """
+    Execute the steps from ``start`` up to ``end`` for each context taken
+    from the source queue, putting each resulting triple of context, result
+    and index of the next step on the sink queue.
+    Items that have already been taken past ``start`` by an earlier stage,
+    because a context manager was entered there, are passed on unchanged.
+    If ``skip`` is true, the calls made are not traced.
+    """
+    token = skipping.set(skip)
+    try:
+        while True:
+            item = get(source, stopped)
+            if item is done or isinstance(item, Failure):
+                put(sink, item, stopped)
+                return
+            context, _, index = item
+            if not start <= index < end:
+                if not put(sink, item, stopped):
+                    return
+                continue
+            triples = plan.flow(context, Cursor(plan.steps, index), end)
+            try:
+                for triple in triples:
+                    if not put(sink, triple, stopped):
+                        return
+            finally:
+                triples.close()
+    except Exception as e:
+        put(sink, Failure(e), stopped)
+    finally:
+        skipping.reset(token)
+
+
+def split(plan, points):
+    """
+    Split the steps of the supplied :class:`~.plan.Plan` into stages, with
+    a new stage starting after the step for each of the supplied points,
+    returning the index of the first step of each stage along with the
+    index after its last step.
+    """
+    ends = set(points)
+    stages = []
+    start = 0
+    for index, step in enumerate(plan.steps):
+        if step.point in ends:
+            stages.append((start, index + 1))
+            start = index + 1
+    if start < len(plan.steps):
+        stages.append((start, len(plan.steps)))
+    return stages
+
+
+def run(plan, context, points, max_queued):
+    """
+    Execute the steps of the supplied :class:`~.plan.Plan` in the supplied
+    context, split into stages after the steps for the supplied points,
+    yielding the result for each item that reaches the end of the pipeline.
+
+    Each stage is executed in its own thread, with no more than
+    ``max_queued`` items waiting between any two stages.
+    If the consumer stops iterating, the stages are stopped once the steps
+    they are executing have completed.
+    A context manager returned by a step is kept open until the remaining
+    steps have been executed for the item it was returned for, so those
+    steps are executed in the stage that returned it.
+
+    Calls made by the stages are traced as part of the run started by the
+    thread or task consuming the results.
+    """
+    owner = origin()
+    skip = skipping.get()
+    stopped = Event()
+    source = Queue()
+    source.put((context, None, 0))
+    source.put(done)
+
+    threads = []
+    for start, end in split(plan, points):
+        sink = Queue(max_queued)
+        thread = Thread(target=call_from,
+                        args=(owner, work,
+                              (plan, start, end, source, sink, stopped, skip),
+                              {}))
+        thread.daemon = True
+        threads.append(thread)
+        source = sink
+
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = source.get()
+            if item is done:
+                break
+            if isinstance(item, Failure):
+                raise item.exception
+            yield item[1]
+    finally:
+        stopped.set()
+        for thread in threads:
+            thread.join()
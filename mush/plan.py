@@ -0,0 +1,931 @@
+"""
+.. currentmodule:: mush
+
+Compiled forms of the points in a :class:`Runner`.
+"""
+from contextlib import contextmanager
+from inspect import isclass
+from pickle import HIGHEST_PROTOCOL, dumps, loads
+from threading import RLock
+
+from .context import Context, ContextError, SlotContext
+from .declarations import (
+    how, nothing, returns as returns_declaration, returns_result_type,
+    returns_sequence, streams
+)
+from .factory import Factory
+from .markers import missing
+from .batching import batching
+from .compat import perf_counter
+from .memo import memoized
+from .tracing import (
+    Traced, call_from, origin, skipping, span, trace_future
+)
+
+
+def resolve(context, key, factory):
+    """
+    Call the callable wrapped by a :class:`~.factory.Factory` and replace
+    the factory with its result in the context.
+    """
+    o = context.call(factory.__wrapped__, factory.requires)
+    context[key] = o
+    return o
+
+
+class Requirement(object):
+    """
+    A requirement of a callable where the key used to look up the resource
+    and the operations needed to extract the required part of it have
+    been worked out in advance.
+    """
+
+    #: The index of the slot allocated to :attr:`key` by the
+    #: :class:`Plan` this requirement is part of.
+    slot = None
+
+    def __init__(self, name, required):
+        self.name = name
+        self.required = required
+        ops = []
+        key = required
+        while isinstance(key, how):
+            ops.append(key.process)
+            key = key.type
+        ops.reverse()
+        self.key = key
+        self.ops = tuple(ops)
+
+    def extract(self, context):
+        o = context.get(self.key, missing)
+        if isinstance(o, Factory):
+            o = resolve(context, self.key, o)
+        for op in self.ops:
+            o = op(o)
+            if o is nothing:
+                break
+        if o is missing:
+            raise ContextError('No %s in context' % repr(self.required))
+        return o
+
+
+def arguments(requirements, context):
+    """
+    Extract the arguments and keyword parameters for the supplied
+    :class:`Requirement` instances from the supplied context.
+    """
+    args = []
+    kw = {}
+    for requirement in requirements:
+        o = requirement.extract(context)
+        if o is nothing:
+            pass
+        elif requirement.name is None:
+            args.append(o)
+        else:
+            kw[requirement.name] = o
+    return args, kw
+
+
+def add_nothing(context, result):
+    pass
+
+
+def add_by_type(context, result):
+    if result is not None:
+        context.add(result, result.__class__)
+
+
+class AddAs(object):
+
+    def __init__(self, key):
+        self.key = key
+
+    def __call__(self, context, result):
+        context.add(result, self.key)
+
+
+class AddProcessed(object):
+
+    def __init__(self, returns):
+        self.process = returns.process
+
+    def __call__(self, context, result):
+        for type, obj in self.process(result):
+            context.add(obj, type)
+
+
+def result_handler(returns):
+    """
+    Return a callable that will add the result of a call to a
+    :class:`~.context.Context` as specified by the supplied
+    returns declaration.
+    """
+    returns_type = type(returns)
+    if returns is nothing or returns_type is streams:
+        return add_nothing
+    if returns_type is returns_result_type:
+        return add_by_type
+    if returns_type is returns_declaration and len(returns.args) == 1:
+        return AddAs(returns.args[0])
+    return AddProcessed(returns)
+
+
+def provided_keys(returns):
+    """
+    Return the keys of the resources that will be added to a context
+    by the supplied returns declaration, or ``None`` if these cannot be
+    known until the callable has been called.
+    """
+    if returns is nothing:
+        return frozenset()
+    if type(returns) is returns_declaration:
+        return frozenset(returns.args)
+    if type(returns) is streams:
+        return frozenset((returns.type,))
+
+
+def requirements_for(requires):
+    return tuple(
+        Requirement(name, required) for name, required in requires
+    )
+
+
+class Step(object):
+    """
+    A single :class:`~.callpoints.CallPoint` compiled into a form that can
+    be executed with as little overhead as possible.
+    """
+
+    #: The keys of the resources this step requires.
+    needs = frozenset()
+
+    #: The keys of the resources this step adds to the context or ``None``
+    #: if these are not known until the step has been executed.
+    provides = None
+
+    #: The index of the slot in which the result should be stored when
+    #: it is added to the context using a single key.
+    add_slot = None
+
+    #: The name of the :class:`~.declarations.scope` of this step, if it
+    #: is not ``'run'``.
+    scope = None
+
+    #: The key with which each item of the iterable returned by this step is
+    #: added to the context, if it :class:`~.declarations.streams`.
+    streams = None
+
+    #: The :class:`~.tracing.Tracer` whose hooks are called around each call
+    #: to this step's callable, if any.
+    tracer = None
+
+    #: The keys of the resources that should be removed from the context
+    #: once this step has been executed, as no later step can require them,
+    #: or ``None`` if resources are not being released.
+    releases = None
+
+    def __init__(self, point):
+        self.point = point
+        self.obj = batching(memoized(point.obj))
+        self.requirements = requirements_for(point.requires)
+        self.add = result_handler(point.returns)
+        self.needs = frozenset(r.key for r in self.requirements)
+        self.provides = provided_keys(point.returns)
+        if type(point.returns) is streams:
+            self.streams = point.returns.type
+
+    def arguments(self, context):
+        """
+        Return the arguments and keyword parameters with which this step's
+        callable should be called.
+        """
+        return arguments(self.requirements, context)
+
+    def call(self, args, kw):
+        return self.obj(*args, **kw)
+
+    def trace(self, tracer):
+        """
+        Call the hooks of the supplied :class:`~.tracing.Tracer` around
+        each call to this step's callable.
+        """
+        self.obj = Traced(self.obj, self.point, tracer)
+        self.tracer = tracer
+
+    def submit(self, context, executor, args, kw):
+        """
+        Submit the calling of this step's callable to the supplied executor,
+        returning a :class:`~concurrent.futures.Future`.
+        """
+        if self.tracer is not None:
+            if skipping.get():
+                return executor.submit(self.obj.__wrapped__, *args, **kw)
+            return executor.submit(call_from, origin(), self.obj, args, kw)
+        return executor.submit(self.call, args, kw)
+
+    def __call__(self, context):
+        args, kw = arguments(self.requirements, context)
+        result = self.call(args, kw)
+        self.add(context, result)
+        return result
+
+    def run_slotted(self, context, slotted):
+        """
+        Execute this step in a :class:`~.context.SlotContext` with the slots
+        allocated by the :class:`Plan` this step is part of, where
+        ``slotted`` is the list of resources stored in those slots.
+        """
+        args = []
+        kw = {}
+        for requirement in self.requirements:
+            o = slotted[requirement.slot]
+            if isinstance(o, Factory):
+                o = resolve(context, requirement.key, o)
+            for op in requirement.ops:
+                o = op(o)
+                if o is nothing:
+                    break
+            if o is nothing:
+                continue
+            if o is missing:
+                raise ContextError('No %s in context' % repr(
+                    requirement.required
+                ))
+            if requirement.name is None:
+                args.append(o)
+            else:
+                kw[requirement.name] = o
+        result = self.obj(*args, **kw)
+        slot = self.add_slot
+        if slot is None:
+            self.add(context, result)
+        elif slotted[slot] is missing:
+            slotted[slot] = result
+        else:
+            raise ContextError('Context already contains %r' % (
+                self.add.key,
+            ))
+        return result
+
+
+class FactoryStep(Step):
+    """
+    A compiled point for a lazy callable, which adds itself to the
+    context when executed so that the callable can be called the first
+    time its resource is required.
+    """
+
+    requirements = ()
+
+    def __init__(self, point):
+        self.point = point
+        self.obj = point.obj
+        self.key = point.obj.returns.args[0]
+        self.needs = frozenset(
+            r.key for r in requirements_for(point.obj.requires)
+        )
+        self.provides = frozenset((self.key,))
+
+    def call(self, args, kw):
+        pass
+
+    def trace(self, tracer):
+        factory = self.obj
+        self.obj = Factory(Traced(factory.__wrapped__, self.point, tracer),
+                           factory.requires, factory.returns)
+
+    def add(self, context, result):
+        context.add(self.obj, self.key)
+
+    def __call__(self, context):
+        context.add(self.obj, self.key)
+
+    def run_slotted(self, context, slotted):
+        context.add(self.obj, self.key)
+
+
+def call_pickled(obj, parameters):
+    """
+    Unpickle a callable along with its arguments and keyword parameters
+    and then call it. This is what is run in another process by a
+    :class:`ProcessStep`.
+    """
+    args, kw = loads(parameters)
+    return loads(obj)(*args, **kw)
+
+
+class ProcessStep(Step):
+    """
+    A compiled point for a callable that should be called in another
+    process using the :attr:`~.context.Context.process_executor` of the
+    context in which it is executed. If the context has no process executor,
+    the callable is called in the current process.
+
+    Pickling takes place before anything is submitted to the executor so
+    that callables or parameters that cannot be pickled result in a
+    :class:`~.context.ContextError`.
+    """
+
+    pickled = None
+
+    def pickle(self, args, kw):
+        """
+        Return the pickled callable and pickled parameters to pass to
+        :func:`call_pickled`.
+        """
+        pickled = self.pickled
+        if pickled is None:
+            try:
+                pickled = self.pickled = dumps(self.point.obj,
+                                               HIGHEST_PROTOCOL)
+            except Exception as e:
+                raise ContextError('Cannot pickle %r to call it in another '
+                                   'process: %s' % (self.point.obj, e))
+        try:
+            parameters = dumps((args, kw), HIGHEST_PROTOCOL)
+        except Exception as e:
+            raise ContextError('Cannot pickle parameters for %r to call it '
+                               'in another process: %s' % (self.obj, e))
+        return pickled, parameters
+
+    def submit(self, context, executor, args, kw):
+        process_executor = context.process_executor
+        if process_executor is None:
+            return super(ProcessStep, self).submit(context, executor, args, kw)
+        pickled = self.pickle(args, kw)
+        tracer = self.tracer
+        if tracer is None or skipping.get():
+            return process_executor.submit(call_pickled, *pickled)
+        tracer.point_start(self.point)
+        start = perf_counter()
+        return trace_future(tracer, self.point,
+                            process_executor.submit(call_pickled, *pickled),
+                            start)
+
+    def __call__(self, context):
+        args, kw = arguments(self.requirements, context)
+        if context.process_executor is None:
+            result = self.call(args, kw)
+        else:
+            result = self.submit(context, None, args, kw).result()
+        self.add(context, result)
+        return result
+
+    def run_slotted(self, context, slotted):
+        return self(context)
+
+
+class Scope(object):
+    """
+    The resources added by steps with a particular
+    :class:`~.declarations.scope`, along with any context managers they
+    returned, kept until the scope is closed.
+    """
+
+    def __init__(self):
+        # re-entrant, as keeping a resource may resolve a lazy callable
+        # kept in the same scope:
+        self.lock = RLock()
+        self.results = {}
+        self.values = {}
+        self.managers = []
+
+    def close(self):
+        """
+        Exit any context managers entered in this scope, most recently
+        entered first, and forget all the resources kept.
+        """
+        managers = self.managers
+        self.results = {}
+        self.values = {}
+        self.managers = []
+        error = None
+        for manager in reversed(managers):
+            try:
+                manager.__exit__(None, None, None)
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+
+
+class ScopedStep(Step):
+    """
+    A compiled point for a callable that is called once for each
+    :class:`Scope`, with the resources it added being added to the context
+    of each run that takes place in that scope.
+    If the context has no scopes, this behaves as a normal :class:`Step`.
+    """
+
+    def __init__(self, point):
+        super(ScopedStep, self).__init__(point)
+        self.scope = point.scope
+
+    def __call__(self, context):
+        scopes = context.scopes
+        if scopes is None:
+            return super(ScopedStep, self).__call__(context)
+        scope = scopes[self.scope]
+        with scope.lock:
+            kept = scope.results.get(self.point)
+            if kept is None:
+                kept = scope.results[self.point] = self.keep(context, scope)
+        items, result = kept
+        for key, obj in items:
+            context.add(obj, key)
+        return result
+
+    def keep(self, context, scope):
+        """
+        Call this step's callable, entering any context manager returned
+        in the supplied scope, and return the resources added along with
+        the result to be returned for each run.
+        """
+        args, kw = arguments(self.requirements, context)
+        result = self.obj(*args, **kw)
+        added = Context()
+        self.add(added, result)
+        if getattr(result, '__enter__', None):
+            manager = result.__enter__()
+            scope.managers.append(result)
+            if manager not in (None, result):
+                added.add(manager, manager.__class__)
+            result = None
+        return list(added.items()), result
+
+    def run_slotted(self, context, slotted):
+        return self(context)
+
+
+class Keep(object):
+    """
+    A callable that calls the wrapped callable only if no value has been
+    kept for the supplied key in the supplied :class:`Scope`.
+    """
+
+    def __init__(self, scope, key, obj):
+        self.scope = scope
+        self.key = key
+        self.obj = obj
+
+    def __call__(self, *args, **kw):
+        with self.scope.lock:
+            value = self.scope.values.get(self.key, missing)
+            if value is missing:
+                value = self.scope.values[self.key] = self.obj(*args, **kw)
+        return value
+
+
+class ScopedFactoryStep(FactoryStep):
+    """
+    A compiled point for a lazy callable that is called at most once for
+    each :class:`Scope`.
+    If the context has no scopes, this behaves as a normal
+    :class:`FactoryStep`.
+    """
+
+    def __init__(self, point):
+        super(ScopedFactoryStep, self).__init__(point)
+        self.scope = point.scope
+
+    def __call__(self, context):
+        scopes = context.scopes
+        if scopes is None:
+            context.add(self.obj, self.key)
+            return
+        scope = scopes[self.scope]
+        value = scope.values.get(self.key, missing)
+        if value is missing:
+            factory = self.obj
+            value = Factory(Keep(scope, self.key, factory.__wrapped__),
+                            factory.requires, factory.returns)
+        context.add(value, self.key)
+
+    def add(self, context, result):
+        self(context)
+
+    def run_slotted(self, context, slotted):
+        self(context)
+
+
+def is_context_manager_class(obj):
+    return isclass(obj) and hasattr(obj, '__enter__')
+
+
+def compile_point(point):
+    if isinstance(point.obj, Factory):
+        if point.scope is not None:
+            return ScopedFactoryStep(point)
+        return FactoryStep(point)
+    if point.scope is not None:
+        return ScopedStep(point)
+    if point.runs_in == 'process':
+        return ProcessStep(point)
+    return Step(point)
+
+
+def points_needed(plan, targets):
+    """
+    Return the points of the steps in the supplied :class:`Plan` that are
+    needed to add the resources with the supplied keys to the context,
+    working backwards from the last step.
+
+    Steps are kept if they may add a needed resource, if their callable has
+    been declared to have :func:`~.declarations.side_effects` or if they are
+    context manager classes. Steps where the resources added cannot be known
+    in advance are kept if they could add a needed resource.
+    """
+    needed = set()
+    for target in targets:
+        while isinstance(target, how):
+            target = target.type
+        needed.add(target)
+
+    points = []
+    for step in reversed(plan.steps):
+        obj = step.point.obj
+        provides = step.provides
+        if type(step.point.returns) is returns_result_type and isclass(obj):
+            provides = frozenset((obj,))
+        if provides is not None:
+            keep = bool(needed & provides)
+        elif type(step.point.returns) in (returns_result_type,
+                                          returns_sequence):
+            # only resources keyed by type can be added:
+            keep = any(not isinstance(key, str) for key in needed)
+        else:
+            keep = True
+        if (keep or
+                getattr(obj, '__mush_side_effects__', False) or
+                is_context_manager_class(obj)):
+            needed.update(step.needs)
+            points.append(step.point)
+
+    points.reverse()
+    return points
+
+
+def invariant_prefix(plan, key):
+    """
+    Return the number of steps at the start of the supplied :class:`Plan`
+    that do not depend on the resource with the supplied key and so can be
+    executed once for many runs that each add a different resource with that
+    key.
+
+    The prefix ends at the first step that needs the resource, either
+    directly or through a lazy callable, that streams, that has been
+    declared to have
+    :func:`~.declarations.side_effects`, that is a context manager class or
+    that may add resources with keys that cannot be known in advance.
+    Other context managers returned by steps in the prefix must be kept
+    open for all the runs, as :meth:`Plan.prepare` does.
+    """
+    while isinstance(key, how):
+        key = key.type
+    dependent = set([key])
+    for index, step in enumerate(plan.steps):
+        obj = step.point.obj
+        if isinstance(step, FactoryStep):
+            if dependent & step.needs:
+                dependent.add(step.key)
+            continue
+        if (dependent & step.needs or
+                step.streams is not None or
+                getattr(obj, '__mush_side_effects__', False) or
+                is_context_manager_class(obj) or
+                (step.provides is None and not (
+                    isclass(obj) and
+                    type(step.point.returns) is returns_result_type
+                ))):
+            return index
+    return len(plan.steps)
+
+
+def release(context, keys):
+    """
+    Remove the resources with the supplied keys from the supplied context,
+    if present.
+    """
+    for key in keys:
+        if key in context:
+            del context[key]
+
+
+def lazy_needs(plan):
+    """
+    Return a mapping of the key of each lazy callable in the supplied
+    :class:`Plan` to the keys of the resources it requires.
+    """
+    return dict((step.key, step.needs) for step in plan.steps
+                if isinstance(step, FactoryStep))
+
+
+def expand_needs(needs, factories):
+    """
+    Return the supplied keys along with the keys required, directly or
+    indirectly, by the lazy callables in the supplied mapping, as returned
+    by :func:`lazy_needs`, that return any of them.
+    """
+    keys = set()
+    pending = list(needs)
+    while pending:
+        key = pending.pop()
+        if key not in keys:
+            keys.add(key)
+            pending.extend(factories.get(key, ()))
+    return keys
+
+
+def liveness(plan, keep):
+    """
+    Set the :attr:`~Step.releases` of each step in the supplied
+    :class:`Plan` to the keys of the resources that no later step can
+    require, other than those with the supplied keys.
+
+    A resource required by a lazy callable is treated as being required by
+    every step that requires the resource the lazy callable returns.
+    Resources added with keys that cannot be known in advance are never
+    released.
+    """
+    factories = lazy_needs(plan)
+    last = {}
+    for index, step in enumerate(plan.steps):
+        keys = expand_needs(step.needs, factories)
+        keys.update(step.provides or ())
+        for key in keys:
+            last[key] = index
+    releases = [[] for _ in plan.steps]
+    for key, index in last.items():
+        if key not in keep:
+            releases[index].append(key)
+    for step, keys in zip(plan.steps, releases):
+        step.releases = tuple(keys)
+
+
+class Cursor(object):
+    """
+    An iterator over a sequence of steps that records the index of the
+    next step to be returned.
+    """
+
+    def __init__(self, steps, index=0):
+        self.steps = steps
+        self.index = index
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        index = self.index
+        if index >= len(self.steps):
+            raise StopIteration
+        self.index = index + 1
+        return self.steps[index]
+
+    next = __next__
+
+
+class Plan(object):
+    """
+    The points in a :class:`Runner` compiled into a flat sequence of
+    :class:`Step` instances.
+    """
+
+    #: The function generated from this plan by :meth:`Runner.generate`,
+    #: if any.
+    generated = None
+
+    #: The :class:`~.parallel.Schedule` used when this plan is executed
+    #: using an executor, if it has been.
+    schedule = None
+
+    #: The :class:`~.validation.Validation` of this plan, once it has been
+    #: validated when first called.
+    validation = None
+
+    def __init__(self, runner):
+        #: The :class:`~.tracing.Tracer` installed on the runner when this
+        #: plan was compiled, if any.
+        self.tracer = tracer = runner.tracer
+        steps = []
+        point = runner.start
+        while point:
+            step = compile_point(point)
+            if tracer is not None:
+                step.trace(tracer)
+            steps.append(step)
+            point = point.next
+        self.steps = tuple(steps)
+
+        #: Whether any steps in this plan have a :class:`~.declarations.scope`
+        #: other than ``'run'``.
+        self.scoped = any(step.scope is not None for step in steps)
+
+        #: The index of the slot allocated to each resource key that can be
+        #: known before the steps of this plan are executed.
+        self.slots = slots = {}
+        for step in steps:
+            for key in step.needs | (step.provides or frozenset()):
+                if key not in slots:
+                    slots[key] = len(slots)
+            for requirement in step.requirements:
+                requirement.slot = slots[requirement.key]
+            if type(step.add) is AddAs:
+                step.add_slot = slots[step.add.key]
+
+        #: The keys of the resources that are never released, if resources
+        #: are released once no later step can require them.
+        self.keep = keep = runner.keep
+        if keep is not None:
+            liveness(self, keep)
+
+    def context(self):
+        """
+        Return a new :class:`~.context.SlotContext` that uses the slots
+        allocated by this plan.
+        """
+        return SlotContext(self.slots)
+
+    def __call__(self, context):
+        return self.run(context, iter(self.steps))
+
+    def run(self, context, steps, result=None):
+        """
+        Execute the supplied steps in the supplied context.
+
+        ``steps`` must be an iterator that is shared with any nested calls
+        made when context managers are entered, so that the steps run within
+        a context manager are not run again once it has exited.
+        """
+        slotted = self.slotted(context)
+
+        for step in steps:
+
+            result = self.execute(step, context, slotted)
+
+            if step.streams is not None:
+                return self.run_each(context, step, result, steps)
+
+            if getattr(result, '__enter__', None):
+                result = self.enter(context, result, steps)
+
+        return result
+
+    def slotted(self, context):
+        """
+        Return the list in which the supplied context stores resources in
+        the slots allocated by this plan, or ``None`` if it does not.
+        """
+        if type(context) is SlotContext and context.slots is self.slots:
+            return context.slotted
+
+    def execute(self, step, context, slotted=None):
+        """
+        Execute the supplied step in the supplied context, using the slots
+        returned by :meth:`slotted`, if any, and then release any resources
+        that no later step can require.
+        This is shared by all the ways in which the steps of a plan can be
+        executed.
+        """
+        try:
+            if slotted is None:
+                result = step(context)
+            else:
+                result = step.run_slotted(context, slotted)
+        except ContextError as e:
+            raise ContextError(str(e), step.point, context)
+
+        if step.releases:
+            release(context, step.releases)
+
+        return result
+
+    def child(self, context, step, item):
+        """
+        Return a copy of the supplied context to which an item from the
+        iterable returned by the supplied step, which
+        :class:`~.declarations.streams`, has been added.
+        """
+        child = context.copy()
+        try:
+            child.add(item, step.streams)
+        except ContextError as e:
+            raise ContextError(str(e), step.point, child)
+        return child
+
+    @contextmanager
+    def entered(self, context, result):
+        """
+        Enter the context manager that has been returned as a result,
+        adding any resource it provides to the supplied context.
+        """
+        with span(self.tracer, result), result as manager:
+            if manager not in (None, result):
+                context.add(manager, manager.__class__)
+            yield
+
+    def stream(self, context):
+        """
+        Execute the steps of this plan in the supplied context as :meth:`run`
+        does, yielding the result once for each item of any iterable
+        returned by a step that :class:`~.declarations.streams`, or once if
+        there are no such steps.
+        """
+        for _, result, _ in self.flow(context, Cursor(self.steps)):
+            yield result
+
+    def flow(self, context, cursor, end=None):
+        """
+        Execute the steps of this plan in the supplied context, from the
+        index of the supplied :class:`Cursor` up to ``end`` or, by default,
+        the last step, as :meth:`stream` does.
+        Triples are yielded of the context in which the last step was
+        executed, which will be a copy for each item of any stream, its
+        result and the index of the next step to be executed for that
+        context.
+
+        If a step returns a context manager, all the remaining steps are
+        executed within it, even those beyond ``end``.
+        """
+        if end is None:
+            end = len(self.steps)
+        slotted = self.slotted(context)
+
+        result = None
+        while cursor.index < end:
+            step = self.steps[cursor.index]
+            cursor.index += 1
+
+            result = self.execute(step, context, slotted)
+
+            if step.streams is not None:
+                start = cursor.index
+                for item in result:
+                    child = self.child(context, step, item)
+                    for triple in self.flow(child, Cursor(self.steps, start),
+                                            end):
+                        yield triple
+                return
+
+            if getattr(result, '__enter__', None):
+                with self.entered(context, result):
+                    for triple in self.flow(context, cursor):
+                        yield triple
+                    return
+                result = None
+
+        yield context, result, cursor.index
+
+    def run_each(self, context, step, items, steps):
+        """
+        Execute the remaining steps once for each of the supplied items,
+        in a copy of the supplied context to which the item has been added,
+        returning the result for the last item.
+        """
+        remaining = tuple(steps)
+        result = None
+        for item in items:
+            result = self.run(self.child(context, step, item),
+                              iter(remaining))
+        return result
+
+    def enter(self, context, result, steps):
+        """
+        Execute the supplied steps within the context manager that has been
+        returned as a result.
+        If the context manager suppresses an exception, ``None`` is returned
+        and the caller should continue with any steps that remain.
+        """
+        with self.entered(context, result):
+            result = None
+            result = self.run(context, steps)
+        return result
+
+    def prepare(self, context, steps, scope):
+        """
+        Execute the supplied steps in the supplied context as :meth:`run`
+        does, except that any context manager returned is entered in the
+        supplied :class:`Scope`, so that it is only exited when that scope
+        is closed, rather than around the steps that follow.
+        """
+        slotted = self.slotted(context)
+
+        for step in steps:
+
+            result = self.execute(step, context, slotted)
+
+            if getattr(result, '__enter__', None):
+                manager = result.__enter__()
+                scope.managers.append(result)
+                if manager not in (None, result):
+                    context.add(manager, manager.__class__)
+
+    def __repr__(self):
+        bits = []
+        for step in self.steps:
+            bits.append('\n    ' + repr(step.point))
+        if bits:
+            bits.append('\n')
+        return '<Plan>%s</Plan>' % ''.join(bits)
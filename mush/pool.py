@@ -0,0 +1,162 @@
+"""
+.. currentmodule:: mush
+
+Pools of expensive resources, such as connections, that are lent to each
+run of a :class:`Runner` and returned once the run has completed.
+"""
+from threading import Condition
+
+from .compat import monotonic
+from .declarations import nothing
+from .markers import missing
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no resource becomes available from a :class:`Pool` within
+    its timeout.
+    """
+
+
+class Lease(object):
+    """
+    A context manager that borrows a resource from a :class:`Pool` when
+    entered and returns it to the pool when exited.
+    """
+
+    resource = missing
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __enter__(self):
+        self.resource = self.pool.acquire()
+        return self.resource
+
+    def __exit__(self, type, obj, tb):
+        resource = self.resource
+        self.resource = missing
+        if resource is not missing:
+            self.pool.release(resource)
+
+
+class Pool(object):
+    """
+    A bounded pool of resources that can be added to a :class:`Runner`.
+    Each run is lent a resource that is added to its context using its type
+    and returned to the pool once the rest of the run has completed.
+    Resources are created using the supplied factory when none are idle.
+
+    :param factory: A callable, taking no parameters, that returns a new
+                    resource.
+
+    :param max_size: The maximum number of resources that may exist at once.
+
+    :param timeout: If specified, the number of seconds to wait for a
+                    resource to become available before raising a
+                    :class:`PoolTimeout`. By default, waits forever.
+
+    :param check: If specified, a callable that is passed an idle resource
+                  before it is lent and returns ``False`` if the resource
+                  should be discarded rather than used.
+
+    :param dispose: If specified, a callable that is passed each resource
+                    that is discarded, either because it failed its check or
+                    because the pool has been closed.
+    """
+
+    # only the resource lent by the lease is added to the context, so that
+    # more than one pool can be used in a runner:
+    __mush_returns__ = nothing
+
+    def __init__(self, factory, max_size=10, timeout=None, check=None,
+                 dispose=None):
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check = check
+        self.dispose = dispose
+        #: The number of resources that currently exist, idle or lent.
+        self.size = 0
+        #: The resources that are not currently lent.
+        self.idle = []
+        self.condition = Condition()
+
+    def __call__(self):
+        return Lease(self)
+
+    def acquire(self):
+        """
+        Return an idle resource, creating one if there are none and the
+        pool is not full, otherwise waiting for one to be released.
+        """
+        deadline = None if self.timeout is None else monotonic() + self.timeout
+        while True:
+            with self.condition:
+                while not self.idle and self.size >= self.max_size:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            raise PoolTimeout(
+                                'No resource available from %r after %s '
+                                'seconds' % (self, self.timeout)
+                            )
+                    self.condition.wait(remaining)
+                if self.idle:
+                    resource = self.idle.pop()
+                else:
+                    resource = missing
+                    self.size += 1
+
+            if resource is missing:
+                try:
+                    return self.factory()
+                except Exception:
+                    self.forget()
+                    raise
+
+            if self.check is None or self.check(resource):
+                return resource
+            self.discard(resource)
+
+    def release(self, resource):
+        """
+        Return a resource to this pool so that it can be lent again.
+        """
+        with self.condition:
+            self.idle.append(resource)
+            self.condition.notify()
+
+    def forget(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def discard(self, resource):
+        """
+        Remove a resource from this pool, making room for another to be
+        created, and dispose of it.
+        """
+        self.forget()
+        if self.dispose is not None:
+            self.dispose(resource)
+
+    def close(self):
+        """
+        Dispose of all the idle resources in this pool. Resources that are
+        currently lent will be returned to the pool as normal.
+        """
+        with self.condition:
+            idle = self.idle
+            self.idle = []
+            self.size -= len(idle)
+            self.condition.notify_all()
+        if self.dispose is not None:
+            for resource in idle:
+                self.dispose(resource)
+
+    def __repr__(self):
+        return '<Pool for %r: size=%i, idle=%i, max_size=%i>' % (
+            self.factory, self.size, len(self.idle), self.max_size
+        )
@@ -0,0 +1,227 @@
+"""
+.. currentmodule:: mush
+
+A :class:`~.tracing.Tracer` that uses :mod:`tracemalloc` to account for the
+memory allocated by each point of a :class:`Runner` and the memory retained
+by the resources left in the context of each run.
+"""
+import sys
+import tracemalloc
+from collections import OrderedDict
+from threading import Lock
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+
+from .declarations import name_or_repr
+from .factory import Factory
+from .tracing import Tracer, origin, unique_names
+
+#: Types whose instances are shared rather than owned by a resource, so are
+#: not included in its size.
+shared_types = (type, ModuleType, FunctionType, BuiltinFunctionType,
+                MethodType)
+
+#: :func:`tracemalloc.reset_peak` where available, which is Python 3.9 and
+#: later. Without it, the peak memory of each point cannot be measured.
+reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+def deep_size(obj, limit=100000):
+    """
+    Return the approximate number of bytes used by the supplied object along
+    with the objects it refers to through containers, instance dictionaries
+    and slots. Objects referred to more than once are only counted once and
+    no more than ``limit`` objects are counted.
+    """
+    seen = set()
+    pending = [obj]
+    size = 0
+    while pending and len(seen) < limit:
+        o = pending.pop()
+        if id(o) in seen or isinstance(o, shared_types):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            pending.extend(o.keys())
+            pending.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            pending.extend(o)
+        elif not isinstance(o, (str, bytes)):
+            instance_dict = getattr(o, '__dict__', None)
+            if instance_dict is not None:
+                pending.append(instance_dict)
+            for cls in type(o).__mro__:
+                slots = cls.__dict__.get('__slots__', ())
+                if isinstance(slots, str):
+                    slots = (slots,)
+                for name in slots:
+                    value = getattr(o, name, None)
+                    if value is not None:
+                        pending.append(value)
+    return size
+
+
+def key_name(key):
+    if isinstance(key, str):
+        return key
+    return name_or_repr(key)
+
+
+class PointMemory(object):
+    """
+    The memory accounting for a single :class:`~.callpoints.CallPoint`.
+    """
+
+    def __init__(self, point):
+        self.point = point
+        #: The number of times the point's callable has been called.
+        self.calls = 0
+        #: The total number of bytes still allocated when those calls
+        #: returned, which may be negative if memory was freed.
+        self.allocated = 0
+        #: The most bytes allocated at once during any of those calls,
+        #: or ``None`` if :func:`tracemalloc.reset_peak` is not available.
+        self.peak = None if reset_peak is None else 0
+        #: The bytes allocated by each source line during those calls.
+        self.sites = {}
+
+    def top(self, count):
+        """
+        Return a list of the supplied number of ``(site, bytes)`` pairs that
+        allocated the most memory, largest first.
+        """
+        return sorted(self.sites.items(),
+                      key=lambda item: item[1], reverse=True)[:count]
+
+
+class ResourceMemory(object):
+    """
+    The memory retained by a resource left in the context at the end of
+    runs.
+    """
+
+    def __init__(self):
+        #: The approximate size, in bytes, at the end of the most recent run.
+        self.size = 0
+        #: The largest approximate size, in bytes, at the end of any run.
+        self.max = 0
+
+    def add(self, size):
+        self.size = size
+        if size > self.max:
+            self.max = size
+
+
+class MemoryProfiler(Tracer):
+    """
+    A :class:`~.tracing.Tracer` that takes :mod:`tracemalloc` measurements
+    around each call of the callables of the :class:`Runner` it is installed
+    on and measures the resources left in the context of each run.
+    See :ref:`memory-profiling`.
+
+    :param top: The number of allocation sites to report for each point.
+                If zero, no snapshots are taken, which makes profiling much
+                cheaper, but sites will not be reported.
+
+    :param frames: The number of frames :mod:`tracemalloc` should store for
+                   each allocation, if it is not already tracing.
+
+    :mod:`tracemalloc` is started if it is not already tracing and is
+    stopped again by :meth:`close`. Memory is measured for the whole
+    process, so runs should not take place concurrently while profiling.
+    """
+
+    def __init__(self, top=5, frames=1):
+        self.top = top
+        self.started = not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start(frames)
+        self.filters = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        )
+        self.lock = Lock()
+        self.active = {}
+        #: The :class:`PointMemory` for each point that has been called,
+        #: in the order they were first called.
+        self.points = OrderedDict()
+        #: The :class:`ResourceMemory` for each key with which a resource
+        #: has been left in the context at the end of a run.
+        self.resources = OrderedDict()
+
+    def snapshot(self):
+        if self.top:
+            return tracemalloc.take_snapshot().filter_traces(self.filters)
+
+    def point_start(self, point):
+        snapshot = self.snapshot()
+        current, _ = tracemalloc.get_traced_memory()
+        if reset_peak is not None:
+            reset_peak()
+        self.active.setdefault(origin(), []).append((snapshot, current))
+
+    def point_end(self, point, start, elapsed, error):
+        current, peak = tracemalloc.get_traced_memory()
+        key = origin()
+        stack = self.active[key]
+        before, initial = stack.pop()
+        if not stack:
+            del self.active[key]
+        sites = ()
+        if before is not None:
+            sites = [
+                (str(stat.traceback[0]), stat.size_diff)
+                for stat in self.snapshot().compare_to(before, 'lineno')
+                if stat.size_diff > 0
+            ]
+        with self.lock:
+            memory = self.points.get(point)
+            if memory is None:
+                memory = self.points[point] = PointMemory(point)
+            memory.calls += 1
+            memory.allocated += current - initial
+            if memory.peak is not None:
+                memory.peak = max(memory.peak, peak - initial)
+            for site, size in sites:
+                memory.sites[site] = memory.sites.get(site, 0) + size
+
+    def run_end(self, context, start, elapsed, error):
+        sizes = [(key, deep_size(obj)) for key, obj in context.items()
+                 if not isinstance(obj, Factory)]
+        with self.lock:
+            for key, size in sizes:
+                memory = self.resources.get(key)
+                if memory is None:
+                    memory = self.resources[key] = ResourceMemory()
+                memory.add(size)
+
+    def as_dict(self):
+        """
+        Return the measurements taken as a :class:`dict`.
+        """
+        with self.lock:
+            return {
+                'points': OrderedDict(
+                    (name, {
+                        'calls': memory.calls,
+                        'allocated': memory.allocated,
+                        'peak': memory.peak,
+                        'sites': memory.top(self.top),
+                    })
+                    for name, memory in zip(unique_names(self.points),
+                                            self.points.values())
+                ),
+                'resources': OrderedDict(
+                    (key_name(key), {'size': memory.size,
+                                         'max': memory.max})
+                    for key, memory in self.resources.items()
+                ),
+            }
+
+    def close(self):
+        """
+        Stop :mod:`tracemalloc` if it was started by this profiler.
+        """
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
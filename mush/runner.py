@@ -1,9 +1,15 @@
 from .callpoints import CallPoint
+from .codegen import generate
 from .context import Context, ContextError
 from .declarations import extract_declarations
 from .markers import not_specified
 from .modifier import Modifier
+from .parallel import map_with_executor, run as run_with_executor
+from .pipeline import run as run_pipeline
+from .plan import Plan, Scope, invariant_prefix, points_needed
 from .plug import Plug
+from .tracing import trace_iterator, trace_run
+from .validation import validate
 
 
 class Runner(object):
@@ -14,12 +20,33 @@ class Runner(object):
     """
 
     start = end = None
+    _plan = None
+    _process_scope = None
+
+    #: The :class:`~.tracing.Tracer` installed using :meth:`instrument`,
+    #: if any.
+    tracer = None
+
+    #: The keys of the resources that are kept until the end of each run
+    #: when resources are being released using :meth:`release`, or ``None``
+    #: if every resource is kept until the end of each run.
+    keep = None
+
+    #: If true, :meth:`validate` will be called with the context supplied,
+    #: if any, the first time this runner is called after it has been
+    #: modified.
+    validate_on_call = False
+
+    #: The maximum number of inputs submitted to an executor by :meth:`map`
+    #: before their results are returned.
+    map_window = 100
 
     def __init__(self, *objects):
         self.labels = {}
         self.extend(*objects)
 
-    def add(self, obj, requires=None, returns=None, label=None, lazy=False):
+    def add(self, obj, requires=None, returns=None, label=None, lazy=False,
+            runs_in=None, scope=None):
         """
         Add a callable to the runner.
 
@@ -41,12 +68,20 @@ class Runner(object):
 
         :param lazy: If true, ``obj`` will only be called the first time it
                      is needed.
+
+        :param runs_in: If specified, this is a string naming where ``obj``
+                        should be called. See
+                        :class:`~.declarations.runs_in`.
+
+        :param scope: If specified, this is a string naming how long the
+                      resources returned by ``obj`` should be kept. See
+                      :class:`~.declarations.scope`.
         """
         if isinstance(obj, Plug):
             obj.add_to(self)
         else:
             m = Modifier(self, self.end, not_specified)
-            m.add(obj, requires, returns, label, lazy)
+            m.add(obj, requires, returns, label, lazy, runs_in, scope)
             return m
 
     def add_label(self, label):
@@ -58,24 +93,15 @@ class Runner(object):
         return m
 
     def _copy_from(self, start_point, end_point, added_using=None):
+        self._plan = None
         previous_cloned_point = self.end
         point = start_point
 
         while point:
             if added_using is None or added_using in point.added_using:
-                cloned_point = CallPoint(point.obj, point.requires, point.returns)
-                cloned_point.labels = set(point.labels)
-                for label in cloned_point.labels:
-                    self.labels[label] = cloned_point
-
-                if self.start is None:
-                    self.start = cloned_point
-
-                if previous_cloned_point:
-                    previous_cloned_point.next = cloned_point
-                cloned_point.previous = previous_cloned_point
-
-                previous_cloned_point = cloned_point
+                previous_cloned_point = self._copy_point(
+                    point, previous_cloned_point
+                )
 
             point = point.next
             if point and point.previous is end_point:
@@ -83,6 +109,22 @@ class Runner(object):
 
         self.end = previous_cloned_point
 
+    def _copy_point(self, point, previous_cloned_point):
+        cloned_point = CallPoint(point.obj, point.requires, point.returns,
+                                 runs_in=point.runs_in, scope=point.scope)
+        cloned_point.labels = point.labels
+        for label in cloned_point.labels:
+            self.labels[label] = cloned_point
+
+        if self.start is None:
+            self.start = cloned_point
+
+        if previous_cloned_point:
+            previous_cloned_point.next = cloned_point
+        cloned_point.previous = previous_cloned_point
+
+        return cloned_point
+
     def extend(self, *objs):
         """
         Add the specified callables to this runner.
@@ -122,7 +164,7 @@ class Runner(object):
             label specified in this option should be cloned.
             This filtering is applied in addition to the above options.
         """
-        runner = Runner()
+        runner = self.__class__()
 
         if start_label:
             start = self.labels[start_label]
@@ -148,6 +190,27 @@ class Runner(object):
         runner._copy_from(start, end, added_using)
         return runner
 
+    def slice(self, *targets):
+        """
+        Return a new :class:`Runner` containing only the callables from this
+        runner that are needed to provide the resources specified.
+
+        Working backwards from the end of this runner, a callable is kept if
+        it may return a resource that is needed, either as one of the
+        targets or as a requirement of a callable that has been kept.
+        Callables that are context manager classes, or that have been
+        declared to have :func:`~.declarations.side_effects`, are always
+        kept.
+
+        :param targets: The types or names of the resources required.
+        """
+        runner = self.__class__()
+        previous = None
+        for point in points_needed(self.compile(), targets):
+            previous = runner._copy_point(point, previous)
+        runner.end = previous
+        return runner
+
     def replace(self, original, replacement, requires=None, returns=None):
         """
         Replace all instances of one callable with another.
@@ -166,6 +229,7 @@ class Runner(object):
                         :class:`returns_mapping`, :class:`returns_sequence`
                         object.
         """
+        self._plan = None
         point = self.start
         while point:
             if point.obj is original:
@@ -187,8 +251,8 @@ class Runner(object):
                     new_point.next = point.next
                     for label in point.labels:
                         self.labels[label] = new_point
-                        new_point.labels.add(label)
-                    new_point.added_using = set(point.added_using)
+                    new_point.labels = point.labels
+                    new_point.added_using = point.added_using
 
                 else:
 
@@ -208,50 +272,349 @@ class Runner(object):
         Return a new :class:`Runner` containing the contents of the two
         :class:`Runner` instances being added together.
         """
-        runner = Runner()
+        runner = self.__class__()
         for r in self, other:
             runner._copy_from(r.start, r.end)
         return runner
 
-    def __call__(self, context=None):
+    def compile(self):
+        """
+        Return the :class:`~mush.plan.Plan` used to execute this runner.
+
+        The plan is created the first time it is needed and then re-used
+        until the runner is modified using :meth:`add`, :meth:`extend`,
+        :meth:`replace` or a :class:`~.modifier.Modifier`.
+        """
+        plan = self._plan
+        if plan is None:
+            plan = self._plan = Plan(self)
+        return plan
+
+    def instrument(self, tracer):
+        """
+        Install a :class:`~.tracing.Tracer` whose hooks will be called around
+        each run of this runner and each call of the callables in it.
+        Passing ``None`` removes any tracer that is installed.
+        See :ref:`tracing`.
+        """
+        self.tracer = tracer
+        self._plan = None
+
+    def release(self, *results):
+        """
+        Remove each resource from the context of a run as soon as none of the
+        callables still to be called in that run can require it, so that the
+        memory it uses can be reclaimed.
+        Resources with the keys passed as ``results`` are kept until the end
+        of each run, as are resources whose keys cannot be known until they
+        have been added. See :ref:`releasing`.
+        """
+        self.keep = frozenset(results)
+        self._plan = None
+
+    def generate(self):
+        """
+        Return a function that has the same behaviour as calling this runner
+        but which is made up of Python source code generated from the
+        callables in this runner and their declarations. This removes
+        most of the overhead of calling a runner, but any changes made to
+        this runner after the function has been returned will not be
+        reflected by the function.
+
+        The function is cached in the same way as the result of
+        :meth:`compile`.
+
+        If this runner has callables with a :class:`~.declarations.scope`,
+        each call of the function takes place in its own batch unless the
+        context passed to it already has scopes. If :attr:`validate_on_call`
+        is set when the function is generated, the function validates this
+        runner in the same way as calling it does.
+        """
+        plan = self.compile()
+        if plan.generated is None:
+            function = generate(plan)
+            if plan.scoped or self.validate_on_call:
+                function = self._generated(plan, function)
+            plan.generated = function
+        return plan.generated
+
+    def _generated(self, plan, run):
+        scopes = self._scopes if plan.scoped else None
+        validate_on_call = self.validate_on_call
+
+        def generated(context=None):
+            if context is None:
+                context = Context()
+            if validate_on_call and plan.validation is None:
+                plan.validation = validate(plan, context)
+            if scopes is None or context.scopes is not None:
+                return run(context)
+            scope = Scope()
+            context.scopes = scopes(scope)
+            try:
+                return run(context)
+            finally:
+                scope.close()
+
+        generated.source = run.source
+        return generated
+
+    def source(self):
+        """
+        Return the Python source code of the function returned by
+        :meth:`generate`.
+        """
+        return self.generate().source
+
+    def validate(self, context=None):
+        """
+        Check, without calling anything, that the requirements of every
+        callable in this runner can be satisfied by the callables before it,
+        raising a :class:`~.context.ContextError` listing any that cannot.
+
+        Callables that return resources using :class:`returns_mapping`, or
+        that return resources keyed by types that cannot be known in
+        advance, are listed as dynamic; requirements that they may satisfy
+        are not reported.
+
+        :param context:
+          An optional :class:`~.context.Context` containing resources that
+          will be present when this runner is called.
+
+        :return: A :class:`~.validation.Validation` describing the checks
+                 made.
+        """
+        return validate(self.compile(), () if context is None else context)
+
+    def __call__(self, context=None, executor=None, process_executor=None,
+                 resources=None):
         """
         Execute the callables in this runner in the required order
         storing objects that are returned and providing them as
         arguments or keyword parameters when required.
 
         A runner may be called multiple times. Each time a new
-        :class:`~.context.Context` will be created meaning that no required
-        objects are kept between calls and all callables will be
-        called each time.
+        :class:`~.context.Context` will be created, so resources are only
+        kept between calls by callables with a :class:`~.declarations.scope`
+        and results are only re-used by callables declared using
+        :class:`~.declarations.memoize`. All other callables will be called
+        each time.
 
         :param context:
-          Used for passing a context when context managers are used.
+          The :class:`~.context.Context` in which to run.
           You should never need to pass this parameter.
+
+        :param executor:
+          An optional :class:`~concurrent.futures.Executor`. If supplied,
+          callables that have no dependencies on each other will be called
+          concurrently using it. See :ref:`concurrent-execution`.
+
+        :param process_executor:
+          An optional :class:`~concurrent.futures.ProcessPoolExecutor` used to
+          call any callables that are declared to run in ``'process'``.
+          See :ref:`process-execution`.
+
+        :param resources:
+          An optional mapping of key to resource with which the context
+          will be seeded before any callables are called.
+          See :ref:`seeding`.
         """
+        return self._call(context, executor, process_executor, resources,
+                          None)
+
+    def _context(self, plan, context, executor, process_executor, resources):
         if context is None:
-            context = Context()
-            context.point = self.start
+            if executor is None:
+                context = plan.context()
+            else:
+                context = Context()
+        if resources:
+            for key, resource in resources.items():
+                context.add(resource, key)
+        if process_executor is not None:
+            context.process_executor = process_executor
+        if self.validate_on_call and plan.validation is None:
+            plan.validation = validate(plan, context)
+        return context
+
+    def _call(self, context, executor, process_executor, resources, batch):
+        plan = self.compile()
+        context = self._context(plan, context, executor, process_executor,
+                                resources)
+        if plan.scoped:
+            scope = Scope() if batch is None else batch.scope
+            context.scopes = self._scopes(scope)
+            if batch is None:
+                try:
+                    return self._run(plan, context, executor)
+                finally:
+                    scope.close()
+        return self._run(plan, context, executor)
+
+    def _scopes(self, batch_scope):
+        if self._process_scope is None:
+            self._process_scope = Scope()
+        return {'process': self._process_scope, 'batch': batch_scope}
+
+    @staticmethod
+    def _run(plan, context, executor):
+        if plan.tracer is not None:
+            return trace_run(plan.tracer, context, Runner._execute,
+                             plan, context, executor)
+        return Runner._execute(plan, context, executor)
+
+    @staticmethod
+    def _execute(plan, context, executor):
+        if executor is None:
+            return plan(context)
+        return run_with_executor(plan, context, plan.steps, executor)
+
+    def stream(self, context=None, process_executor=None, resources=None):
+        """
+        Execute the callables in this runner as described in
+        :meth:`__call__`, returning an iterator that yields the result
+        once for each item of any iterable returned by a callable declared
+        to return using :class:`streams`. See :ref:`streaming`.
+
+        The callables are executed as the iterator is consumed.
+        """
+        plan = self.compile()
+        context = self._context(plan, context, None, process_executor,
+                                resources)
+        scope = None
+        if plan.scoped:
+            scope = Scope()
+            context.scopes = self._scopes(scope)
+        results = plan.stream(context)
+        if plan.tracer is not None:
+            results = trace_iterator(plan.tracer, context, results)
+        try:
+            for result in results:
+                yield result
+        finally:
+            if scope is not None:
+                scope.close()
+
+    def pipeline(self, labels, max_queued=10, context=None,
+                 process_executor=None, resources=None):
+        """
+        Execute the callables in this runner as described in :meth:`stream`,
+        but split into stages after each of the supplied labels, with each
+        stage executed in its own thread. See :ref:`pipelines`.
+
+        :param labels: The labels after which new stages start.
+
+        :param max_queued: The maximum number of items that may be waiting
+                           between two stages before the earlier stage is
+                           made to wait.
+        """
+        plan = self.compile()
+        points = [self.labels[label] for label in labels]
+        context = self._context(plan, context, None, process_executor,
+                                resources)
+        scope = None
+        if plan.scoped:
+            scope = Scope()
+            context.scopes = self._scopes(scope)
+        results = run_pipeline(plan, context, points, max_queued)
+        if plan.tracer is not None:
+            results = trace_iterator(plan.tracer, context, results)
+        try:
+            for result in results:
+                yield result
+        finally:
+            if scope is not None:
+                scope.close()
+
+    def map(self, inputs, seed, executor=None, ordered=True):
+        """
+        Execute the callables in this runner once for each of the supplied
+        inputs, returning an iterator of the results.
+        Each input is added to the context of its run with the supplied key.
 
-        result = None
+        The callables at the start of this runner that do not depend on the
+        input are only called once, with the resources they return being
+        shared by every run. Any context managers they return are kept open
+        until all the runs have completed. All the runs are treated as one
+        :class:`Batch`.
 
-        while context.point:
+        :param inputs: An iterable of inputs, which will be consumed as
+                       results are returned.
 
-            point = context.point
-            context.point = point.next
+        :param seed: The key with which each input is added to the context.
 
+        :param executor:
+          An optional :class:`~concurrent.futures.Executor`, such as a
+          :class:`~concurrent.futures.ThreadPoolExecutor`, in which the runs
+          will take place.
+
+        :param ordered: If false, results are returned as each run
+                        completes, rather than in the order of the inputs.
+
+        :return: An iterator that yields the result of each run or, if it
+                 failed, the :class:`~.context.ContextError` raised. Any
+                 other exception is raised from the iterator.
+        """
+        plan = self.compile()
+        if self.validate_on_call and plan.validation is None:
+            plan.validation = validate(plan, (seed,))
+        prefix = invariant_prefix(plan, seed)
+        steps = plan.steps[prefix:]
+
+        base = plan.context()
+        scope = None
+        if plan.scoped:
+            scope = Scope()
+            base.scopes = self._scopes(scope)
+        # context managers returned by the shared steps stay open for all
+        # the runs:
+        shared = Scope()
+        try:
+            plan.prepare(base, plan.steps[:prefix], shared)
+
+            def call(item):
+                context = base.copy()
+                try:
+                    context.add(item, seed)
+                    if plan.tracer is None:
+                        return plan.run(context, iter(steps))
+                    return trace_run(plan.tracer, context, plan.run,
+                                     context, iter(steps))
+                except ContextError as e:
+                    return e
+
+            if executor is None:
+                for item in inputs:
+                    yield call(item)
+            else:
+                for result in map_with_executor(
+                    call, inputs, executor, ordered, self.map_window
+                ):
+                    yield result
+        finally:
             try:
-                result = point(context)
-            except ContextError as e:
-                raise ContextError(str(e), point, context)
+                shared.close()
+            finally:
+                if scope is not None:
+                    scope.close()
 
-            if getattr(result, '__enter__', None):
-                with result as manager:
-                    if manager not in (None, result):
-                        context.add(manager, manager.__class__)
-                    result = None
-                    result = self(context)
+    def batch(self):
+        """
+        Return a :class:`Batch` of calls to this runner that will share the
+        resources of callables with a ``'batch'`` scope.
+        See :ref:`scopes`.
+        """
+        return Batch(self)
 
-        return result
+    def close(self):
+        """
+        Exit any context managers returned by callables with a
+        ``'process'`` scope and forget the resources they returned, so that
+        they will be called again the next time this runner is called.
+        See :ref:`scopes`.
+        """
+        if self._process_scope is not None:
+            self._process_scope.close()
 
     def __repr__(self):
         bits = []
@@ -264,3 +627,35 @@ class Runner(object):
         return '<Runner>%s</Runner>' % ''.join(bits)
 
 
+class Batch(object):
+    """
+    A sequence of calls to a :class:`Runner` that share the resources
+    returned by callables with a ``'batch'`` :class:`~.declarations.scope`.
+    These should be obtained using :meth:`Runner.batch` and used as a
+    context manager, so that :meth:`close` is called at the end of the batch.
+    """
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.scope = Scope()
+
+    def __call__(self, context=None, executor=None, process_executor=None,
+                 resources=None):
+        """
+        Call the runner as described in :meth:`Runner.__call__`.
+        """
+        return self.runner._call(context, executor, process_executor,
+                                 resources, self)
+
+    def close(self):
+        """
+        Exit any context managers returned by callables with a ``'batch'``
+        scope and forget the resources they returned.
+        """
+        self.scope.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, obj, tb):
+        self.close()
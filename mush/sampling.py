@@ -0,0 +1,193 @@
+"""
+.. currentmodule:: mush
+
+A :class:`~.tracing.Tracer` that records the calls made by only some of the
+runs of a :class:`Runner`, keeping the most recent of them in a fixed-size
+buffer.
+"""
+from collections import deque
+from threading import Lock
+
+from .compat import monotonic
+from .context import ContextError
+from .tracing import Tracer, origin, point_name
+
+
+class Trace(object):
+    """
+    The calls made during a single run recorded by a :class:`Sampler`.
+    """
+
+    #: Why this trace was kept: ``'sampled'``, ``'error'`` or ``'slow'``.
+    reason = None
+
+    #: The time at which the run started.
+    start = None
+
+    #: The number of seconds the run took.
+    elapsed = None
+
+    #: The exception raised by the run, if any.
+    error = None
+
+    def __init__(self, sampled, parent):
+        self.sampled = sampled
+        self.parent = parent
+        #: A list of ``(point, start, elapsed, error)`` for each call made.
+        self.points = []
+
+    def as_dict(self):
+        """
+        Return this trace as a :class:`dict` containing only strings and
+        numbers, so that it can be serialised.
+        """
+        return {
+            'reason': self.reason,
+            'start': self.start,
+            'elapsed': self.elapsed,
+            'error': None if self.error is None else repr(self.error),
+            'points': [{
+                'name': point_name(point),
+                'labels': sorted(point.labels),
+                'start': start,
+                'elapsed': elapsed,
+                'error': None if error is None else repr(error),
+            } for point, start, elapsed, error in self.points],
+        }
+
+    def __repr__(self):
+        return '<Trace: %s, %i points, %.6fs>' % (
+            self.reason, len(self.points), self.elapsed
+        )
+
+
+class Sampler(Tracer):
+    """
+    A :class:`~.tracing.Tracer` that decides when each run starts whether to
+    record it and, when each run ends, whether to keep what was recorded.
+    See :ref:`sampling`.
+
+    :param every: If specified, one in every ``every`` runs is sampled.
+
+    :param rate: If specified, no more than this number of runs are sampled
+                 each second.
+
+    :param slower_than: If specified, runs that take at least this many
+                        seconds are kept even if they were not sampled.
+
+    :param errors: Runs that raise an exception of one of these types are
+                   kept even if they were not sampled.
+
+    :param size: The number of traces kept, with the oldest being discarded
+                 once this number is reached.
+
+    If neither ``every`` nor ``rate`` are specified, no runs are sampled and
+    only runs that are kept because they were slow or raised an exception
+    will be recorded.
+
+    Keeping runs that are slow or raise an exception requires every run to be
+    recorded, as whether it will be kept is not known until it ends. Only
+    when ``slower_than`` is not specified and ``errors`` is empty are the
+    calls made by runs that are not sampled left untraced, making them
+    almost as cheap as they would be without a tracer.
+    """
+
+    #: The number of runs that have started.
+    runs = 0
+
+    #: The number of runs that were sampled when they started.
+    sampled = 0
+
+    #: The number of traces that have been kept.
+    kept = 0
+
+    def __init__(self, every=None, rate=None, slower_than=None,
+                 errors=(ContextError,), size=100):
+        self.every = every
+        self.rate = rate
+        self.slower_than = slower_than
+        self.errors = errors
+        self.traces = deque(maxlen=size)
+        self.lock = Lock()
+        self.capacity = None if rate is None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.refilled = monotonic()
+        self.active = {}
+        #: Whether runs that are not sampled must still be recorded so that
+        #: they can be kept if they are slow or raise an exception.
+        self.tail = slower_than is not None or bool(errors)
+
+    def sample(self):
+        """
+        Return ``True`` if the run that is starting should be sampled.
+        """
+        with self.lock:
+            self.runs += 1
+            if self.every is None and self.rate is None:
+                return False
+            if self.every is not None and self.runs % self.every:
+                return False
+            if self.rate is not None:
+                now = monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.refilled) * self.rate
+                )
+                self.refilled = now
+                if self.tokens < 1:
+                    return False
+                self.tokens -= 1
+            self.sampled += 1
+            return True
+
+    def run_start(self, context):
+        sampled = self.sample()
+        key = origin()
+        parent = self.active.get(key)
+        # a run within a recorded run must be tracked so that the end of
+        # the outer run is not mistaken for the end of this one:
+        if sampled or self.tail or parent is not None:
+            self.active[key] = Trace(sampled, parent)
+            return True
+        # the calls in runs that are not recorded are not traced at all:
+        return False
+
+    def run_end(self, context, start, elapsed, error):
+        key = origin()
+        trace = self.active.pop(key, None)
+        if trace is None:
+            return
+        if trace.parent is not None:
+            self.active[key] = trace.parent
+            trace.parent = None
+        if trace.sampled:
+            reason = 'sampled'
+        elif error is not None and isinstance(error, self.errors):
+            reason = 'error'
+        elif self.slower_than is not None and elapsed >= self.slower_than:
+            reason = 'slow'
+        else:
+            return
+        trace.reason = reason
+        trace.start = start
+        trace.elapsed = elapsed
+        trace.error = error
+        with self.lock:
+            self.traces.append(trace)
+            self.kept += 1
+
+    def point_end(self, point, start, elapsed, error):
+        trace = self.active.get(origin())
+        if trace is not None:
+            trace.points.append((point, start, elapsed, error))
+
+    def dump(self, clear=True):
+        """
+        Return a list of the :class:`Trace` instances kept, oldest first,
+        removing them from this sampler unless ``clear`` is false.
+        """
+        with self.lock:
+            traces = list(self.traces)
+            if clear:
+                self.traces.clear()
+        return traces
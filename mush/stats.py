@@ -0,0 +1,270 @@
+"""
+.. currentmodule:: mush
+
+A :class:`~.tracing.Tracer` that collects call counts, error counts and
+latency histograms for each point of a :class:`Runner` along with its runs.
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+from os import rename
+from threading import Lock
+
+from .factory import Factory
+from .tracing import Tracer, unique_names
+
+
+class Histogram(object):
+    """
+    A histogram of durations, in seconds, that uses a fixed amount of memory
+    however many durations are added. Each bucket covers twice the range of
+    the one before it, from one microsecond up to around eighteen minutes,
+    with a final bucket for anything longer.
+    """
+
+    #: The upper bounds of the buckets, in seconds.
+    bounds = tuple(1e-6 * 2 ** i for i in range(31))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        #: The number of durations added.
+        self.count = 0
+        #: The sum of the durations added.
+        self.total = 0.0
+        #: The longest duration added.
+        self.max = 0.0
+
+    def add(self, value):
+        """
+        Add a duration to this histogram.
+        """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """
+        Return an estimate of the supplied percentile of the durations added,
+        interpolated within the bucket it falls in, or ``None`` if no
+        durations have been added.
+        """
+        if not self.count:
+            return None
+        rank = self.count * percent / 100.0
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(self.bounds + (self.max,), self.counts):
+            if count and seen + count >= rank:
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.max
+
+    def as_dict(self):
+        """
+        Return a summary of the durations added as a :class:`dict`.
+        """
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+class PointStats(object):
+    """
+    The statistics collected for a single :class:`~.callpoints.CallPoint`.
+    """
+
+    def __init__(self, point):
+        self.point = point
+        #: The number of times the point's callable has been called.
+        self.calls = 0
+        #: The number of those calls that raised an exception.
+        self.errors = 0
+        #: A :class:`Histogram` of how long those calls took.
+        self.latency = Histogram()
+
+    def as_dict(self, runs):
+        obj = self.point.obj
+        stats = {
+            'labels': sorted(self.point.labels),
+            'calls': self.calls,
+            'errors': self.errors,
+            'latency': self.latency.as_dict(),
+        }
+        if isinstance(obj, Factory):
+            stats['resolved'] = float(self.calls) / runs if runs else None
+        cache = getattr(obj, '__mush_memoize__', None)
+        if cache is not None:
+            stats['cache'] = {'hits': cache.hits, 'misses': cache.misses}
+        return stats
+
+
+def escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Stats(Tracer):
+    """
+    A :class:`~.tracing.Tracer` that keeps counts and latency
+    :class:`Histogram` instances for the runs of the :class:`Runner` it is
+    installed on, along with those of each point that is called.
+    See :ref:`stats`.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        #: The :class:`PointStats` for each point that has been called,
+        #: in the order they were first called.
+        self.points = OrderedDict()
+        #: The number of runs that have completed.
+        self.runs = 0
+        #: The number of those runs that raised an exception.
+        self.run_errors = 0
+        #: A :class:`Histogram` of how long those runs took.
+        self.run_latency = Histogram()
+
+    def run_end(self, context, start, elapsed, error):
+        with self.lock:
+            self.runs += 1
+            if error is not None:
+                self.run_errors += 1
+            self.run_latency.add(elapsed)
+
+    def point_end(self, point, start, elapsed, error):
+        with self.lock:
+            stats = self.points.get(point)
+            if stats is None:
+                stats = self.points[point] = PointStats(point)
+            stats.calls += 1
+            if error is not None:
+                stats.errors += 1
+            stats.latency.add(elapsed)
+
+    def names(self):
+        """
+        Return a list of pairs of unique name and :class:`PointStats`.
+        Points are named after their callables, with a suffix added to the
+        names of any points after the first with the same callable name.
+        """
+        return list(zip(unique_names(self.points), self.points.values()))
+
+    def as_dict(self):
+        """
+        Return the statistics collected as a :class:`dict`.
+
+        For lazy points, ``resolved`` is the proportion of runs in which the
+        resource was needed. For points declared using
+        :class:`~.declarations.memoize`, ``cache`` gives the hits and misses
+        of their cache.
+        """
+        with self.lock:
+            runs = self.runs
+            return {
+                'runs': runs,
+                'errors': self.run_errors,
+                'latency': self.run_latency.as_dict(),
+                'points': OrderedDict(
+                    (name, stats.as_dict(runs)) for name, stats in self.names()
+                ),
+            }
+
+    def prometheus(self, prefix='mush'):
+        """
+        Return the statistics collected in the Prometheus text exposition
+        format, with each metric name starting with the supplied prefix.
+        """
+        lines = []
+
+        def metric(name, type, help):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, type))
+
+        def sample(name, labels, value):
+            if labels:
+                name += '{%s}' % ','.join(
+                    '%s="%s"' % (key, escape(text)) for key, text in labels
+                )
+            lines.append('%s_%s %r' % (prefix, name, value))
+
+        def histogram(name, labels, histogram):
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                sample(name + '_bucket', labels + [('le', repr(bound))],
+                       cumulative)
+            sample(name + '_bucket', labels + [('le', '+Inf')],
+                   histogram.count)
+            sample(name + '_sum', labels, histogram.total)
+            sample(name + '_count', labels, histogram.count)
+
+        with self.lock:
+            names = self.names()
+
+            metric('runs_total', 'counter', 'Runs completed.')
+            sample('runs_total', None, self.runs)
+            metric('run_errors_total', 'counter', 'Runs that raised.')
+            sample('run_errors_total', None, self.run_errors)
+            metric('run_seconds', 'histogram', 'Duration of runs.')
+            histogram('run_seconds', [], self.run_latency)
+
+            metric('point_calls_total', 'counter', 'Calls made to each point.')
+            for name, stats in names:
+                sample('point_calls_total', [('point', name)], stats.calls)
+            metric('point_errors_total', 'counter',
+                   'Calls to each point that raised.')
+            for name, stats in names:
+                sample('point_errors_total', [('point', name)], stats.errors)
+            metric('point_seconds', 'histogram',
+                   'Duration of calls to each point.')
+            for name, stats in names:
+                histogram('point_seconds', [('point', name)], stats.latency)
+            metric('point_max_seconds', 'gauge',
+                   'Longest call made to each point.')
+            for name, stats in names:
+                sample('point_max_seconds', [('point', name)],
+                       stats.latency.max)
+
+            lazy = [(name, stats) for name, stats in names
+                    if isinstance(stats.point.obj, Factory)]
+            if lazy and self.runs:
+                metric('point_resolved_ratio', 'gauge',
+                       'Proportion of runs that resolved each lazy point.')
+                for name, stats in lazy:
+                    sample('point_resolved_ratio', [('point', name)],
+                           float(stats.calls) / self.runs)
+
+            caches = [(name, getattr(stats.point.obj, '__mush_memoize__',
+                                     None)) for name, stats in names]
+            caches = [(name, cache) for name, cache in caches
+                      if cache is not None]
+            if caches:
+                metric('point_cache_hits_total', 'counter',
+                       'Cache hits for each memoized point.')
+                for name, cache in caches:
+                    sample('point_cache_hits_total', [('point', name)],
+                           cache.hits)
+                metric('point_cache_misses_total', 'counter',
+                       'Cache misses for each memoized point.')
+                for name, cache in caches:
+                    sample('point_cache_misses_total', [('point', name)],
+                           cache.misses)
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='mush'):
+        """
+        Write the output of :meth:`prometheus` to the file at the supplied
+        path. The output is written to a temporary file that is then renamed,
+        so that a collector reading the file never sees partial output.
+        """
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as output:
+            output.write(self.prometheus(prefix))
+        rename(temporary, path)
@@ -0,0 +1,31 @@
+"""
+Callables and runners shared by the tests of the tracers.
+"""
+from mush.runner import Runner
+
+
+def fetch():
+    return 'a b'
+
+
+def count(page):
+    return len(page.split())
+
+
+def double(x):
+    return x * 2
+
+
+def make_runner(tracer, lazy=False, between=()):
+    """
+    Return a runner instrumented with the supplied tracer in which
+    ``fetch`` returns a page and ``count`` counts the words on it, with any
+    callables in ``between`` added between them.
+    """
+    runner = Runner()
+    runner.add(fetch, returns='page', label='fetch', lazy=lazy)
+    for obj in between:
+        runner.add(obj)
+    runner.add(count, requires='page', returns='words')
+    runner.instrument(tracer)
+    return runner
@@ -0,0 +1,612 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import ShouldRaise, compare
+
+from mush.asyncio import AsyncRunner
+from mush.context import Context, ContextError
+from mush.declarations import (
+    requires, returns, lazy, batched, single_flight, streams
+)
+from mush.sampling import Sampler
+from mush.timeline import ChromeTrace
+from mush.tracing import Tracer
+
+
+def run(awaitable):
+    return asyncio.run(awaitable)
+
+
+class T1(object): pass
+class T2(object): pass
+
+
+def square(x):
+    return x * x
+
+
+class TestAsyncRunner(TestCase):
+
+    def test_sync_callables(self):
+        def job1():
+            return T1()
+
+        @requires(T1)
+        def job2(obj):
+            return type(obj)
+
+        compare(run(AsyncRunner(job1, job2)()), expected=T1)
+
+    def test_coroutines(self):
+        m = Mock()
+
+        async def job1() -> 'x':
+            await asyncio.sleep(0)
+            return 1
+
+        async def job2(x: 'x') -> 'y':
+            m.job2(x)
+            return x + 1
+
+        def job3(y: 'y'):
+            m.job3(y)
+            return y * 10
+
+        context = Context()
+        compare(run(AsyncRunner(job1, job2, job3)(context)), expected=20)
+        compare(context, expected={'x': 1, 'y': 2, int: 20})
+        compare(m.mock_calls, expected=[call.job2(1), call.job3(2)])
+
+    def test_awaitable_returned(self):
+        async def make():
+            return 'x'
+
+        def job():
+            return make()
+
+        compare(run(AsyncRunner(job)()), expected='x')
+
+    def test_lazy_coroutine(self):
+        m = Mock()
+
+        @lazy
+        @returns('conn')
+        async def connect():
+            m.connect()
+            return 'connection'
+
+        @lazy
+        @returns('unused')
+        async def unused():
+            raise AssertionError('should not be called')  # pragma: no cover
+
+        @lazy
+        @requires('conn')
+        @returns('cursor')
+        def cursor(conn):
+            m.cursor(conn)
+            return conn + ' cursor'
+
+        @requires('cursor', 'conn')
+        def job(cursor, conn):
+            return cursor, conn
+
+        runner = AsyncRunner(connect, unused, cursor, job)
+        compare(run(runner()),
+                expected=('connection cursor', 'connection'))
+        compare(m.mock_calls, expected=[
+            call.connect(), call.cursor('connection'),
+        ])
+
+    def test_async_context_manager(self):
+        m = Mock()
+
+        class Manager(object):
+            pass
+
+        class Transaction(object):
+            async def __aenter__(self):
+                m.enter()
+                return Manager()
+            async def __aexit__(self, type, obj, tb):
+                m.exit(type)
+
+        async def job(manager: Manager):
+            m.job(type(manager))
+            return 'done'
+
+        compare(run(AsyncRunner(Transaction, job)()), expected='done')
+        compare(m.mock_calls, expected=[
+            call.enter(), call.job(Manager), call.exit(None),
+        ])
+
+    def test_async_context_manager_suppresses(self):
+        m = Mock()
+
+        class Transaction(object):
+            async def __aenter__(self):
+                m.enter()
+            async def __aexit__(self, type, obj, tb):
+                m.exit(type)
+                return True
+
+        async def bad():
+            raise Exception()
+
+        def after():
+            m.after()
+            return 'after'
+
+        compare(run(AsyncRunner(Transaction, bad, after)()), expected='after')
+        compare(m.mock_calls, expected=[
+            call.enter(), call.exit(Exception), call.after(),
+        ])
+
+    def test_sync_context_manager(self):
+        m = Mock()
+
+        class CM(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+
+        async def job():
+            m.job()
+
+        run(AsyncRunner(CM, job)())
+        compare(m.mock_calls, expected=[
+            call.enter(), call.job(), call.exit(None),
+        ])
+
+    def test_missing(self):
+        async def job(x: 'x'):
+            pass  # pragma: no cover
+
+        with ShouldRaise(ContextError) as s:
+            run(AsyncRunner(job)())
+        compare(s.raised.text, expected="No 'x' in context")
+        compare(s.raised.point.obj, expected=job)
+
+    def test_validate_on_call(self):
+        m = Mock()
+
+        async def expensive():
+            m.expensive()  # pragma: no cover
+
+        async def job(x: 'x'):
+            pass  # pragma: no cover
+
+        runner = AsyncRunner(expensive, job)
+        runner.validate_on_call = True
+        with ShouldRaise(ContextError):
+            run(runner())
+        compare(m.mock_calls, expected=[])
+        compare(run(runner(resources={'x': 1})), expected=None)
+        compare(m.mock_calls, expected=[call.expensive()])
+
+    def test_resources(self):
+        async def job(x: 'x'):
+            return x + 1
+
+        compare(run(AsyncRunner(job)(resources={'x': 1})), expected=2)
+
+    def test_batched(self):
+        m = Mock()
+
+        @batched(max_size=2, max_wait=5)
+        def score(xs: 'x') -> 'y':
+            m.score(sorted(xs))
+            return [x * 10 for x in xs]
+
+        runner = AsyncRunner(score)
+
+        async def both():
+            return await asyncio.gather(
+                runner(resources={'x': 1}), runner(resources={'x': 2})
+            )
+
+        compare(run(both()), expected=[10, 20])
+        compare(m.mock_calls, expected=[call.score([1, 2])])
+
+    def test_single_flight(self):
+        m = Mock()
+
+        @single_flight
+        async def load_config(tenant: 'tenant') -> 'config':
+            m.load(tenant)
+            await asyncio.sleep(0.01)
+            return tenant + ' config'
+
+        runner = AsyncRunner(load_config)
+
+        async def calls():
+            return await asyncio.gather(*(
+                runner(resources={'tenant': tenant})
+                for tenant in ('a', 'a', 'b', 'a')
+            ))
+
+        compare(run(calls()), expected=[
+            'a config', 'a config', 'b config', 'a config',
+        ])
+        compare(m.mock_calls, expected=[call.load('a'), call.load('b')])
+        compare(load_config.__mush_single_flight__, expected={})
+        # once complete, calls are made again:
+        compare(run(runner(resources={'tenant': 'a'})), expected='a config')
+        compare(len(m.mock_calls), expected=3)
+
+    def test_single_flight_lazy(self):
+        m = Mock()
+
+        @single_flight
+        @lazy
+        async def load_config(tenant: 'tenant') -> 'config':
+            m.load(tenant)
+            await asyncio.sleep(0.01)
+            return tenant + ' config'
+
+        async def job(config: 'config'):
+            return config
+
+        runner = AsyncRunner(load_config, job)
+
+        async def calls():
+            return await asyncio.gather(
+                runner(resources={'tenant': 'a'}),
+                runner(resources={'tenant': 'a'}),
+            )
+
+        compare(run(calls()), expected=['a config', 'a config'])
+        compare(m.mock_calls, expected=[call.load('a')])
+
+    def test_single_flight_exception(self):
+        m = Mock()
+
+        @single_flight
+        async def bad(x: 'x') -> 'y':
+            m.bad()
+            await asyncio.sleep(0.01)
+            raise ValueError('boom')
+
+        runner = AsyncRunner(bad)
+
+        async def calls():
+            return await asyncio.gather(
+                runner(resources={'x': 1}), runner(resources={'x': 1}),
+                return_exceptions=True,
+            )
+
+        results = run(calls())
+        compare([str(r) for r in results], expected=['boom', 'boom'])
+        compare(m.mock_calls, expected=[call.bad()])
+
+    def test_single_flight_unhashable(self):
+        m = Mock()
+
+        @single_flight
+        async def job(x: 'x'):
+            m.job()
+
+        runner = AsyncRunner(job)
+
+        async def calls():
+            await asyncio.gather(
+                runner(resources={'x': []}), runner(resources={'x': []})
+            )
+
+        run(calls())
+        compare(m.mock_calls, expected=[call.job(), call.job()])
+
+    def test_single_flight_sync(self):
+        @single_flight
+        def job(x: 'x'):
+            return x
+
+        compare(run(AsyncRunner(job)(resources={'x': 1})), expected=1)
+
+    def test_loader(self):
+        m = Mock()
+
+        @batched(max_size=10)
+        async def load(tenants: 'tenant') -> 'config':
+            m.load(tenants)
+            return [tenant + ' config' for tenant in tenants]
+
+        runner = AsyncRunner(load)
+
+        async def calls():
+            return await asyncio.gather(*(
+                runner(resources={'tenant': tenant})
+                for tenant in ('a', 'b', 'a', 'c')
+            ))
+
+        compare(run(calls()), expected=[
+            'a config', 'b config', 'a config', 'c config',
+        ])
+        compare(m.mock_calls, expected=[call.load(['a', 'b', 'c'])])
+        compare(load.__mush_batched__.calls, expected=3)
+
+    def test_loader_max_size(self):
+        m = Mock()
+
+        @batched(max_size=2)
+        async def load(keys: 'key') -> 'value':
+            m.load(keys)
+            return keys
+
+        runner = AsyncRunner(load)
+
+        async def calls():
+            return await asyncio.gather(*(
+                runner(resources={'key': key}) for key in range(3)
+            ))
+
+        compare(run(calls()), expected=[0, 1, 2])
+        compare(m.mock_calls, expected=[call.load([0, 1]), call.load([2])])
+
+    def test_loader_exception(self):
+        @batched()
+        async def load(keys: 'key') -> 'value':
+            raise ValueError('boom')
+
+        runner = AsyncRunner(load)
+
+        async def calls():
+            return await asyncio.gather(
+                runner(resources={'key': 1}), runner(resources={'key': 2}),
+                return_exceptions=True,
+            )
+
+        compare([str(r) for r in run(calls())], expected=['boom', 'boom'])
+
+    def test_loader_lazy(self):
+        m = Mock()
+
+        @lazy
+        @batched()
+        async def load(tenants: 'tenant') -> 'config':
+            m.load(tenants)
+            return [tenant.upper() for tenant in tenants]
+
+        async def job(config: 'config'):
+            return config
+
+        runner = AsyncRunner(load, job)
+
+        async def calls():
+            return await asyncio.gather(
+                runner(resources={'tenant': 'a'}),
+                runner(resources={'tenant': 'b'}),
+            )
+
+        compare(run(calls()), expected=['A', 'B'])
+        compare(m.mock_calls, expected=[call.load(['a', 'b'])])
+
+    def test_streams(self):
+        def lines() -> streams('line'):
+            yield 'a'
+            yield 'b'
+
+        async def upper(line: 'line') -> 'upper':
+            return line.upper()
+
+        compare(run(AsyncRunner(lines, upper)()), expected='B')
+
+    def test_streams_async_generator(self):
+        m = Mock()
+
+        async def lines() -> streams('line'):
+            for line in ('a', 'b'):
+                await asyncio.sleep(0)
+                yield line
+
+        async def upper(line: 'line') -> 'upper':
+            m.upper(line)
+            return line.upper()
+
+        context = Context()
+        compare(run(AsyncRunner(lines, upper)(context)), expected='B')
+        compare(m.mock_calls, expected=[call.upper('a'), call.upper('b')])
+        compare(context, expected={})
+
+    def test_streams_key_clash(self):
+        def lines() -> streams('line'):
+            yield 'a'
+
+        with ShouldRaise(ContextError) as s:
+            run(AsyncRunner(lines)(resources={'line': 'x'}))
+        compare(s.raised.text, expected="Context already contains 'line'")
+
+    def test_process(self):
+        async def job(y: 'y'):
+            return y + 1
+
+        runner = AsyncRunner()
+        runner.add(lambda: 3, returns='x')
+        runner.add(square, requires='x', returns='y', runs_in='process')
+        runner.add(job)
+        with ProcessPoolExecutor(1) as executor:
+            compare(run(runner(process_executor=executor)), expected=10)
+
+    def test_instrument(self):
+        m = Mock()
+
+        class Recorder(Tracer):
+            def run_start(self, context):
+                m.run_start()
+            def run_end(self, context, start, elapsed, error):
+                m.run_end(error)
+            def point_start(self, point):
+                m.start(point.obj)
+            def point_end(self, point, start, elapsed, error):
+                m.end(point.obj, error)
+
+        async def job(x: 'x') -> 'y':
+            m.job()
+            await asyncio.sleep(0)
+            return x + 1
+
+        runner = AsyncRunner()
+        runner.add(lambda: 1, returns='x', lazy=True)
+        runner.add(job)
+        runner.instrument(Recorder())
+        compare(run(runner()), expected=2)
+        factory = runner.start.obj
+        compare(m.mock_calls, expected=[
+            call.run_start(),
+            call.start(factory), call.end(factory, None),
+            call.start(job), call.job(), call.end(job, None),
+            call.run_end(None),
+        ])
+
+    def test_instrument_skipped(self):
+        m = Mock()
+        m.tracer.run_start.return_value = False
+
+        class CM(object):
+            def __enter__(self):
+                pass
+            def __exit__(self, type, obj, tb):
+                pass
+
+        async def job(x: 'x') -> 'y':
+            await asyncio.sleep(0)
+            return x + 1
+
+        runner = AsyncRunner(CM)
+        runner.add(lambda: 1, returns='x', lazy=True)
+        runner.add(job)
+        runner.instrument(m.tracer)
+        compare(run(runner()), expected=2)
+        compare([c[0] for c in m.tracer.mock_calls],
+                expected=['run_start', 'run_end'])
+
+    def test_instrument_scopes(self):
+        m = Mock()
+
+        class AsyncCM(object):
+            async def __aenter__(self):
+                pass
+            async def __aexit__(self, type, obj, tb):
+                pass
+
+        class CM(object):
+            def __enter__(self):
+                pass
+            def __exit__(self, type, obj, tb):
+                pass
+
+        runner = AsyncRunner(AsyncCM, CM, m.job)
+        runner.instrument(m.tracer)
+        run(runner())
+        compare([c[0] for c in m.tracer.mock_calls if 'scope' in c[0]],
+                expected=['scope_start', 'scope_start',
+                          'scope_end', 'scope_end'])
+        compare(m.tracer.scope_end.call_args[0][0].__class__,
+                expected=AsyncCM)
+
+    def test_instrument_timeline(self):
+        trace = ChromeTrace()
+
+        async def job(x: 'x') -> 'y':
+            await asyncio.sleep(0)
+
+        runner = AsyncRunner(job)
+        runner.instrument(trace)
+
+        async def calls():
+            await asyncio.gather(runner(resources={'x': 1}),
+                                 runner(resources={'x': 2}))
+
+        run(calls())
+        events = trace.as_dict()['traceEvents']
+        compare([event['name'] for event in events],
+                expected=['job', 'run', 'job', 'run'])
+        # each run is recorded against its own task:
+        compare(len(set(event['tid'] for event in events)), expected=2)
+
+    def test_instrument_sampler(self):
+        sampler = Sampler(every=2)
+
+        async def job(x: 'x') -> 'y':
+            await asyncio.sleep(0)
+
+        runner = AsyncRunner(job)
+        runner.instrument(sampler)
+
+        async def calls():
+            await asyncio.gather(*(runner(resources={'x': i})
+                                   for i in range(4)))
+
+        run(calls())
+        traces = sampler.dump()
+        compare([len(trace.points) for trace in traces], expected=[1, 1])
+        compare(sampler.active, expected={})
+
+    def test_instrument_exception(self):
+        m = Mock()
+        e = ValueError('boom')
+
+        async def job():
+            raise e
+
+        runner = AsyncRunner(job)
+        runner.instrument(m.tracer)
+        with ShouldRaise(e):
+            run(runner())
+        self.assertTrue(m.tracer.point_end.call_args[0][3] is e)
+        self.assertTrue(m.tracer.run_end.call_args[0][3] is e)
+
+    def test_scoped(self):
+        m = Mock()
+        runner = AsyncRunner()
+        runner.add(m.connect, returns='conn', scope='process')
+        with ShouldRaise(TypeError(
+            'scoped callables are not supported by AsyncRunner'
+        )):
+            run(runner())
+        compare(m.mock_calls, expected=[])
+
+    def test_sync_only_methods(self):
+        runner = AsyncRunner(lambda: 1)
+        for name, args in (('stream', ()), ('pipeline', ([],)),
+                           ('map', ([1], 'x')), ('batch', ())):
+            with ShouldRaise(TypeError(
+                '%s() is not supported by AsyncRunner' % name
+            )):
+                getattr(runner, name)(*args)
+
+    def test_release(self):
+        async def parse() -> 'big':
+            return 'big'
+
+        async def summarise(big: 'big') -> 'size':
+            return len(big)
+
+        runner = AsyncRunner()
+        runner.add(parse)
+        runner.add(lambda size: size * 10, requires='size', returns='report',
+                   lazy=True)
+        runner.add(summarise)
+        runner.add(lambda report: report + 1, requires='report',
+                   returns='result')
+        runner.release('result')
+        context = Context()
+        compare(run(runner(context)), expected=31)
+        compare(context, expected={'result': 31})
+
+    def test_clone(self):
+        runner = AsyncRunner(lambda: None)
+        self.assertTrue(isinstance(runner.clone(), AsyncRunner))
+        self.assertTrue(isinstance(runner + runner, AsyncRunner))
+
+    def test_generate(self):
+        expected = TypeError(
+            'generated functions are not supported by AsyncRunner'
+        )
+        with ShouldRaise(expected):
+            AsyncRunner().generate()
+        with ShouldRaise(expected):
+            AsyncRunner().source()
@@ -0,0 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import ShouldRaise, compare
+
+from mush.batching import Batched, Batcher, batching
+from mush.declarations import batched, requires, returns
+from mush.runner import Runner
+
+
+def double(xs):
+    return [x * 2 for x in xs]
+
+
+class TestBatcher(TestCase):
+
+    def test_single_call(self):
+        batcher = Batcher(max_wait=0)
+        compare(batcher.call(double, (1,), {}), expected=2)
+        compare(batcher.batches, expected=1)
+        compare(batcher.calls, expected=1)
+
+    def test_execute(self):
+        m = Mock(return_value=['a', 'b'])
+        batcher = Batcher()
+        compare(batcher.execute(m, [((1,), {'y': 2}), ((3,), {'y': 4})]),
+                expected=['a', 'b'])
+        compare(m.mock_calls, expected=[call([1, 3], y=[2, 4])])
+
+    def test_execute_different_shapes(self):
+        m = Mock(side_effect=[['a', 'c'], ['b']])
+        batcher = Batcher()
+        compare(batcher.execute(m, [((1,), {}), ((2,), {'y': 3}), ((4,), {})]),
+                expected=['a', 'b', 'c'])
+        compare(m.mock_calls, expected=[call([1, 4]), call([2], y=[3])])
+        compare(batcher.batches, expected=2)
+
+    def test_execute_wrong_number_of_results(self):
+        def bad(xs):
+            return []
+        with ShouldRaise(ValueError) as s:
+            Batcher().execute(bad, [((1,), {})])
+        self.assertTrue(str(s.raised).endswith('returned 0 results for 1 calls'))
+
+    def test_concurrent_calls_combined(self):
+        m = Mock(side_effect=double)
+        batcher = Batcher(max_size=3, max_wait=5)
+        with ThreadPoolExecutor(3) as executor:
+            futures = [executor.submit(batcher.call, m, (x,), {})
+                       for x in (1, 2, 3)]
+            compare(sorted(f.result() for f in futures), expected=[2, 4, 6])
+        # max_size was reached, so there was no waiting for max_wait:
+        compare(len(m.mock_calls), expected=1)
+        compare(sorted(m.mock_calls[0].args[0]), expected=[1, 2, 3])
+
+    def test_max_size(self):
+        m = Mock(side_effect=double)
+        batcher = Batcher(max_size=2, max_wait=0.01)
+        with ThreadPoolExecutor(4) as executor:
+            futures = [executor.submit(batcher.call, m, (x,), {})
+                       for x in range(4)]
+            compare(sorted(f.result() for f in futures),
+                    expected=[0, 2, 4, 6])
+        for c in m.mock_calls:
+            self.assertTrue(len(c.args[0]) <= 2)
+        compare(batcher.calls, expected=4)
+
+    def test_exception_raised_for_all_calls(self):
+        started = Event()
+
+        def bad(xs):
+            raise ValueError('boom')
+
+        batcher = Batcher(max_size=2, max_wait=5)
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(batcher.call, bad, (x,), {})
+                       for x in (1, 2)]
+            for future in futures:
+                with ShouldRaise(ValueError('boom')):
+                    future.result()
+
+    def test_repr(self):
+        compare(repr(Batcher(10, 0.5)),
+                expected='<Batcher: max_size=10, max_wait=0.5, '
+                         'batches=0, calls=0>')
+
+
+class TestBatching(TestCase):
+
+    def test_not_batched(self):
+        self.assertTrue(batching(double) is double)
+
+    def test_batched(self):
+        obj = batched(max_wait=0)(lambda xs: xs)
+        wrapped = batching(obj)
+        self.assertTrue(isinstance(wrapped, Batched))
+        self.assertTrue(wrapped.__wrapped__ is obj)
+        compare(wrapped(1), expected=1)
+        compare(repr(wrapped), expected=repr(obj))
+
+
+class TestRunner(TestCase):
+
+    def test_map(self):
+        m = Mock()
+
+        @batched(max_size=4, max_wait=5)
+        @requires('x')
+        @returns('y')
+        def score(xs):
+            m.score(sorted(xs))
+            return [x * 10 for x in xs]
+
+        runner = Runner(score)
+        with ThreadPoolExecutor(4) as executor:
+            compare(list(runner.map(range(4), 'x', executor=executor)),
+                    expected=[0, 10, 20, 30])
+        compare(m.mock_calls, expected=[call.score([0, 1, 2, 3])])
+
+    def test_lazy(self):
+        m = Mock()
+
+        @batched(max_size=2, max_wait=5)
+        @returns('y')
+        def load(xs):
+            m.load(sorted(xs))
+            return xs
+
+        @requires('y')
+        @returns('z')
+        def job(y):
+            return y
+
+        runner = Runner()
+        runner.add(load, requires='x', lazy=True)
+        runner.add(job)
+        with ThreadPoolExecutor(2) as executor:
+            compare(list(runner.map([1, 2], 'x', executor=executor)),
+                    expected=[1, 2])
+        compare(m.mock_calls, expected=[call.load([1, 2])])
+
+    def test_serial(self):
+        @batched(max_wait=0)
+        @requires('x')
+        @returns('y')
+        def score(xs):
+            return [x + 1 for x in xs]
+
+        compare(list(Runner(score).map([1, 2], 'x')), expected=[2, 3])
+        compare(score.__mush_batched__.batches, expected=2)
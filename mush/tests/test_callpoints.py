@@ -2,10 +2,16 @@ from functools import update_wrapper
 from unittest import TestCase
 
 from mock import Mock, call
-from testfixtures import compare
+from testfixtures import ShouldRaise, compare
 
 from mush.callpoints import CallPoint
-from mush.declarations import requires, returns, update_wrapper
+from mush.declarations import (
+    requires, returns, update_wrapper, runs_in, lazy, scope, batched, memoize
+)
+
+
+def square(x):
+    return x * x
 
 
 class TestCallPoints(TestCase):
@@ -20,13 +26,28 @@ class TestCallPoints(TestCase):
         compare(point.next, None)
         compare(point.labels, set())
 
+    def test_compact(self):
+        point1 = CallPoint(square, requires='x', returns='y')
+        point2 = CallPoint(square, requires='x', returns='y')
+        self.assertFalse(hasattr(point1, '__dict__'))
+        self.assertTrue(point1.labels is point2.labels)
+        self.assertTrue(point1.added_using is point2.added_using)
+        self.assertTrue(point1.requires is point2.requires)
+        self.assertTrue(point1.returns is point2.returns)
+
     def test_supplied_explicitly(self):
         obj = object()
         rq = requires('foo')
         rt = returns('bar')
-        result = CallPoint(obj, rq, rt)(self.context)
+        point = CallPoint(obj, rq, rt)
+        result = point(self.context)
         compare(result, self.context.extract.return_value)
-        self.context.extract.assert_called_with(obj, rq, rt)
+        # equal declarations are interned, so may not be those passed:
+        compare(point.requires, expected=rq)
+        compare(point.returns, expected=rt)
+        self.context.extract.assert_called_with(
+            obj, point.requires, point.returns
+        )
 
     def test_extract_from_decorations(self):
         rq = requires('foo')
@@ -36,9 +57,14 @@ class TestCallPoints(TestCase):
         @rt
         def foo(): pass
 
-        result = CallPoint(foo)(self.context)
+        point = CallPoint(foo)
+        result = point(self.context)
         compare(result, self.context.extract.return_value)
-        self.context.extract.assert_called_with(foo, rq, rt)
+        compare(point.requires, expected=rq)
+        compare(point.returns, expected=rt)
+        self.context.extract.assert_called_with(
+            foo, point.requires, point.returns
+        )
 
     def test_extract_from_decorated_class(self):
 
@@ -76,6 +102,71 @@ class TestCallPoints(TestCase):
         compare(result, self.context.extract.return_value)
         self.context.extract.assert_called_with(foo, rq, rt)
 
+    def test_runs_in_default(self):
+        compare(CallPoint(lambda: None).runs_in, expected=None)
+
+    def test_runs_in_supplied(self):
+        point = CallPoint(lambda: None, runs_in='process')
+        compare(point.runs_in, expected='process')
+
+    def test_runs_in_from_decoration(self):
+        @runs_in('process')
+        def foo(): pass
+        compare(CallPoint(foo).runs_in, expected='process')
+
+    def test_runs_in_bad(self):
+        with ShouldRaise(ValueError):
+            CallPoint(lambda: None, runs_in='moon')
+
+    def test_runs_in_lazy(self):
+        @lazy
+        @returns('x')
+        def foo(): pass
+        with ShouldRaise(TypeError(
+            "lazy callables cannot be run in 'process'"
+        )):
+            CallPoint(foo, runs_in='process')
+
+    def test_batched_memoized(self):
+        @batched()
+        @memoize()
+        def foo(xs): pass
+        with ShouldRaise(TypeError('memoized callables cannot be batched')):
+            CallPoint(foo)
+
+    def test_batched_runs_in(self):
+        @batched()
+        def foo(xs): pass
+        with ShouldRaise(TypeError(
+            "batched callables cannot be run in 'process'"
+        )):
+            CallPoint(foo, runs_in='process')
+
+    def test_scope_default(self):
+        compare(CallPoint(lambda: None).scope, expected=None)
+
+    def test_scope_supplied(self):
+        point = CallPoint(lambda: None, scope='batch')
+        compare(point.scope, expected='batch')
+
+    def test_scope_from_decoration(self):
+        @scope('process')
+        def foo(): pass
+        compare(CallPoint(foo).scope, expected='process')
+
+    def test_scope_run(self):
+        compare(CallPoint(lambda: None, scope='run').scope, expected=None)
+
+    def test_scope_bad(self):
+        with ShouldRaise(ValueError("'forever' is not a scope")):
+            CallPoint(lambda: None, scope='forever')
+
+    def test_scope_runs_in(self):
+        with ShouldRaise(TypeError(
+            "callables scoped to 'process' cannot be run in 'process'"
+        )):
+            CallPoint(square, scope='process', runs_in='process')
+
     def test_repr_minimal(self):
         def foo(): pass
         point = CallPoint(foo)
@@ -84,8 +175,7 @@ class TestCallPoints(TestCase):
     def test_repr_maximal(self):
         def foo(): pass
         point = CallPoint(foo, requires('foo'), returns('bar'))
-        point.labels.add('baz')
-        point.labels.add('bob')
+        point.labels = frozenset(('baz', 'bob'))
         compare(repr(foo)+" requires('foo') returns('bar') <-- baz, bob",
                 repr(point))
 
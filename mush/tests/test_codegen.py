@@ -0,0 +1,444 @@
+import gc
+import linecache
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import ShouldRaise, compare
+
+from mush.codegen import call_without_nothing, generated_refs, is_identifier
+from mush.context import Context, ContextError
+from mush.declarations import (
+    requires, returns, returns_mapping, nothing, optional, attr, item, how,
+    lazy
+)
+from mush.markers import missing
+from mush.runner import Runner
+
+
+class T1(object): pass
+class T2(object): pass
+
+
+class TestHelpers(TestCase):
+
+    def test_is_identifier(self):
+        compare(is_identifier('foo'), expected=True)
+        compare(is_identifier('foo-bar'), expected=False)
+        compare(is_identifier('class'), expected=False)
+        compare(is_identifier(1), expected=False)
+
+    def test_call_without_nothing(self):
+        def job(a, b=2, c=3):
+            return a, b, c
+        compare(call_without_nothing(job, (1, nothing), {'c': nothing}),
+                expected=(1, 2, 3))
+
+
+class TestGenerate(TestCase):
+
+    def check(self, runner, expected):
+        # the generated function must behave exactly as the runner does
+        compare(runner(), expected=expected)
+        compare(runner.generate()(), expected=expected)
+
+    def test_empty(self):
+        self.check(Runner(), None)
+
+    def test_cached(self):
+        runner = Runner(lambda: None)
+        function = runner.generate()
+        self.assertTrue(runner.generate() is function)
+        runner.add(lambda: None)
+        self.assertFalse(runner.generate() is function)
+
+    def test_source(self):
+        def job():
+            return 1
+        runner = Runner(job)
+        source = runner.source()
+        self.assertTrue(source.startswith('def run(context=None):\n'))
+        self.assertTrue('result = obj_0()\n' in source)
+        compare(runner.generate().source, expected=source)
+
+    def test_source_in_linecache(self):
+        function = Runner(lambda: None).generate()
+        filename = function.__code__.co_filename
+        compare(''.join(linecache.getlines(filename)),
+                expected=function.source)
+
+    def test_source_removed_from_linecache(self):
+        function = Runner(lambda: None).generate()
+        filename = function.__code__.co_filename
+        self.assertTrue(filename in linecache.cache)
+        del function
+        gc.collect()
+        self.assertFalse(filename in linecache.cache)
+        self.assertFalse(filename in generated_refs)
+
+    def test_supplied_context(self):
+        @requires('foo')
+        def job(foo):
+            return foo + 1
+        context = Context()
+        context.add(1, 'foo')
+        compare(Runner(job).generate()(context), expected=2)
+        compare(context, expected={'foo': 1, int: 2})
+
+    def test_resources(self):
+        m = Mock()
+        t1 = T1()
+
+        def job1():
+            return t1
+
+        @requires(T1)
+        @returns('name')
+        def job2(obj):
+            m.job2(obj)
+            return 'x'
+
+        @requires('name', obj=T1)
+        @returns(T2, 'other')
+        def job3(name, obj):
+            m.job3(name, obj)
+            return 'a', 'b'
+
+        @requires(T2, 'other')
+        def job4(t2, other):
+            m.job4(t2, other)
+            return 'done'
+
+        runner = Runner(job1, job2, job3, job4)
+        self.check(runner, 'done')
+        compare(m.mock_calls, expected=[
+            call.job2(t1), call.job3('x', t1), call.job4('a', 'b'),
+        ] * 2)
+
+    def test_local_for_named_resource(self):
+        @returns('name')
+        def job1():
+            return 'x'
+
+        @requires('name')
+        def job2(name):
+            return name + 'y'
+
+        runner = Runner(job1, job2)
+        self.check(runner, 'xy')
+        self.assertTrue('obj_1(r0)' in runner.source())
+
+    def test_release(self):
+        runner = Runner()
+        runner.add(lambda: 'x', returns='name')
+        runner.add(lambda t: 'y', requires=T1, returns='other')
+        runner.add(lambda name, other: name + other,
+                   requires=('name', 'other'), returns='result')
+        runner.release('result')
+        source = runner.source()
+        # the temporary holding the T1 and the locals holding the released
+        # resources are deleted along with them:
+        self.assertTrue('    release(context, releases_1)\n'
+                        '    del a0\n' in source)
+        self.assertTrue('    release(context, releases_2)\n'
+                        '    del ' in source)
+        self.assertTrue('r0' in source.split('del ')[-1])
+        context = Context()
+        context.add(T1(), T1)
+        compare(runner.generate()(context), expected='xy')
+        compare(context, expected={'result': 'xy'})
+
+    def test_hows(self):
+        class T(object):
+            foo = dict(bar=dict(baz='x'))
+
+        @requires(item(attr(T, 'foo'), 'bar', 'baz'),
+                  optional(attr(T, 'nope')),
+                  attr(optional('nope'), 'foo'))
+        def job(x, y='y', z='z'):
+            return x, y, z
+
+        runner = Runner(T, job)
+        self.check(runner, ('x', 'y', 'z'))
+
+    def test_how_on_local(self):
+        @returns('config')
+        def job1():
+            return dict(x=1)
+
+        @requires(item('config', 'x'), item('config', 'y'))
+        def job2(x, y):
+            pass  # pragma: no cover
+
+        runner = Runner(job1, job2)
+        with ShouldRaise(ContextError) as s:
+            runner.generate()()
+        compare(s.raised.text, expected="No 'config'['y'] in context")
+
+    def test_non_identifier_names(self):
+        class T(object):
+            pass
+
+        def make_t():
+            t = T()
+            setattr(t, 'a-b', 1)
+            return t
+
+        @requires(x=attr(T, 'a-b'), **{'y-z': item('map', 1)})
+        def job(**kw):
+            return kw
+
+        runner = Runner()
+        runner.add(make_t)
+        runner.add(lambda: {1: 2}, returns='map')
+        runner.add(job)
+        self.check(runner, {'x': 1, 'y-z': 2})
+
+    def test_custom_how(self):
+        class double(how):
+            def process(self, o):
+                if o is missing:
+                    return o
+                return o * 2
+
+        @returns('x')
+        def job1():
+            return 2
+
+        @requires(double('x'))
+        def job2(x):
+            return x
+
+        self.check(Runner(job1, job2), 4)
+
+    def test_missing(self):
+        @requires(T1)
+        def job(obj):
+            pass  # pragma: no cover
+
+        runner = Runner(job)
+        with ShouldRaise(ContextError) as s:
+            runner()
+        expected = str(s.raised)
+        with ShouldRaise(ContextError) as s:
+            runner.generate()()
+        compare(str(s.raised), expected=expected)
+
+    def test_context_error_from_callable(self):
+        def job():
+            raise ContextError('oops')
+        with ShouldRaise(ContextError) as s:
+            Runner(job).generate()()
+        compare(s.raised.text, expected='oops')
+        compare(s.raised.point.obj, expected=job)
+
+    def test_already_in_context(self):
+        @returns('x')
+        def job1():
+            return 1
+
+        runner = Runner(job1, job1)
+        with ShouldRaise(ContextError) as s:
+            runner.generate()()
+        compare(s.raised.text, expected="Context already contains 'x'")
+
+    def test_nothing_marker(self):
+        class Marker(object):
+            pass
+
+        def job1():
+            return {Marker: nothing, 'x': 1}
+
+        @requires(Marker, 'x')
+        def job2(x=None, y=None):
+            return x, y
+
+        runner = Runner()
+        runner.add(job1, returns=returns_mapping())
+        runner.add(job2)
+        self.check(runner, (1, None))
+
+    def test_returns_nothing(self):
+        def job():
+            return 1
+        runner = Runner()
+        runner.add(job, returns=nothing)
+        self.check(runner, 1)
+        context = Context()
+        runner.generate()(context)
+        compare(context, expected={})
+
+    def test_lazy(self):
+        m = Mock()
+
+        @lazy
+        @returns('x')
+        def job1():
+            m.job1()
+            return 1
+
+        @lazy
+        @returns('y')
+        def unused():
+            raise AssertionError('should not be called')  # pragma: no cover
+
+        @requires('x', 'x')
+        def job2(a, b):
+            return a + b
+
+        runner = Runner(job1, unused, job2)
+        self.check(runner, 2)
+        compare(m.mock_calls, expected=[call.job1(), call.job1()])
+
+    def test_lazy_last(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='x', lazy=True)
+        self.check(runner, None)
+
+    def test_context_managers(self):
+        m = Mock()
+
+        class CM1(object):
+            def __enter__(self):
+                m.cm1.enter()
+                return self
+            def __exit__(self, type, obj, tb):
+                m.cm1.exit(type)
+
+        class Manager(object):
+            pass
+
+        class CM2(object):
+            def __enter__(self):
+                m.cm2.enter()
+                return Manager()
+            def __exit__(self, type, obj, tb):
+                m.cm2.exit(type)
+
+        @requires(CM1, CM2, Manager)
+        def job(cm1, cm2, manager):
+            m.job()
+            return 'job'
+
+        runner = Runner(CM1, CM2, job)
+        self.check(runner, 'job')
+        compare(m.mock_calls, expected=[
+            call.cm1.enter(), call.cm2.enter(), call.job(),
+            call.cm2.exit(None), call.cm1.exit(None),
+        ] * 2)
+
+    def test_context_manager_suppresses_then_continues(self):
+        m = Mock()
+
+        class CM1(object):
+            def __enter__(self):
+                m.cm1.enter()
+            def __exit__(self, type, obj, tb):
+                m.cm1.exit(type)
+
+        class CM2(object):
+            def __enter__(self):
+                m.cm2.enter()
+            def __exit__(self, type, obj, tb):
+                m.cm2.exit(type)
+                return True
+
+        def bad():
+            m.bad()
+            raise Exception()
+
+        def after():
+            m.after()
+            return 'after'
+
+        runner = Runner(CM1, CM2, bad, after)
+        self.check(runner, 'after')
+        compare(m.mock_calls, expected=[
+            call.cm1.enter(), call.cm2.enter(), call.bad(),
+            call.cm2.exit(Exception), call.after(), call.cm1.exit(None),
+        ] * 2)
+
+    def test_context_manager_suppresses_last(self):
+        class CM(object):
+            def __enter__(self):
+                pass
+            def __exit__(self, type, obj, tb):
+                return True
+
+        def job1():
+            return 1
+
+        def bad():
+            raise Exception()
+
+        self.check(Runner(CM, job1, bad), None)
+
+    def test_context_manager_returned_by_function(self):
+        m = Mock()
+
+        class CM(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+                return True
+
+        def make():
+            return CM()
+
+        def bad():
+            m.bad()
+            raise Exception()
+
+        def after():
+            m.after()
+            return 'after'
+
+        runner = Runner(make, bad, after)
+        self.check(runner, 'after')
+        compare(m.mock_calls, expected=[
+            call.enter(), call.bad(), call.exit(Exception), call.after(),
+        ] * 2)
+
+    def test_context_manager_returned_by_function_within_class(self):
+        m = Mock()
+
+        class Outer(object):
+            def __enter__(self):
+                m.outer.enter()
+            def __exit__(self, type, obj, tb):
+                m.outer.exit(type)
+                return True
+
+        class Inner(object):
+            def __enter__(self):
+                m.inner.enter()
+            def __exit__(self, type, obj, tb):
+                m.inner.exit(type)
+
+        def make():
+            return Inner()
+
+        def job():
+            m.job()
+
+        def bad():
+            m.bad()
+            raise Exception()
+
+        def after():
+            m.after()
+            return 'after'
+
+        runner = Runner(Outer, make, job, bad, after)
+        self.check(runner, 'after')
+        compare(m.mock_calls, expected=[
+            call.outer.enter(), call.inner.enter(), call.job(), call.bad(),
+            call.inner.exit(Exception), call.outer.exit(Exception),
+            call.after(),
+        ] * 2)
+
+    def test_exception_propagates(self):
+        def job():
+            raise ValueError('boom')
+        with ShouldRaise(ValueError('boom')):
+            Runner(job).generate()()
@@ -1,9 +1,11 @@
+import pickle
 from unittest import TestCase
 from mock import Mock
 
 from testfixtures import ShouldRaise, compare
 
-from mush.context import Context, ContextError
+from mush.context import Context, ContextError, SlotContext
+from mush.markers import missing
 
 from mush.declarations import (
     nothing, requires, optional, item,
@@ -266,3 +268,185 @@ class TestContext(TestCase):
         result = context.extract(foo, nothing, nothing)
         compare(result, expected=None)
         compare(context, expected={})
+
+
+    def test_copy(self):
+        context = Context()
+        context.add('foo', 'bar')
+        context.process_executor = executor = object()
+        copy = context.copy()
+        self.assertTrue(type(copy) is Context)
+        compare(copy, expected={'bar': 'foo'})
+        self.assertTrue(copy.process_executor is executor)
+        copy.add('baz', 'bob')
+        compare(context, expected={'bar': 'foo'})
+
+
+class TestSlotContext(TestCase):
+
+    def test_copy(self):
+        context = SlotContext({'foo': 0, 'bar': 1})
+        context.add(1, 'foo')
+        context.add(2, 'baz')
+        context.scopes = scopes = {}
+        copy = context.copy()
+        self.assertTrue(type(copy) is SlotContext)
+        self.assertTrue(copy.slots is context.slots)
+        self.assertTrue(copy.scopes is scopes)
+        compare(copy, expected={'foo': 1, 'baz': 2})
+        copy.add(3, 'bar')
+        copy.add(4, 'bob')
+        compare(context, expected={'foo': 1, 'baz': 2})
+        compare(context.slotted, expected=[1, missing])
+
+    def test_pickle(self):
+        context = SlotContext({'foo': 0, 'bar': 1})
+        context.add(1, 'foo')
+        context.add(2, 'baz')
+        context.process_executor = 'executor'
+        copy = pickle.loads(pickle.dumps(context, pickle.HIGHEST_PROTOCOL))
+        self.assertTrue(type(copy) is SlotContext)
+        compare(copy.slots, expected={'foo': 0, 'bar': 1})
+        compare(copy.slotted, expected=[1, missing])
+        compare(dict.items(copy), expected=[('baz', 2)])
+        compare(copy, expected={'foo': 1, 'baz': 2})
+        compare(copy.process_executor, expected='executor')
+
+    def test_pickle_protocol_0(self):
+        context = SlotContext({'foo': 0})
+        context.add(1, 'foo')
+        context.add(2, 'bar')
+        copy = pickle.loads(pickle.dumps(context, 0))
+        compare(copy, expected={'foo': 1, 'bar': 2})
+
+    def test_add_slotted(self):
+        obj = TheType()
+        context = SlotContext({TheType: 0})
+        context.add(obj, TheType)
+        compare(context.slotted, expected=[obj])
+        compare(dict.items(context), expected=[])
+        self.assertTrue(context[TheType] is obj)
+        self.assertTrue(context.get(TheType) is obj)
+        self.assertTrue(TheType in context)
+
+    def test_add_not_slotted(self):
+        context = SlotContext({TheType: 0})
+        context.add('foo', 'bar')
+        compare(context.slotted, expected=[missing])
+        compare(context, expected={'bar': 'foo'})
+
+    def test_add_twice(self):
+        context = SlotContext({'foo': 0})
+        context.add(1, 'foo')
+        with ShouldRaise(ContextError("Context already contains 'foo'")):
+            context.add(2, 'foo')
+
+    def test_missing(self):
+        context = SlotContext({'foo': 0})
+        compare(context.get('foo'), expected=None)
+        compare(context.get('foo', 'default'), expected='default')
+        self.assertFalse('foo' in context)
+        with ShouldRaise(KeyError('foo')):
+            context['foo']
+        with ShouldRaise(KeyError('foo')):
+            del context['foo']
+
+    def test_set_and_delete(self):
+        context = SlotContext({'foo': 0})
+        context['foo'] = 1
+        context['bar'] = 2
+        compare(context, expected={'foo': 1, 'bar': 2})
+        del context['foo']
+        del context['bar']
+        compare(context, expected={})
+        compare(len(context), expected=0)
+
+    def test_dict_api(self):
+        context = SlotContext({'foo': 0, 'baz': 1})
+        context.add(1, 'foo')
+        context.add(2, 'bar')
+        compare(sorted(context.keys()), expected=['bar', 'foo'])
+        compare(sorted(context.values()), expected=[1, 2])
+        compare(sorted(context.items()), expected=[('bar', 2), ('foo', 1)])
+        compare(sorted(context), expected=['bar', 'foo'])
+        compare(len(context), expected=2)
+        self.assertTrue(context == {'foo': 1, 'bar': 2})
+        self.assertTrue(context != {'foo': 1})
+
+    def test_update(self):
+        context = SlotContext({'foo': 0, 'baz': 1})
+        context.update({'foo': 1, 'bar': 2}, baz=3)
+        context.update([('bob', 4)])
+        compare(context.slotted, expected=[1, 3])
+        compare(dict.items(context), expected=[('bar', 2), ('bob', 4)])
+        compare(context, expected={'foo': 1, 'bar': 2, 'baz': 3, 'bob': 4})
+
+    def test_update_from_slot_context(self):
+        other = SlotContext({'foo': 0})
+        other.add(1, 'foo')
+        context = SlotContext({'foo': 0})
+        context.update(other)
+        compare(context.slotted, expected=[1])
+
+    def test_update_too_many(self):
+        context = SlotContext({})
+        with ShouldRaise(TypeError(
+            'update expected at most 1 argument, got 2'
+        )):
+            context.update({}, {})
+
+    def test_setdefault(self):
+        context = SlotContext({'foo': 0})
+        compare(context.setdefault('foo', 1), expected=1)
+        compare(context.setdefault('foo', 2), expected=1)
+        compare(context.setdefault('bar', 3), expected=3)
+        compare(context.slotted, expected=[1])
+        compare(context, expected={'foo': 1, 'bar': 3})
+
+    def test_pop(self):
+        context = SlotContext({'foo': 0})
+        context.add(1, 'foo')
+        context.add(2, 'bar')
+        compare(context.pop('foo'), expected=1)
+        compare(context.pop('bar'), expected=2)
+        compare(context.pop('foo', None), expected=None)
+        with ShouldRaise(KeyError('foo')):
+            context.pop('foo')
+        compare(context.slotted, expected=[missing])
+        compare(context, expected={})
+
+    def test_popitem(self):
+        context = SlotContext({'foo': 0})
+        context.add(1, 'foo')
+        context.add(2, 'bar')
+        compare(context.popitem(), expected=('foo', 1))
+        compare(context.popitem(), expected=('bar', 2))
+        with ShouldRaise(KeyError):
+            context.popitem()
+
+    def test_clear(self):
+        context = SlotContext({'foo': 0})
+        context.add(1, 'foo')
+        context.add(2, 'bar')
+        context.clear()
+        compare(context.slotted, expected=[missing])
+        compare(context, expected={})
+
+    def test_repr(self):
+        context = SlotContext({TheType: 0})
+        context.add(TheType(), TheType)
+        context.add('x', 'a')
+        compare(repr(context), expected=(
+            "<Context: {\n"
+            "    <class 'mush.tests.test_context.TheType'>: <TheType obj>\n"
+            "    'a': 'x'\n"
+            "}>"
+        ))
+
+    def test_call_and_extract(self):
+        context = SlotContext({'foo': 0})
+        context.add(1, 'foo')
+        result = context.extract(lambda x: x + 1,
+                                 requires('foo'), returns('bar'))
+        compare(result, expected=2)
+        compare(context, expected={'foo': 1, 'bar': 2})
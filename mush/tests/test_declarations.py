@@ -1,13 +1,15 @@
 from functools import partial
 from unittest import TestCase
-from mock import Mock
+from mock import Mock, patch
 from testfixtures import compare, generator, ShouldRaise
 from mush.markers import missing
 from mush.declarations import (
     requires, optional, returns,
     returns_mapping, returns_sequence, returns_result_type,
-    how, item, attr, nothing,
-    extract_declarations
+    how, item, attr, nothing, runs_in, scope, side_effects, batched,
+    single_flight, streams,
+    extract_declarations, declarations_cache, guess_requirements,
+    intern_declaration, interned_declarations, no_kw
 )
 
 
@@ -223,6 +225,84 @@ class TestReturnsResultType(TestCase):
         compare(dict(r.process(foo())), {})
 
 
+class TestSideEffects(TestCase):
+
+    def test_decorator(self):
+        @side_effects
+        def foo(): pass
+        compare(foo.__mush_side_effects__, expected=True)
+
+
+class TestRunsIn(TestCase):
+
+    def test_decorator(self):
+        @runs_in('process')
+        def foo(): pass
+        compare(foo.__mush_runs_in__, expected='process')
+
+    def test_repr(self):
+        compare(repr(runs_in('process')), expected="runs_in('process')")
+
+    def test_bad_place(self):
+        with ShouldRaise(ValueError(
+            "'moon' is not a place callables can run in"
+        )):
+            runs_in('moon')
+
+
+class TestStreams(TestCase):
+
+    def test_decorator(self):
+        @streams('line')
+        def foo(): pass
+        compare(foo.__mush_returns__, expected=streams('line'))
+
+    def test_repr(self):
+        compare(repr(streams('line')), expected="streams('line')")
+        compare(repr(streams(Type1)), expected='streams(Type1)')
+
+    def test_bad_type(self):
+        with ShouldRaise(TypeError('[] is not a type or label')):
+            streams([])
+
+
+class TestBatched(TestCase):
+
+    def test_decorator(self):
+        @batched(max_size=10, max_wait=1)
+        def foo(xs): pass
+        batcher = foo.__mush_batched__
+        compare(batcher.max_size, expected=10)
+        compare(batcher.max_wait, expected=1)
+
+    def test_repr(self):
+        compare(repr(batched()),
+                expected='batched(max_size=100, max_wait=0.01)')
+
+
+class TestSingleFlight(TestCase):
+
+    def test_decorator(self):
+        @single_flight
+        def foo(): pass
+        compare(foo.__mush_single_flight__, expected={})
+
+
+class TestScope(TestCase):
+
+    def test_decorator(self):
+        @scope('process')
+        def foo(): pass
+        compare(foo.__mush_scope__, expected='process')
+
+    def test_repr(self):
+        compare(repr(scope('batch')), expected="scope('batch')")
+
+    def test_bad_name(self):
+        with ShouldRaise(ValueError("'forever' is not a scope")):
+            scope('forever')
+
+
 class TestExtractDeclarations(object):
 
     def test_default_requirements_for_function(self):
@@ -321,3 +401,141 @@ class TestExtractDeclarations(object):
             expected_rq=requires('b', a=optional('a')),
             expected_rt=None
         )
+
+
+class TestDeclarationsCache(TestCase):
+
+    def test_guess_cached(self):
+        def foo(a): pass
+        with patch('mush.declarations.guess_requirements',
+                   wraps=guess_requirements) as guess:
+            check_extract(foo, expected_rq=requires('a'), expected_rt=None)
+            check_extract(foo, expected_rq=requires('a'), expected_rt=None)
+        compare(guess.call_count, expected=1)
+
+    def test_same_declarations(self):
+        @requires('a', 'b')
+        def foo(a, b): pass
+        first = extract_declarations(foo, None, None)
+        second = extract_declarations(foo, None, None)
+        self.assertTrue(first[0] is second[0])
+
+    def test_explicit_not_cached(self):
+        def foo(a): pass
+        check_extract(foo, expected_rq=requires('a'), expected_rt=None)
+        rq, rt = extract_declarations(foo, 'b', 'c')
+        compare(rq, expected=requires('b'))
+        compare(rt, expected=returns('c'))
+        check_extract(foo, expected_rq=requires('a'), expected_rt=None)
+
+    def test_invalidated_by_decoration(self):
+        def foo(a): pass
+        check_extract(foo, expected_rq=requires('a'), expected_rt=None)
+        requires('b')(foo)
+        returns('c')(foo)
+        check_extract(foo, expected_rq=requires('b'), expected_rt=returns('c'))
+
+    def test_not_guessed(self):
+        def foo(a): pass
+        compare(extract_declarations(foo, None, None, guess=False),
+                expected=(None, None))
+        check_extract(foo, expected_rq=requires('a'), expected_rt=None)
+
+    def test_forgotten(self):
+        def foo(a): pass
+        extract_declarations(foo, None, None)
+        key = id(foo)
+        self.assertTrue(key in declarations_cache)
+        del foo
+        self.assertFalse(key in declarations_cache)
+
+    def test_cannot_weakref(self):
+        class Callable(object):
+            __slots__ = ()
+            def __call__(self, a): pass
+        obj = Callable()
+        check_extract(obj, expected_rq=requires('a'), expected_rt=None)
+        self.assertFalse(id(obj) in declarations_cache)
+
+    def test_unhashable(self):
+        class Callable(object):
+            __hash__ = None
+            def __call__(self, a): pass
+        obj = Callable()
+        check_extract(obj, expected_rq=requires('a'), expected_rt=None)
+        check_extract(obj, expected_rq=requires('a'), expected_rt=None)
+
+
+class TestInternDeclaration(TestCase):
+
+    def check(self, first, second):
+        first = intern_declaration(first)
+        self.assertTrue(intern_declaration(second) is first)
+        return first
+
+    def test_requires(self):
+        interned = self.check(requires(Type1, 'a', x=optional('b')),
+                              requires(Type1, 'a', x=optional('b')))
+        compare(interned, expected=requires(Type1, 'a', x=optional('b')))
+
+    def test_requires_different(self):
+        first = intern_declaration(requires('a', x='b'))
+        self.assertFalse(intern_declaration(requires('a', y='b')) is first)
+        self.assertFalse(intern_declaration(requires('a')) is first)
+        self.assertFalse(intern_declaration(returns('a')) is first)
+
+    def test_hows(self):
+        self.check(requires(item(attr(Type1, 'x'), 'y')),
+                   requires(item(attr(Type1, 'x'), 'y')))
+        first = intern_declaration(requires(item(Type1, 'x')))
+        self.assertFalse(intern_declaration(requires(attr(Type1, 'x')))
+                         is first)
+        self.assertFalse(intern_declaration(requires(item(Type1, 'y')))
+                         is first)
+
+    def test_custom_how(self):
+        class default(how):
+            def __init__(self, type, value):
+                super(default, self).__init__(type)
+                self.value = value
+        first = intern_declaration(requires(default('x', 1)))
+        self.assertFalse(intern_declaration(requires(default('x', 2)))
+                         is first)
+        self.assertFalse(intern_declaration(requires(default('x', 1)))
+                         is first)
+        self.assertTrue(intern_declaration(first) is first)
+
+    def test_returns(self):
+        self.check(returns('a', Type1), returns('a', Type1))
+
+    def test_streams(self):
+        self.check(streams('line'), streams('line'))
+
+    def test_stateless(self):
+        self.check(returns_mapping(), returns_mapping())
+        self.check(returns_sequence(), returns_sequence())
+        self.check(returns_result_type(), returns_result_type())
+
+    def test_unhashable_names(self):
+        declaration = requires(item('a', ['x']))
+        self.assertTrue(intern_declaration(declaration) is declaration)
+
+    def test_subclass(self):
+        class custom(returns):
+            pass
+        declaration = custom('a')
+        self.assertTrue(intern_declaration(declaration) is declaration)
+
+    def test_forgotten(self):
+        count = len(interned_declarations)
+        intern_declaration(requires(Type1, Type2, Type3, Type4))
+        compare(len(interned_declarations), expected=count)
+
+    def test_no_kw_shared(self):
+        self.assertTrue(requires('a').kw is no_kw)
+        self.assertFalse(requires(x='a').kw is no_kw)
+
+    def test_slots(self):
+        for declaration in (requires('a'), returns('a'), streams('a'),
+                            returns_mapping(), nothing):
+            self.assertFalse(hasattr(declaration, '__dict__'))
@@ -1,8 +1,8 @@
-from testfixtures import compare
+from testfixtures import ShouldRaise, compare
 
 from mush.declarations import (
     requires, returns, returns_mapping, returns_sequence, item, update_wrapper,
-    optional
+    optional, extract_declarations, memoize, batched
 )
 from mush.tests.test_declarations import check_extract
 
@@ -84,3 +84,40 @@ class TestExtractDeclarations(object):
                                            c='c',
                                            d=optional('d')),
                       expected_rt=None)
+
+    def test_cache_invalidated_by_annotations(self):
+        def foo(a: 'foo') -> 'bar': pass
+        check_extract(foo,
+                      expected_rq=requires(a='foo'),
+                      expected_rt=returns('bar'))
+        foo.__annotations__['a'] = 'baz'
+        check_extract(foo,
+                      expected_rq=requires(a='baz'),
+                      expected_rt=returns('bar'))
+        foo.__annotations__ = {'return': 'bob'}
+        check_extract(foo,
+                      expected_rq=requires('a'),
+                      expected_rt=returns('bob'))
+
+    def test_bad_annotations_with_explicit(self):
+        def foo(a: [1]) -> [2]: pass
+        compare(extract_declarations(foo, 'x', 'y'),
+                expected=(requires('x'), returns('y')))
+
+
+class TestMemoize(object):
+
+    def test_coroutine_function(self):
+        async def foo():
+            pass  # pragma: no cover
+        with ShouldRaise(TypeError('coroutine functions cannot be memoized')):
+            memoize()(foo)
+
+
+class TestBatched(object):
+
+    def test_coroutine_function(self):
+        async def foo(xs):
+            pass  # pragma: no cover
+        batched(max_size=5)(foo)
+        compare(foo.__mush_batched__.max_size, expected=5)
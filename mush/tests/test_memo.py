@@ -0,0 +1,213 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from mock import Mock, call, patch
+from testfixtures import ShouldRaise, compare
+
+from mush.callpoints import CallPoint
+from mush.context import Context
+from mush.declarations import memoize, requires, returns, lazy
+from mush.markers import missing
+from mush.memo import Cache, Memoized, memoized
+from mush.runner import Runner
+
+
+class TestCache(TestCase):
+
+    def test_get_and_set(self):
+        cache = Cache()
+        compare(cache.get('x'), expected=missing)
+        cache.set('x', 1)
+        compare(cache.get('x'), expected=1)
+        compare(cache.hits, expected=1)
+        compare(cache.misses, expected=1)
+        compare(len(cache), expected=1)
+
+    def test_least_recently_used_evicted(self):
+        cache = Cache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        compare(cache.get('b'), expected=missing)
+        compare(cache.get('a'), expected=1)
+        compare(cache.get('c'), expected=3)
+
+    def test_set_existing(self):
+        cache = Cache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('a', 3)
+        cache.set('c', 4)
+        compare(cache.get('b'), expected=missing)
+        compare(cache.get('a'), expected=3)
+
+    def test_ttl(self):
+        cache = Cache(ttl=10)
+        with patch('mush.memo.monotonic', return_value=100):
+            cache.set('a', 1)
+        with patch('mush.memo.monotonic', return_value=109):
+            compare(cache.get('a'), expected=1)
+        with patch('mush.memo.monotonic', return_value=110):
+            compare(cache.get('a'), expected=missing)
+        compare(len(cache), expected=0)
+
+    def test_clear(self):
+        cache = Cache()
+        cache.set('a', 1)
+        cache.get('a')
+        cache.clear()
+        compare(len(cache), expected=0)
+        compare((cache.hits, cache.misses), expected=(0, 0))
+
+    def test_repr(self):
+        cache = Cache(max_size=10)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        compare(repr(cache), expected='<Cache: 1 of 10, hits=1, misses=1>')
+
+
+class TestMemoized(TestCase):
+
+    def test_cached(self):
+        m = Mock(return_value='r')
+        memo = Memoized(m, Cache())
+        compare(memo(1, x=2), expected='r')
+        compare(memo(1, x=2), expected='r')
+        compare(memo(2, x=2), expected='r')
+        compare(m.mock_calls, expected=[call(1, x=2), call(2, x=2)])
+
+    def test_unhashable(self):
+        m = Mock(return_value='r')
+        cache = Cache()
+        memo = Memoized(m, cache)
+        memo([])
+        memo(x=[])
+        compare(m.mock_calls, expected=[call([]), call(x=[])])
+        compare(len(cache), expected=0)
+        compare(cache.misses, expected=2)
+
+    def test_repr(self):
+        def foo(): pass
+        compare(repr(Memoized(foo, Cache())), expected=repr(foo))
+
+    def test_not_declared(self):
+        def foo(): pass
+        self.assertTrue(memoized(foo) is foo)
+
+
+class TestMemoizeDeclaration(TestCase):
+
+    def test_decorator(self):
+        @memoize(max_size=10, ttl=5)
+        def foo(): pass
+        cache = foo.__mush_memoize__
+        compare((cache.max_size, cache.ttl), expected=(10, 5))
+
+    def test_cache_per_callable(self):
+        declaration = memoize()
+        def foo(): pass
+        def bar(): pass
+        declaration(foo)
+        declaration(bar)
+        self.assertFalse(foo.__mush_memoize__ is bar.__mush_memoize__)
+
+    def test_repr(self):
+        compare(repr(memoize(ttl=1)), expected='memoize(max_size=128, ttl=1)')
+
+    def test_runs_in_process(self):
+        @memoize()
+        def foo(): pass
+        with ShouldRaise(TypeError(
+            "memoized callables cannot be run in 'process'"
+        )):
+            CallPoint(foo, runs_in='process')
+
+
+class TestRunner(TestCase):
+
+    def make_runner(self, m):
+        @returns('x')
+        def source():
+            return 1
+
+        @memoize()
+        @requires('x')
+        @returns('y')
+        def pure(x):
+            m.pure(x)
+            return x + 1
+
+        @requires('y')
+        def job(y):
+            return y * 2
+
+        return Runner(source, pure, job), pure
+
+    def test_across_calls(self):
+        m = Mock()
+        runner, pure = self.make_runner(m)
+        compare(runner(), expected=4)
+        context = Context()
+        compare(runner(context), expected=4)
+        compare(context, expected={'x': 1, 'y': 2, int: 4})
+        compare(m.mock_calls, expected=[call.pure(1)])
+        compare(pure.__mush_memoize__.hits, expected=1)
+
+    def test_across_runners(self):
+        m = Mock()
+        runner, _ = self.make_runner(m)
+        runner()
+        runner.clone()()
+        compare(m.mock_calls, expected=[call.pure(1)])
+
+    def test_different_resources(self):
+        m = Mock()
+
+        @memoize()
+        @requires('x')
+        def pure(x):
+            m.pure(x)
+            return x
+
+        for x in 1, 2, 1:
+            runner = Runner()
+            runner.add(lambda x=x: x, requires=(), returns='x')
+            runner.add(pure)
+            compare(runner(), expected=x)
+        compare(m.mock_calls, expected=[call.pure(1), call.pure(2)])
+
+    def test_generated(self):
+        m = Mock()
+        runner, _ = self.make_runner(m)
+        compare(runner.generate()(), expected=4)
+        compare(runner.generate()(), expected=4)
+        compare(m.mock_calls, expected=[call.pure(1)])
+
+    def test_executor(self):
+        m = Mock()
+        runner, _ = self.make_runner(m)
+        with ThreadPoolExecutor(2) as executor:
+            compare(runner(executor=executor), expected=4)
+            compare(runner(executor=executor), expected=4)
+        compare(m.mock_calls, expected=[call.pure(1)])
+
+    def test_lazy(self):
+        m = Mock()
+
+        @lazy
+        @memoize()
+        @returns('config')
+        def load():
+            m.load()
+            return 'config'
+
+        @requires('config')
+        def job(config):
+            return config
+
+        runner = Runner(load, job)
+        compare(runner(), expected='config')
+        compare(runner(), expected='config')
+        compare(m.mock_calls, expected=[call.load()])
@@ -0,0 +1,363 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Event
+from time import sleep
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import ShouldRaise, compare
+
+from mush.context import Context, ContextError
+from mush.declarations import requires, returns, returns_mapping, nothing
+from mush.parallel import Schedule, is_barrier
+from mush.runner import Runner
+
+
+class T1(object): pass
+
+
+def square(x):
+    return x * x
+
+
+def returns_nothing(obj):
+    obj.__mush_returns__ = nothing
+    return obj
+
+
+class TestSchedule(TestCase):
+
+    def test_barriers(self):
+        class CM(object):
+            def __enter__(self): pass  # pragma: no cover
+            def __exit__(self, *args): pass  # pragma: no cover
+
+        runner = Runner()
+        runner.add(lambda: None)
+        runner.add(lambda: None, returns=returns_mapping())
+        runner.add(CM, returns='cm')
+        runner.add(lambda: None, returns='x')
+        runner.add(lambda: None, returns=nothing)
+        runner.add(lambda: None, returns='y', lazy=True)
+        runner.add(lambda: None, returns='z', scope='batch')
+        compare([is_barrier(s) for s in runner.compile().steps],
+                expected=[True, True, True, False, False, False, True])
+
+    def test_dependencies(self):
+        @returns('a')
+        def job1(): pass
+        @returns('b')
+        def job2(): pass
+        @requires('a', 'b')
+        @returns('c')
+        def job3(a, b): pass
+        @requires('a')
+        @returns_nothing
+        def job4(a): pass
+        def barrier(): pass
+        @requires('c')
+        @returns_nothing
+        def job5(c): pass
+
+        runner = Runner(job1, job2, job3, job4, barrier, job5)
+        steps = runner.compile().steps
+        schedule = Schedule(runner.compile())
+        compare(schedule.barriers, expected={steps[4]})
+        compare(schedule.dependencies, expected={
+            steps[0]: (),
+            steps[1]: (),
+            steps[2]: (steps[0], steps[1]),
+            steps[3]: (steps[0], steps[2]),
+            steps[5]: (),
+        })
+
+
+class TestRunWithExecutor(TestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_independent_points_run_concurrently(self):
+        first = Event()
+        second = Event()
+
+        @returns('a')
+        def job1():
+            first.set()
+            return second.wait(5)
+
+        @returns('b')
+        def job2():
+            second.set()
+            return first.wait(5)
+
+        @requires('a', 'b')
+        @returns('c')
+        def job3(a, b):
+            return a, b
+
+        context = Context()
+        result = Runner(job1, job2, job3)(context, executor=self.executor)
+        compare(result, expected=(True, True))
+        compare(context, expected={'a': True, 'b': True, 'c': (True, True)})
+
+    def test_same_resource_keeps_order(self):
+        m = Mock()
+
+        @returns('ring')
+        def forge():
+            return 'ring'
+
+        @requires('ring')
+        @returns_nothing
+        def polish(ring):
+            m.polish(ring)
+
+        @requires('ring')
+        @returns_nothing
+        def engrave(ring):
+            m.engrave(ring)
+
+        Runner(forge, polish, engrave)(executor=self.executor)
+        compare(m.mock_calls, expected=[
+            call.polish('ring'), call.engrave('ring'),
+        ])
+
+    def test_barrier_result_type(self):
+        def job1():
+            return T1()
+
+        @requires(T1)
+        @returns('x')
+        def job2(t):
+            return type(t)
+
+        compare(Runner(job1, job2)(executor=self.executor), expected=T1)
+
+    def test_context_manager(self):
+        m = Mock()
+
+        class CM(object):
+            def __enter__(self):
+                m.enter()
+                return 'manager'
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+
+        @requires(str)
+        @returns('x')
+        def job(manager):
+            m.job(manager)
+
+        Runner(CM, job)(executor=self.executor)
+        compare(m.mock_calls, expected=[
+            call.enter(), call.job('manager'), call.exit(None),
+        ])
+
+    def test_context_manager_suppresses(self):
+        m = Mock()
+
+        class CM(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+                return True
+
+        @returns('a')
+        def bad():
+            raise Exception()
+
+        @requires('a')
+        @returns_nothing
+        def needs_a(a):
+            pass  # pragma: no cover
+
+        runner = Runner(CM, bad, needs_a)
+        with ShouldRaise(ContextError) as s:
+            runner(executor=self.executor)
+        compare(s.raised.text, expected="No 'a' in context")
+        compare(s.raised.point.obj, expected=needs_a)
+        compare(m.mock_calls, expected=[call.enter(), call.exit(Exception)])
+
+    def test_context_manager_returned_concurrently(self):
+        class CM(object):
+            def __enter__(self): pass  # pragma: no cover
+            def __exit__(self, *args): pass  # pragma: no cover
+
+        @returns('cm')
+        def job():
+            return CM()
+
+        with ShouldRaise(ContextError) as s:
+            Runner(job)(executor=self.executor)
+        compare(s.raised.text,
+                expected='Context manager returned when run concurrently')
+
+    def test_missing(self):
+        @requires('x')
+        @returns_nothing
+        def job(x):
+            pass  # pragma: no cover
+
+        with ShouldRaise(ContextError) as s:
+            Runner(job)(executor=self.executor)
+        compare(s.raised.text, expected="No 'x' in context")
+        compare(s.raised.point.obj, expected=job)
+
+    def test_exception(self):
+        m = Mock()
+
+        @returns('a')
+        def bad():
+            raise ValueError('boom')
+
+        @requires('a')
+        @returns_nothing
+        def never(a):
+            m.never()  # pragma: no cover
+
+        with ShouldRaise(ValueError('boom')):
+            Runner(bad, never)(executor=self.executor)
+        compare(m.mock_calls, expected=[])
+
+    def test_earlier_points_finish_after_failure(self):
+        m = Mock()
+        started = Event()
+
+        @returns('a')
+        def slow():
+            started.wait(5)
+            m.slow()
+
+        @returns('b')
+        def bad():
+            started.set()
+            raise ValueError('boom')
+
+        with ShouldRaise(ValueError('boom')):
+            Runner(slow, bad)(executor=self.executor)
+        compare(m.mock_calls, expected=[call.slow()])
+
+    def test_lazy(self):
+        m = Mock()
+
+        @returns('a')
+        def job1():
+            return 1
+
+        @requires('a')
+        @returns('b')
+        def make_b(a):
+            m.make_b(a)
+            return a + 1
+
+        @requires('b')
+        @returns('c')
+        def job2(b):
+            return b + 1
+
+        runner = Runner()
+        runner.add(job1)
+        runner.add(make_b, lazy=True)
+        runner.add(job2)
+        compare(runner(executor=self.executor), expected=3)
+        compare(m.mock_calls, expected=[call.make_b(1)])
+
+    def test_lazy_requires_later_resource(self):
+
+        @requires('x')
+        @returns('l')
+        def lazy_thing(x):
+            return x + '-lazy'
+
+        @returns('x')
+        def slow():
+            sleep(0.05)
+            return 'X'
+
+        @requires('l')
+        @returns('y')
+        def user(l):
+            return l
+
+        runner = Runner()
+        runner.add(lazy_thing, lazy=True)
+        runner.add(slow)
+        runner.add(user)
+        compare(runner(), expected='X-lazy')
+        compare(runner(executor=self.executor), expected='X-lazy')
+        steps = runner.compile().steps
+        compare(runner.compile().schedule.dependencies[steps[2]],
+                expected=(steps[0], steps[1]))
+
+    def test_scoped(self):
+        m = Mock()
+
+        @returns('a')
+        def job1():
+            m.job1()
+            return 1
+
+        @requires('a')
+        @returns('b')
+        def job2(a):
+            return a + 1
+
+        runner = Runner()
+        runner.add(job1, scope='batch')
+        runner.add(job2)
+        with runner.batch() as batch:
+            compare(batch(executor=self.executor), expected=2)
+            compare(batch(executor=self.executor), expected=2)
+        compare(m.mock_calls, expected=[call.job1()])
+
+    def test_scoped_lazy(self):
+        m = Mock()
+
+        @returns('a')
+        def make_a():
+            m.make_a()
+            return 1
+
+        @requires('a')
+        @returns('b')
+        def job(a):
+            return a + 1
+
+        runner = Runner()
+        runner.add(make_a, lazy=True, scope='process')
+        runner.add(job)
+        compare(runner(executor=self.executor), expected=2)
+        compare(runner(executor=self.executor), expected=2)
+        compare(m.mock_calls, expected=[call.make_a()])
+
+    def test_schedule_cached(self):
+        runner = Runner(lambda: None)
+        runner(executor=self.executor)
+        schedule = runner.compile().schedule
+        runner(executor=self.executor)
+        self.assertTrue(runner.compile().schedule is schedule)
+
+    def test_process(self):
+        runner = Runner()
+        runner.add(lambda: 2, returns='x')
+        runner.add(square, requires='x', returns='a', runs_in='process')
+        runner.add(square, requires='x', returns='b', runs_in='process')
+        runner.add(lambda a, b: a + b, requires=('a', 'b'))
+        with ProcessPoolExecutor(2) as process_executor:
+            compare(runner(executor=self.executor,
+                           process_executor=process_executor),
+                    expected=8)
+
+    def test_process_not_picklable(self):
+        runner = Runner()
+        runner.add(lambda: None, returns='x', runs_in='process')
+        with ProcessPoolExecutor(1) as process_executor:
+            with ShouldRaise(ContextError) as s:
+                runner(executor=self.executor,
+                       process_executor=process_executor)
+        self.assertTrue(s.raised.text.startswith('Cannot pickle '))
+        compare(s.raised.point, expected=runner.start)
@@ -0,0 +1,307 @@
+from threading import Event, Thread, current_thread
+from time import sleep
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import Replace, ShouldRaise, compare
+
+from mush.context import Context, ContextError
+from mush.declarations import nothing, streams
+from mush.pipeline import split
+from mush.runner import Runner
+from mush.sampling import Sampler
+from mush.stats import Stats
+
+
+class TestSplit(TestCase):
+
+    def test_split(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a', label='one')
+        runner.add(lambda: 2, returns='b')
+        runner.add(lambda: 3, returns='c', label='two')
+        runner.add(lambda: 4, returns='d')
+        plan = runner.compile()
+        compare(split(plan, [runner.labels['two'], runner.labels['one']]),
+                expected=[(0, 1), (1, 3), (3, 4)])
+
+    def test_label_at_end(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a', label='one')
+        plan = runner.compile()
+        compare(split(plan, [runner.labels['one']]),
+                expected=[(0, 1)])
+
+    def test_empty(self):
+        compare(split(Runner().compile(), []), expected=[])
+
+
+class TestPipeline(TestCase):
+
+    def make_runner(self, m):
+        def read(path: 'path') -> streams('line'):
+            m.read(path)
+            for line in ('a', 'b', 'c'):
+                yield line
+
+        def parse(line: 'line') -> 'parsed':
+            m.parse(line, current_thread().name)
+            return line.upper()
+
+        def write(path: 'path', parsed: 'parsed') -> 'written':
+            m.write(parsed, current_thread().name)
+            return path + ':' + parsed
+
+        runner = Runner()
+        runner.add(read, label='read')
+        runner.add(parse, label='parse')
+        runner.add(write)
+        return runner
+
+    def test_results(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        results = runner.pipeline(['read', 'parse'],
+                                  resources={'path': 'f'})
+        compare(list(results), expected=['f:A', 'f:B', 'f:C'])
+
+    def test_stages_in_different_threads(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        list(runner.pipeline(['read', 'parse'], resources={'path': 'f'}))
+        parse_threads = set(c.args[1] for c in m.mock_calls
+                            if c[0] == 'parse')
+        write_threads = set(c.args[1] for c in m.mock_calls
+                            if c[0] == 'write')
+        compare(len(parse_threads), expected=1)
+        compare(len(write_threads), expected=1)
+        self.assertFalse(parse_threads & write_threads)
+        self.assertFalse(current_thread().name in parse_threads)
+
+    def test_overlap(self):
+        # the first item reaches the end before the source has finished:
+        second_read = Event()
+        first_written = Event()
+
+        def read() -> streams('item'):
+            yield 1
+            second_read.set()
+            first_written.wait(5)
+            yield 2
+
+        def write(item: 'item') -> 'written':
+            if item == 1:
+                first_written.set()
+            return item
+
+        runner = Runner()
+        runner.add(read, label='read')
+        runner.add(write)
+        compare(list(runner.pipeline(['read'])), expected=[1, 2])
+        self.assertTrue(second_read.is_set())
+
+    def test_backpressure(self):
+        produced = []
+        release = Event()
+
+        def read() -> streams('item'):
+            for item in range(10):
+                produced.append(item)
+                yield item
+
+        def write(item: 'item') -> 'written':
+            release.wait(5)
+            return item
+
+        runner = Runner()
+        runner.add(read, label='read')
+        runner.add(write)
+        results = []
+        consumer = Thread(target=lambda: results.extend(
+            runner.pipeline(['read'], max_queued=1)
+        ))
+        consumer.start()
+        sleep(0.2)
+        # one item being written, one queued and one waiting to be queued:
+        self.assertTrue(len(produced) <= 3, produced)
+        release.set()
+        consumer.join(5)
+        compare(results, expected=list(range(10)))
+
+    def test_no_labels(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        compare(list(runner.pipeline([], resources={'path': 'f'})),
+                expected=['f:A', 'f:B', 'f:C'])
+
+    def test_no_streams(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a', label='one')
+        runner.add(lambda a: a + 1, requires='a', returns='b')
+        compare(list(runner.pipeline(['one'])), expected=[2])
+
+    def test_empty(self):
+        compare(list(Runner().pipeline([])), expected=[None])
+
+    def test_exception(self):
+        def read() -> streams('item'):
+            yield 1
+            yield 2
+
+        def write(item: 'item') -> 'written':
+            if item == 2:
+                raise ValueError('boom')
+            return item
+
+        runner = Runner()
+        runner.add(read, label='read')
+        runner.add(write)
+        results = runner.pipeline(['read'])
+        compare(next(results), expected=1)
+        with ShouldRaise(ValueError('boom')):
+            next(results)
+
+    def test_context_error(self):
+        runner = Runner()
+        runner.add(lambda: [1], returns=streams('item'), label='read')
+        runner.add(lambda x: x, requires='x', returns='y')
+        with ShouldRaise(ContextError) as s:
+            list(runner.pipeline(['read']))
+        compare(s.raised.text, expected="No 'x' in context")
+
+    def test_closed_early(self):
+        m = Mock()
+
+        def read() -> streams('item'):
+            for item in range(1000):
+                yield item
+            m.finished()  # pragma: no cover
+
+        runner = Runner()
+        runner.add(read, label='read')
+        runner.add(lambda item: item, requires='item', returns='written')
+        results = runner.pipeline(['read'], max_queued=1)
+        compare(next(results), expected=0)
+        results.close()
+        compare(m.mock_calls, expected=[])
+
+    def test_unknown_label(self):
+        with ShouldRaise(KeyError('foo')):
+            list(Runner().pipeline(['foo']))
+
+    def test_context_manager_within_stage(self):
+        m = Mock()
+
+        class CM(object):
+            def __init__(self, item):
+                self.item = item
+            def __enter__(self):
+                m.enter(self.item)
+            def __exit__(self, type, obj, tb):
+                m.exit(self.item)
+
+        runner = Runner()
+        runner.add(lambda: [1], returns=streams('item'), label='read')
+        runner.add(CM, requires='item', label='cm')
+        runner.add(lambda item: m.write(item), requires='item',
+                   returns=nothing)
+        list(runner.pipeline(['read', 'cm']))
+        # the manager is kept open until the later stage has used it:
+        compare(m.mock_calls, expected=[
+            call.enter(1), call.write(1), call.exit(1),
+        ])
+
+    def test_context_manager_resource(self):
+        m = Mock()
+
+        class Writer(object):
+            def __init__(self):
+                self.closed = False
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit()
+                self.closed = True
+            def write(self, item):
+                assert not self.closed, 'closed'
+                m.write(item)
+
+        def open_writer():
+            return Writer()
+
+        runner = Runner()
+        runner.add(open_writer, returns='out', label='open')
+        runner.add(lambda: [1, 2], returns=streams('item'), label='read')
+        runner.add(lambda out, item: out.write(item),
+                   requires=('out', 'item'), returns=nothing)
+        list(runner.pipeline(['open', 'read']))
+        compare(m.mock_calls, expected=[
+            call.enter(), call.write(1), call.write(2), call.exit(),
+        ])
+
+    def test_context_manager_suppresses(self):
+        m = Mock()
+
+        class Suppress(object):
+            def __enter__(self):
+                pass
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+                return True
+
+        def fail():
+            raise ValueError()
+
+        runner = Runner()
+        runner.add(Suppress, label='cm')
+        runner.add(fail, label='fail')
+        runner.add(lambda: m.after(), returns=nothing)
+        list(runner.pipeline(['cm', 'fail']))
+        compare(m.mock_calls, expected=[call.exit(ValueError), call.after()])
+
+    def test_scoped(self):
+        m = Mock()
+        runner = Runner()
+        runner.add(lambda: [1, 2], returns=streams('item'), label='read')
+        runner.add(m.connect, returns='conn', scope='batch')
+        runner.add(lambda conn, item: item, requires=('conn', 'item'),
+                   returns='written')
+        compare(list(runner.pipeline(['read'])), expected=[1, 2])
+        compare(m.mock_calls, expected=[call.connect()])
+
+    def test_stats(self):
+        stats = Stats()
+        runner = self.make_runner(Mock())
+        runner.instrument(stats)
+        list(runner.pipeline(['read', 'parse'], resources={'path': 'f'}))
+        actual = stats.as_dict()
+        compare(actual['runs'], expected=1)
+        compare(actual['points']['write']['calls'], expected=3)
+
+    def test_sampler(self):
+        sampler = Sampler(every=1)
+        runner = self.make_runner(Mock())
+        runner.instrument(sampler)
+        list(runner.pipeline(['read', 'parse'], resources={'path': 'f'}))
+        trace, = sampler.dump()
+        compare(sorted(point['name'] for point in trace.as_dict()['points']),
+                expected=['parse', 'parse', 'parse', 'read',
+                          'write', 'write', 'write'])
+        compare(sampler.active, expected={})
+
+    def test_sampler_not_recorded(self):
+        sampler = Sampler(every=1000, errors=())
+        runner = self.make_runner(Mock())
+        runner.instrument(sampler)
+        with Replace('mush.sampling.Sampler.point_end', Mock()) as point_end:
+            list(runner.pipeline(['read', 'parse'], resources={'path': 'f'}))
+        point_end.assert_not_called()
+        compare(sampler.runs, expected=1)
+
+    def test_context(self):
+        context = Context()
+        runner = Runner()
+        runner.add(lambda: [1], returns=streams('item'), label='read')
+        runner.add(lambda item: item, requires='item', returns='written')
+        list(runner.pipeline(['read'], context=context))
+        compare(context, expected={})
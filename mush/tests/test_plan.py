@@ -0,0 +1,665 @@
+from concurrent.futures import ProcessPoolExecutor
+from os import getpid
+from unittest import TestCase
+
+from mock import MagicMock, Mock, call
+from testfixtures import ShouldRaise, compare
+
+from mush.context import Context, ContextError, SlotContext
+from mush.declarations import (
+    requires, returns, returns_mapping, returns_sequence, nothing, optional,
+    attr, item, result_type, side_effects, streams
+)
+from mush.plan import (
+    Requirement, result_handler, add_nothing, add_by_type, AddAs,
+    AddProcessed, FactoryStep, ProcessStep, Scope, ScopedFactoryStep,
+    Cursor, ScopedStep, Step, invariant_prefix, liveness, release
+)
+from mush.runner import Runner
+
+
+class T1(object): pass
+class T2(object): pass
+
+
+class TestRequirement(TestCase):
+
+    def test_plain(self):
+        r = Requirement(None, T1)
+        compare(r.key, T1)
+        compare(r.ops, ())
+        context = Context()
+        t = T1()
+        context.add(t, T1)
+        self.assertTrue(r.extract(context) is t)
+
+    def test_how(self):
+        r = Requirement('x', optional(item(attr(T1, 'foo'), 'bar')))
+        compare(r.key, T1)
+        compare(len(r.ops), 3)
+        context = Context()
+        t = T1()
+        t.foo = dict(bar='baz')
+        context.add(t, T1)
+        compare(r.extract(context), expected='baz')
+
+    def test_optional_missing(self):
+        r = Requirement(None, optional(T1))
+        self.assertTrue(r.extract(Context()) is nothing)
+
+    def test_missing(self):
+        r = Requirement(None, attr(T1, 'foo'))
+        with ShouldRaise(ContextError("No T1.foo in context")):
+            r.extract(Context())
+
+
+class TestResultHandlers(TestCase):
+
+    def test_nothing(self):
+        self.assertTrue(result_handler(nothing) is add_nothing)
+
+    def test_result_type(self):
+        self.assertTrue(result_handler(result_type) is add_by_type)
+        context = Context()
+        add_by_type(context, None)
+        add_by_type(context, 'foo')
+        compare(context, expected={str: 'foo'})
+
+    def test_single(self):
+        handler = result_handler(returns('foo'))
+        self.assertTrue(isinstance(handler, AddAs))
+        context = Context()
+        handler(context, None)
+        compare(context, expected={'foo': None})
+
+    def test_multiple(self):
+        handler = result_handler(returns('foo', 'bar'))
+        self.assertTrue(isinstance(handler, AddProcessed))
+        context = Context()
+        handler(context, (1, 2))
+        compare(context, expected={'foo': 1, 'bar': 2})
+
+    def test_mapping(self):
+        self.assertTrue(isinstance(result_handler(returns_mapping()),
+                                   AddProcessed))
+
+    def test_sequence(self):
+        self.assertTrue(isinstance(result_handler(returns_sequence()),
+                                   AddProcessed))
+
+    def test_subclass(self):
+        class custom(returns):
+            def process(self, obj):
+                yield 'custom', obj
+        handler = result_handler(custom('foo'))
+        context = Context()
+        handler(context, 1)
+        compare(context, expected={'custom': 1})
+
+
+class TestPlan(TestCase):
+
+    def test_steps(self):
+        def job1(): pass
+        def job2(): pass
+        runner = Runner()
+        runner.add(job1)
+        runner.add(job2, returns=returns(T1), lazy=True)
+        plan = runner.compile()
+        compare([type(s) for s in plan.steps], expected=[Step, FactoryStep])
+        compare([s.point for s in plan.steps],
+                expected=[runner.start, runner.end])
+
+    def test_repr(self):
+        def job(): pass
+        runner = Runner(job)
+        compare(repr(runner.compile()),
+                expected='<Plan>\n    %r\n</Plan>' % runner.start)
+
+    def test_repr_empty(self):
+        compare(repr(Runner().compile()), expected='<Plan></Plan>')
+
+    def test_cached(self):
+        runner = Runner()
+        plan = runner.compile()
+        self.assertTrue(runner.compile() is plan)
+
+    def test_invalidated_by_add(self):
+        m = Mock()
+        runner = Runner(m.job1)
+        runner()
+        runner.add(m.job2)
+        runner()
+        compare(m.mock_calls, expected=[
+            call.job1(), call.job1(), call.job2(),
+        ])
+
+    def test_invalidated_by_modifier(self):
+        m = Mock()
+        runner = Runner()
+        runner.add(m.job1, label='label')
+        runner.add(m.job3)
+        plan = runner.compile()
+        runner['label'].add(m.job2)
+        self.assertFalse(runner.compile() is plan)
+        runner()
+        compare(m.mock_calls, expected=[
+            call.job1(), call.job2(), call.job3(),
+        ])
+
+    def test_invalidated_by_extend(self):
+        m = Mock()
+        runner = Runner(m.job1)
+        plan = runner.compile()
+        runner.extend(Runner(m.job2))
+        self.assertFalse(runner.compile() is plan)
+
+    def test_invalidated_by_replace(self):
+        m = Mock()
+        runner = Runner(m.job1)
+        runner()
+        runner.replace(m.job1, m.job2)
+        runner()
+        compare(m.mock_calls, expected=[call.job1(), call.job2()])
+
+    def test_clone_not_shared(self):
+        runner = Runner(lambda: None)
+        plan = runner.compile()
+        self.assertFalse(runner.clone().compile() is plan)
+
+    def test_context_manager_suppresses_then_continues(self):
+        m = Mock()
+
+        class CM(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+                return True
+
+        def bad():
+            m.bad()
+            raise Exception()
+
+        def after():
+            m.after()
+            return 'after'
+
+        runner = Runner(CM, bad, after)
+        compare(runner(), expected='after')
+        compare(m.mock_calls, expected=[
+            call.enter(), call.bad(), call.exit(Exception), call.after(),
+        ])
+
+    def test_execute(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='x')
+        runner.add(lambda x: x + 1, requires='x', returns='y')
+        runner.release()
+        plan = runner.compile()
+        context = plan.context()
+        compare(plan.execute(plan.steps[0], context,
+                             plan.slotted(context)), expected=1)
+        compare(plan.execute(plan.steps[1], context), expected=2)
+        # 'x' is released once no later step can require it:
+        compare(context, expected={})
+
+    def test_execute_context_error(self):
+        runner = Runner()
+        runner.add(lambda x: x, requires='x')
+        plan = runner.compile()
+        context = Context()
+        with ShouldRaise(ContextError) as s:
+            plan.execute(plan.steps[0], context)
+        compare(s.raised.point, expected=runner.start)
+        self.assertTrue(s.raised.context is context)
+
+    def test_slotted(self):
+        plan = Runner().compile()
+        context = plan.context()
+        self.assertTrue(plan.slotted(context) is context.slotted)
+        compare(plan.slotted(Context()), expected=None)
+        compare(plan.slotted(SlotContext({})), expected=None)
+
+    def test_flow_end(self):
+        runner = Runner()
+        runner.add(lambda: [1, 2], returns=streams('item'))
+        runner.add(lambda item: item * 2, requires='item', returns='double')
+        runner.add(lambda double: double + 1, requires='double')
+        plan = runner.compile()
+        triples = list(plan.flow(Context(), Cursor(plan.steps), 2))
+        compare([(context['double'], result, index)
+                 for context, result, index in triples],
+                expected=[(2, 2, 2), (4, 4, 2)])
+
+    def test_run_in_supplied_context(self):
+        @requires('foo')
+        @returns('bar')
+        def job(foo):
+            return foo+1
+        context = Context()
+        context.add(1, 'foo')
+        compare(Runner(job)(context), expected=2)
+        compare(context, expected={'foo': 1, 'bar': 2})
+
+
+def square(x):
+    return x * x
+
+
+def process_id():
+    return getpid()
+
+
+class TestSlots(TestCase):
+
+    def test_allocated(self):
+        @returns('a')
+        def job1():
+            pass  # pragma: no cover
+
+        @requires(T1, 'a')
+        @returns('b')
+        def job2(t, a):
+            pass  # pragma: no cover
+
+        plan = Runner(job1, job2).compile()
+        compare(set(plan.slots), expected={'a', 'b', T1})
+        compare(sorted(plan.slots.values()), expected=[0, 1, 2])
+        job1_step, job2_step = plan.steps
+        compare(job1_step.add_slot, expected=plan.slots['a'])
+        compare([r.slot for r in job2_step.requirements],
+                expected=[plan.slots[T1], plan.slots['a']])
+        compare(job2_step.add_slot, expected=plan.slots['b'])
+
+    def test_context(self):
+        runner = Runner(lambda: None)
+        plan = runner.compile()
+        context = plan.context()
+        self.assertTrue(type(context) is SlotContext)
+        self.assertTrue(context.slots is plan.slots)
+
+    def test_runner_uses_slot_context(self):
+        def job1():
+            return T1()
+
+        @requires(T1)
+        @returns('x')
+        def job2(t):
+            return 'foo'
+
+        @requires('x', optional(T2))
+        def job3(x, t2=None):
+            return x, t2
+
+        runner = Runner(job1, job2, job3)
+        compare(runner(), expected=('foo', None))
+
+        context = runner.compile().context()
+        compare(runner(context), expected=('foo', None))
+        compare(context.slotted[context.slots['x']], expected='foo')
+        compare(context, expected={
+            T1: context[T1], 'x': 'foo', tuple: ('foo', None)
+        })
+
+    def test_slot_context_from_other_plan(self):
+        @returns('x')
+        def job1():
+            return 1
+
+        @requires('x')
+        def job2(x):
+            return x + 1
+
+        context = Runner(job2).compile().context()
+        compare(Runner(job1, job2)(context), expected=2)
+        compare(context, expected={'x': 1, int: 2})
+
+    def test_missing(self):
+        @requires('x')
+        def job(x):
+            pass  # pragma: no cover
+
+        runner = Runner(job)
+        with ShouldRaise(ContextError) as s:
+            runner()
+        compare(s.raised.text, expected="No 'x' in context")
+        compare(s.raised.point, expected=runner.start)
+
+    def test_already_in_context(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='x')
+        runner.add(lambda: 2, returns='x')
+        with ShouldRaise(ContextError) as s:
+            runner()
+        compare(s.raised.text, expected="Context already contains 'x'")
+
+    def test_lazy(self):
+        m = Mock()
+
+        @returns('x')
+        def make():
+            m.make()
+            return 1
+
+        @requires('x', 'x')
+        def job(a, b):
+            return a + b
+
+        runner = Runner()
+        runner.add(make, lazy=True)
+        runner.add(job)
+        compare(runner(), expected=2)
+        compare(m.mock_calls, expected=[call.make()])
+
+
+class TestProcessStep(TestCase):
+
+    def setUp(self):
+        self.executor = ProcessPoolExecutor(1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_compiled(self):
+        runner = Runner()
+        runner.add(square, requires='x', runs_in='process')
+        compare([type(s) for s in runner.compile().steps],
+                expected=[ProcessStep])
+
+    def test_called_in_other_process(self):
+        runner = Runner()
+        runner.add(process_id, returns='pid', runs_in='process')
+        pid = runner(process_executor=self.executor)
+        self.assertFalse(pid == getpid())
+
+    def test_result_added(self):
+        runner = Runner()
+        runner.add(lambda: 3, returns='x')
+        runner.add(square, requires='x', returns='y', runs_in='process')
+        runner.add(lambda y: y + 1, requires='y')
+        context = Context()
+        compare(runner(context, process_executor=self.executor), expected=10)
+        compare(context, expected={'x': 3, 'y': 9, int: 10})
+
+    def test_no_process_executor(self):
+        runner = Runner()
+        runner.add(process_id, runs_in='process')
+        compare(runner(), expected=getpid())
+
+    def test_callable_not_picklable(self):
+        runner = Runner()
+        job = lambda: None
+        runner.add(job, runs_in='process')
+        with ShouldRaise(ContextError) as s:
+            runner(process_executor=self.executor)
+        self.assertTrue(s.raised.text.startswith(
+            'Cannot pickle %r to call it in another process: ' % job
+        ))
+        compare(s.raised.point, expected=runner.start)
+
+    def test_parameters_not_picklable(self):
+        runner = Runner()
+        runner.add(lambda: (lambda: None), returns='x')
+        runner.add(square, requires='x', runs_in='process')
+        with ShouldRaise(ContextError) as s:
+            runner(process_executor=self.executor)
+        self.assertTrue(s.raised.text.startswith(
+            'Cannot pickle parameters for %r to call it in another '
+            'process: ' % square
+        ))
+        compare(s.raised.point, expected=runner.end)
+
+    def test_exception(self):
+        runner = Runner()
+        runner.add(lambda: 'x', returns='x')
+        runner.add(square, requires='x', runs_in='process')
+        with ShouldRaise(TypeError):
+            runner(process_executor=self.executor)
+
+    def test_clone(self):
+        runner = Runner()
+        runner.add(square, requires='x', runs_in='process')
+        compare(runner.clone().start.runs_in, expected='process')
+
+    def test_generate(self):
+        runner = Runner()
+        runner.add(lambda: 4, returns='x')
+        runner.add(square, requires='x', runs_in='process')
+        context = Context()
+        context.process_executor = self.executor
+        compare(runner.generate()(context), expected=16)
+
+
+class TestScope(TestCase):
+
+    def test_close(self):
+        m = MagicMock()
+        scope = Scope()
+        scope.managers.extend((m.first, m.second))
+        scope.results['point'] = [], None
+        scope.values['key'] = 'value'
+        scope.close()
+        compare(m.mock_calls, expected=[
+            call.second.__exit__(None, None, None),
+            call.first.__exit__(None, None, None),
+        ])
+        compare(scope.managers, expected=[])
+        compare(scope.results, expected={})
+        compare(scope.values, expected={})
+
+    def test_close_exception(self):
+        m = MagicMock()
+        m.second.__exit__ = Mock(side_effect=ValueError('boom'))
+        scope = Scope()
+        scope.managers.extend((m.first, m.second))
+        with ShouldRaise(ValueError('boom')):
+            scope.close()
+        compare(m.mock_calls, expected=[
+            call.second.__exit__(None, None, None),
+            call.first.__exit__(None, None, None),
+        ])
+
+    def test_compiled(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a', scope='batch')
+        runner.add(lambda: 2, returns='b', scope='process', lazy=True)
+        runner.add(lambda: 3, returns='c', scope='run')
+        plan = runner.compile()
+        compare([type(step) for step in plan.steps],
+                expected=[ScopedStep, ScopedFactoryStep, Step])
+        compare([step.scope for step in plan.steps],
+                expected=['batch', 'process', None])
+        compare(plan.scoped, expected=True)
+
+    def test_not_scoped(self):
+        compare(Runner(lambda: None).compile().scoped, expected=False)
+
+    def test_lazy_required_by_scoped(self):
+        m = Mock()
+        runner = Runner()
+        runner.add(m.config, returns='config', scope='process', lazy=True)
+        runner.add(m.connect, requires='config', returns='conn',
+                   scope='process')
+        runner.add(m.use, requires='conn')
+        runner()
+        runner()
+        compare(m.mock_calls, expected=[
+            call.config(),
+            call.connect(m.config.return_value),
+            call.use(m.connect.return_value),
+            call.use(m.connect.return_value),
+        ])
+
+    def test_no_scopes_in_context(self):
+        m = Mock()
+        runner = Runner()
+        runner.add(m.job, returns='a', scope='process')
+        runner.add(m.make, returns='b', scope='process', lazy=True)
+        runner.add(m.use, requires='b')
+        plan = runner.compile()
+        for _ in range(2):
+            plan(Context())
+        compare(m.mock_calls, expected=[
+            call.job(), call.make(), call.use(m.make.return_value),
+            call.job(), call.make(), call.use(m.make.return_value),
+        ])
+
+
+class TestInvariantPrefix(TestCase):
+
+    def test_empty(self):
+        compare(invariant_prefix(Runner().compile(), 'x'), expected=0)
+
+    def test_all_invariant(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        runner.add(T1)
+        compare(invariant_prefix(runner.compile(), 'x'), expected=2)
+
+    def test_needs_key(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        runner.add(lambda x: 1, requires='x', returns='b')
+        runner.add(lambda: 1, returns='c')
+        compare(invariant_prefix(runner.compile(), 'x'), expected=1)
+
+    def test_needs_how(self):
+        runner = Runner()
+        runner.add(lambda x: 1, requires=item('x', 'y'), returns='b')
+        compare(invariant_prefix(runner.compile(), item('x', 'z')),
+                expected=0)
+
+    def test_needs_dependent_lazy(self):
+        runner = Runner()
+        runner.add(lambda x: 1, requires='x', returns='a', lazy=True)
+        runner.add(lambda a: 1, requires='a', returns='b', lazy=True)
+        runner.add(lambda: 1, returns='c', lazy=True)
+        runner.add(lambda c: 1, requires='c', returns='d')
+        runner.add(lambda b: 1, requires='b', returns='e')
+        compare(invariant_prefix(runner.compile(), 'x'), expected=4)
+
+    def test_side_effects(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        runner.add(side_effects(lambda: None), returns='b')
+        compare(invariant_prefix(runner.compile(), 'x'), expected=1)
+
+    def test_context_manager_class(self):
+        class CM(object):
+            def __enter__(self): pass  # pragma: no cover
+            def __exit__(self, *args): pass  # pragma: no cover
+        runner = Runner(CM)
+        compare(invariant_prefix(runner.compile(), 'x'), expected=0)
+
+    def test_result_unknown(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        runner.add(lambda: None)
+        compare(invariant_prefix(runner.compile(), 'x'), expected=1)
+
+
+def releases(runner):
+    return [set(step.releases) for step in runner.compile().steps]
+
+
+class TestLiveness(TestCase):
+
+    def test_not_releasing(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        compare([step.releases for step in runner.compile().steps],
+                expected=[None])
+
+    def test_last_use(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        runner.add(lambda a: 2, requires='a', returns='b')
+        runner.add(lambda a, b: 3, requires=('a', 'b'), returns='c')
+        runner.add(lambda c: 4, requires='c')
+        runner.release()
+        compare(releases(runner), expected=[set(), set(), {'a', 'b'}, {'c'}])
+
+    def test_never_required(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        runner.add(lambda: 2, returns='b')
+        runner.release()
+        compare(releases(runner), expected=[{'a'}, {'b'}])
+
+    def test_supplied(self):
+        runner = Runner()
+        runner.add(lambda x: 1, requires='x', returns='a')
+        runner.release()
+        compare(releases(runner), expected=[{'x', 'a'}])
+
+    def test_keep(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        runner.add(lambda a: 2, requires='a', returns='b')
+        runner.release('a', 'b')
+        compare(releases(runner), expected=[set(), set()])
+        compare(runner.compile().keep, expected={'a', 'b'})
+
+    def test_how(self):
+        runner = Runner()
+        runner.add(lambda: {}, returns='a')
+        runner.add(lambda x: 2, requires=item(optional('a'), 'x'))
+        runner.release()
+        compare(releases(runner), expected=[set(), {'a'}])
+
+    def test_lazy(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        runner.add(lambda a: 2, requires='a', returns='b', lazy=True)
+        runner.add(lambda: 3, returns='c')
+        runner.add(lambda b: 4, requires='b')
+        runner.release()
+        compare(releases(runner),
+                expected=[set(), set(), {'c'}, {'a', 'b'}])
+
+    def test_lazy_of_lazy(self):
+        runner = Runner()
+        runner.add(lambda x: 1, requires='x', returns='a', lazy=True)
+        runner.add(lambda a: 2, requires='a', returns='b', lazy=True)
+        runner.add(lambda b: 3, requires='b')
+        runner.release()
+        compare(releases(runner), expected=[set(), set(), {'x', 'a', 'b'}])
+
+    def test_result_unknown(self):
+        runner = Runner()
+        runner.add(lambda: T1())
+        runner.add(lambda t: 1, requires=T1)
+        runner.release()
+        # the key the first callable adds is not known in advance, but
+        # it is known to be required by the second:
+        compare(releases(runner), expected=[set(), {T1}])
+
+    def test_liveness(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        plan = runner.compile()
+        liveness(plan, frozenset())
+        compare(plan.steps[0].releases, expected=('a',))
+
+    def test_recompiled(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        plan = runner.compile()
+        runner.release()
+        self.assertFalse(runner.compile() is plan)
+
+    def test_release(self):
+        context = Context()
+        context['a'] = 1
+        context['b'] = 2
+        release(context, ('a', 'c'))
+        compare(context, expected={'b': 2})
+
+    def test_release_slotted(self):
+        context = SlotContext({'a': 0, 'b': 1})
+        context['a'] = 1
+        context['b'] = 2
+        release(context, ('a', 'c'))
+        compare(dict(context.items()), expected={'b': 2})
+        self.assertFalse('a' in context)
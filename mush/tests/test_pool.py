@@ -0,0 +1,220 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import ShouldRaise, compare
+
+from mush.context import Context
+from mush.declarations import requires, returns
+from mush.pool import Lease, Pool, PoolTimeout
+from mush.runner import Runner
+
+
+class Connection(object):
+    pass
+
+
+class TestPool(TestCase):
+
+    def test_acquire_creates(self):
+        pool = Pool(Connection)
+        resource = pool.acquire()
+        self.assertTrue(isinstance(resource, Connection))
+        compare(pool.size, expected=1)
+        compare(pool.idle, expected=[])
+
+    def test_release_and_reuse(self):
+        pool = Pool(Connection)
+        resource = pool.acquire()
+        pool.release(resource)
+        compare(pool.idle, expected=[resource])
+        self.assertTrue(pool.acquire() is resource)
+        compare(pool.size, expected=1)
+
+    def test_bounded(self):
+        pool = Pool(Connection, max_size=1, timeout=0.01)
+        pool.acquire()
+        with ShouldRaise(PoolTimeout) as s:
+            pool.acquire()
+        self.assertTrue(str(s.raised).startswith('No resource available'))
+
+    def test_wait_for_release(self):
+        pool = Pool(Connection, max_size=1, timeout=5)
+        resource = pool.acquire()
+        waiting = Event()
+
+        def acquire():
+            waiting.set()
+            return pool.acquire()
+
+        with ThreadPoolExecutor(1) as executor:
+            future = executor.submit(acquire)
+            waiting.wait(5)
+            pool.release(resource)
+            self.assertTrue(future.result() is resource)
+        compare(pool.size, expected=1)
+
+    def test_factory_fails(self):
+        factory = Mock(side_effect=ValueError('boom'))
+        pool = Pool(factory, max_size=1)
+        with ShouldRaise(ValueError('boom')):
+            pool.acquire()
+        compare(pool.size, expected=0)
+
+    def test_check_fails(self):
+        m = Mock()
+        m.factory.side_effect = ['bad', 'good']
+        m.check.side_effect = lambda resource: resource == 'good'
+        pool = Pool(m.factory, check=m.check, dispose=m.dispose)
+        pool.release(pool.acquire())
+        compare(pool.acquire(), expected='good')
+        compare(pool.size, expected=1)
+        compare(m.mock_calls, expected=[
+            call.factory(), call.check('bad'), call.dispose('bad'),
+            call.factory(),
+        ])
+
+    def test_check_passes(self):
+        check = Mock(return_value=True)
+        pool = Pool(Connection, check=check)
+        resource = pool.acquire()
+        pool.release(resource)
+        self.assertTrue(pool.acquire() is resource)
+        check.assert_called_once_with(resource)
+
+    def test_close(self):
+        m = Mock()
+        m.factory.side_effect = ['a', 'b']
+        pool = Pool(m.factory, dispose=m.dispose)
+        a = pool.acquire()
+        b = pool.acquire()
+        pool.release(a)
+        pool.close()
+        compare(pool.size, expected=1)
+        compare(pool.idle, expected=[])
+        pool.release(b)
+        compare(m.mock_calls, expected=[
+            call.factory(), call.factory(), call.dispose('a'),
+        ])
+
+    def test_repr(self):
+        pool = Pool(Connection, max_size=2)
+        pool.release(pool.acquire())
+        compare(repr(pool), expected=(
+            '<Pool for %r: size=1, idle=1, max_size=2>' % Connection
+        ))
+
+
+class TestLease(TestCase):
+
+    def test_context_manager(self):
+        pool = Pool(Connection)
+        lease = pool()
+        self.assertTrue(isinstance(lease, Lease))
+        with lease as resource:
+            compare(pool.idle, expected=[])
+        compare(pool.idle, expected=[resource])
+
+    def test_released_on_exception(self):
+        pool = Pool(Connection)
+        with ShouldRaise(ValueError):
+            with pool() as resource:
+                raise ValueError()
+        compare(pool.idle, expected=[resource])
+
+
+class TestRunner(TestCase):
+
+    def test_lent_per_run(self):
+        m = Mock()
+        pool = Pool(Connection)
+
+        @requires(Connection)
+        def job(conn):
+            m.job(conn, list(pool.idle))
+
+        runner = Runner(pool, job)
+        runner()
+        resource, = pool.idle
+        runner()
+        compare(m.mock_calls, expected=[
+            call.job(resource, []), call.job(resource, []),
+        ])
+        compare(pool.size, expected=1)
+
+    def test_two_pools(self):
+        class Other(object):
+            pass
+        first = Pool(Connection)
+        second = Pool(Other)
+
+        @requires(Connection, Other)
+        @returns('result')
+        def job(conn, other):
+            return conn, other
+
+        runner = Runner(first, second, job)
+        runner.validate()
+        conn, other = runner()
+        compare(first.idle, expected=[conn])
+        compare(second.idle, expected=[other])
+        conn_, other_ = runner()
+        self.assertTrue(conn_ is conn)
+        self.assertTrue(other_ is other)
+
+    def test_two_pools_executor(self):
+        class Other(object):
+            pass
+
+        @requires(Connection, Other)
+        @returns('result')
+        def job(conn, other):
+            return conn, other
+
+        runner = Runner(Pool(Connection), Pool(Other), job)
+        with ThreadPoolExecutor(2) as executor:
+            conn, other = runner(executor=executor)
+        self.assertTrue(isinstance(conn, Connection))
+        self.assertTrue(isinstance(other, Other))
+
+    def test_lease_not_added(self):
+        runner = Runner(Pool(Connection), lambda: None)
+        context = Context()
+        runner(context)
+        self.assertFalse(Lease in context)
+
+    def test_validate_factory_not_class(self):
+        runner = Runner(Pool(lambda: Connection()),
+                        requires(Connection)(lambda conn: None))
+        runner.validate()
+
+    def test_concurrent_runs(self):
+        pool = Pool(Connection, max_size=2)
+        both = Event()
+        seen = []
+
+        @requires(Connection)
+        @returns('result')
+        def job(conn):
+            seen.append(conn)
+            if len(seen) == 2:
+                both.set()
+            both.wait(5)
+            return conn
+
+        runner = Runner(pool, job)
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(runner) for _ in range(2)]
+            results = [future.result() for future in futures]
+        self.assertFalse(results[0] is results[1])
+        compare(pool.size, expected=2)
+        compare(len(pool.idle), expected=2)
+
+    def test_generated(self):
+        pool = Pool(Connection)
+        runner = Runner()
+        runner.add(pool)
+        runner.add(lambda conn: conn, requires=Connection, returns='result')
+        resource = runner.generate()(Context())
+        compare(pool.idle, expected=[resource])
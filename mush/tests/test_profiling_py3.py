@@ -0,0 +1,147 @@
+import sys
+import tracemalloc
+from unittest import TestCase, skipIf
+
+from testfixtures import Replace, ShouldRaise, compare
+
+from mush.profiling import MemoryProfiler, deep_size
+from mush.runner import Runner
+
+
+def allocate() -> 'data':
+    return [bytearray(100000) for _ in range(10)]
+
+
+def temporary(data: 'data') -> 'total':
+    scratch = bytearray(500000)
+    return len(scratch) + len(data)
+
+
+class Slotted(object):
+    __slots__ = 'value'
+
+    def __init__(self, value):
+        self.value = value
+
+
+class TestDeepSize(TestCase):
+
+    def test_containers(self):
+        data = [bytearray(1000), {'a': bytearray(1000)}]
+        self.assertTrue(deep_size(data) > 2000)
+
+    def test_shared_counted_once(self):
+        item = bytearray(1000)
+        self.assertTrue(deep_size([item, item]) < 2 * sys.getsizeof(item))
+
+    def test_instance(self):
+        class Holder(object):
+            def __init__(self):
+                self.data = bytearray(1000)
+        self.assertTrue(deep_size(Holder()) > 1000)
+
+    def test_slots(self):
+        self.assertTrue(deep_size(Slotted(bytearray(1000))) > 1000)
+
+    def test_classes_not_counted(self):
+        compare(deep_size([Slotted]), expected=sys.getsizeof([Slotted]))
+
+    def test_limit(self):
+        compare(deep_size([bytearray(1000)], limit=1),
+                expected=sys.getsizeof([bytearray(1000)]))
+
+
+class TestMemoryProfiler(TestCase):
+
+    def setUp(self):
+        self.was_tracing = tracemalloc.is_tracing()
+        self.addCleanup(self.check_tracing)
+
+    def check_tracing(self):
+        compare(tracemalloc.is_tracing(), expected=self.was_tracing)
+
+    def make_profiler(self, **kw):
+        profiler = MemoryProfiler(**kw)
+        self.addCleanup(profiler.close)
+        return profiler
+
+    @skipIf(not hasattr(tracemalloc, 'reset_peak'), 'requires Python 3.9')
+    def test_points(self):
+        profiler = self.make_profiler()
+        runner = Runner(allocate, temporary)
+        runner.instrument(profiler)
+        runner()
+        runner()
+        actual = profiler.as_dict()
+        compare(list(actual['points']), expected=['allocate', 'temporary'])
+        allocated = actual['points']['allocate']
+        compare(allocated['calls'], expected=2)
+        self.assertTrue(allocated['allocated'] >= 2000000)
+        self.assertTrue(allocated['peak'] >= 1000000)
+        site, size = allocated['sites'][0]
+        self.assertTrue('test_profiling_py3.py' in site)
+        self.assertTrue(size >= 2000000)
+        scratch = actual['points']['temporary']
+        self.assertTrue(scratch['peak'] >= 500000)
+        self.assertTrue(scratch['allocated'] < 500000)
+
+    def test_no_reset_peak(self):
+        profiler = self.make_profiler(top=0)
+        runner = Runner(allocate, temporary)
+        runner.instrument(profiler)
+        with Replace('mush.profiling.reset_peak', None):
+            runner()
+        actual = profiler.as_dict()
+        compare(actual['points']['allocate']['peak'], expected=None)
+        compare(actual['points']['temporary']['peak'], expected=None)
+        self.assertTrue(actual['points']['allocate']['allocated'] >= 1000000)
+
+    def test_resources(self):
+        profiler = self.make_profiler()
+        runner = Runner(allocate, temporary)
+        runner.instrument(profiler)
+        runner()
+        resources = profiler.as_dict()['resources']
+        compare(sorted(resources), expected=['data', 'total'])
+        self.assertTrue(resources['data']['size'] >= 1000000)
+        compare(resources['data']['max'], expected=resources['data']['size'])
+
+    def test_lazy_not_resolved(self):
+        profiler = self.make_profiler()
+        runner = Runner()
+        runner.add(allocate, lazy=True)
+        runner.instrument(profiler)
+        runner()
+        compare(profiler.as_dict(), expected={'points': {}, 'resources': {}})
+
+    def test_no_sites(self):
+        profiler = self.make_profiler(top=0)
+        runner = Runner(allocate)
+        runner.instrument(profiler)
+        runner()
+        point = profiler.as_dict()['points']['allocate']
+        compare(point['sites'], expected=[])
+        self.assertTrue(point['allocated'] >= 1000000)
+
+    def test_exception(self):
+        profiler = self.make_profiler()
+
+        def fail():
+            raise ValueError()
+
+        runner = Runner(fail)
+        runner.instrument(profiler)
+        with ShouldRaise(ValueError):
+            runner()
+        compare(profiler.as_dict()['points']['fail']['calls'], expected=1)
+        compare(profiler.active, expected={})
+
+    def test_already_tracing(self):
+        tracemalloc.start()
+        try:
+            profiler = MemoryProfiler()
+            profiler.close()
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            if not self.was_tracing:
+                tracemalloc.stop()
@@ -1,3 +1,5 @@
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
 
 from mock import Mock, call
@@ -6,10 +8,12 @@ from testfixtures import (
     compare
 )
 
-from mush.context import ContextError
+from mush.context import Context, ContextError
 from mush.declarations import (
-    requires, attr, item, nothing, returns, returns_mapping, lazy
+    requires, attr, how, item, nothing, returns, returns_mapping, lazy,
+    returns_sequence, scope, side_effects, streams
 )
+from mush.markers import missing
 from mush.runner import Runner
 
 
@@ -622,6 +626,25 @@ class RunnerTests(TestCase):
                 call.job2('bar'),
                 ], m.mock_calls)
 
+    def test_custom_how_with_state(self):
+        class default(how):
+            def __init__(self, type, value):
+                super(default, self).__init__(type)
+                self.value = value
+            def process(self, o):
+                if o is missing:
+                    return self.value
+                return o
+        def f(x):
+            return 'f:%s' % x
+        def g(x):
+            return 'g:%s' % x
+        runner = Runner()
+        runner.add(f, requires(default('x', 1)), returns='f')
+        runner.add(g, requires(default('x', 2)), returns='g')
+        runner.add(lambda f, g: (f, g), requires('f', 'g'))
+        compare(runner(), expected=('f:1', 'g:2'))
+
     def test_attr_multiple(self):
         class T2:
             bar = 'baz'
@@ -794,6 +817,51 @@ class RunnerTests(TestCase):
                 call.use(),
                 ], m.mock_calls)
 
+    def test_resources(self):
+        class Request(object): pass
+        request = Request()
+
+        @requires(Request, 'config')
+        @returns('response')
+        def handle(request, config):
+            return request, config
+
+        runner = Runner(handle)
+        compare(runner(resources={Request: request, 'config': 'cfg'}),
+                expected=(request, 'cfg'))
+        compare(runner(resources={Request: 1, 'config': 2}),
+                expected=(1, 2))
+
+    def test_resources_with_context(self):
+        context = Context()
+        runner = Runner(requires('x')(lambda x: x * 2))
+        compare(runner(context, resources={'x': 2}), expected=4)
+        compare(context, expected={'x': 2, int: 4})
+
+    def test_resources_with_executor(self):
+        runner = Runner()
+        runner.add(lambda x: x * 2, requires='x', returns='y')
+        with ThreadPoolExecutor(1) as executor:
+            compare(runner(executor=executor, resources={'x': 2}),
+                    expected=4)
+
+    def test_resources_clash(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='x')
+        with ShouldRaise(ContextError) as s:
+            runner(resources={'x': 2})
+        compare(s.raised.text, expected="Context already contains 'x'")
+
+    def test_resources_validated(self):
+        runner = Runner(requires('x')(lambda x: x))
+        runner.validate_on_call = True
+        compare(runner(resources={'x': 1}), expected=1)
+
+    def test_resources_batch(self):
+        runner = Runner(requires('x')(lambda x: x))
+        with runner.batch() as batch:
+            compare(batch(resources={'x': 1}), expected=1)
+
     def test_clone(self):
         m = Mock()
         class T1(object): pass
@@ -868,6 +936,24 @@ class RunnerTests(TestCase):
                 call.tn()
                 ], m.mock_calls)
 
+    def test_clone_shares_declarations_and_labels(self):
+        def job(a): pass
+        runner1 = Runner()
+        runner1.add(job, requires='a', returns='b', label='job')
+        runner1.add(job, requires='b')
+        runner2 = runner1.clone()
+        for point1, point2 in ((runner1.start, runner2.start),
+                               (runner1.end, runner2.end)):
+            self.assertFalse(point1 is point2)
+            self.assertTrue(point1.requires is point2.requires)
+            self.assertTrue(point1.returns is point2.returns)
+            self.assertTrue(point1.labels is point2.labels)
+        compare(runner2.start.labels, expected={'job'})
+        # labels are replaced rather than modified:
+        runner2['job'].add_label('other')
+        compare(runner1.start.labels, expected={'job'})
+        compare(runner2.start.labels, expected={'job', 'other'})
+
     def test_clone_end_label(self):
         m = Mock()
         runner1 = Runner()
@@ -1335,3 +1421,954 @@ class RunnerTests(TestCase):
 
     def test_repr_empty(self):
         compare('<Runner></Runner>', repr(Runner()))
+
+
+class SliceTests(TestCase):
+
+    def test_empty(self):
+        verify(Runner().slice('x'))
+
+    def test_named(self):
+        @returns('a')
+        def job1(): return 1
+        @returns('b')
+        def job2(): return 2
+        @requires('a')
+        @returns('c')
+        def job3(a): return a + 10
+        @requires('b')
+        @returns('d')
+        def job4(b): return b + 20
+
+        runner = Runner()
+        runner.add(job1, label='one')
+        runner.add(job2, label='two')
+        runner.add(job3)
+        runner.add(job4)
+        sliced = runner.slice('c')
+        verify(sliced, (job1, {'one'}), (job3, set()))
+        compare(sliced(), expected=11)
+        # the original is unchanged:
+        verify(runner, (job1, {'one'}), (job2, {'two'}),
+               (job3, set()), (job4, set()))
+
+    def test_multiple_targets(self):
+        @returns('a')
+        def job1(): pass  # pragma: no cover
+        @returns('b')
+        def job2(): pass  # pragma: no cover
+        @returns('c')
+        def job3(): pass  # pragma: no cover
+
+        verify(Runner(job1, job2, job3).slice('a', item('c', 'x')),
+               (job1, set()), (job3, set()))
+
+    def test_types(self):
+        class T1(object): pass
+        class T2(object): pass
+
+        def make_t2():
+            return T2()
+
+        @requires(T2)
+        @returns('x')
+        def job(t2): pass  # pragma: no cover
+
+        @returns('y')
+        def other(): pass  # pragma: no cover
+
+        runner = Runner(T1, make_t2, job, other)
+        verify(runner.slice('x'), (make_t2, set()), (job, set()))
+        # make_t2 could return a T1 for all that is known:
+        verify(runner.slice(T1), (T1, set()), (make_t2, set()))
+        verify(runner.slice('y'), (other, set()))
+
+    def test_dynamic(self):
+        @returns_mapping()
+        def mapping(): pass  # pragma: no cover
+        @returns_sequence()
+        def sequence(): pass  # pragma: no cover
+        @returns('x')
+        def job(): pass  # pragma: no cover
+
+        runner = Runner(mapping, sequence, job)
+        verify(runner.slice('x'), (mapping, set()), (job, set()))
+
+    def test_returns_nothing(self):
+        def job(): pass  # pragma: no cover
+        runner = Runner()
+        runner.add(job, returns=nothing)
+        verify(runner.slice('x'))
+
+    def test_side_effects(self):
+        m = Mock()
+
+        @side_effects
+        @requires('a')
+        def save(a):
+            m.save(a)
+
+        @returns('a')
+        def job1():
+            return 1
+
+        @returns('b')
+        def job2():
+            m.job2()  # pragma: no cover
+
+        runner = Runner(job1, job2, save)
+        sliced = runner.slice()
+        verify(sliced, (job1, set()), (save, set()))
+        sliced()
+        compare(m.mock_calls, expected=[call.save(1)])
+
+    def test_context_manager(self):
+        class CM(object):
+            def __enter__(self): pass  # pragma: no cover
+            def __exit__(self, *args): pass  # pragma: no cover
+
+        @returns('x')
+        def job(): pass  # pragma: no cover
+
+        verify(Runner(CM, job).slice(), (CM, set()))
+
+    def test_lazy(self):
+        m = Mock()
+
+        @returns('a')
+        def job1():
+            return 1
+
+        @requires('a')
+        @returns('b')
+        def make_b(a):
+            m.make_b(a)
+            return a + 1
+
+        @returns('c')
+        def make_c():
+            m.make_c()  # pragma: no cover
+
+        @requires('b')
+        @returns('d')
+        def job2(b):
+            return b * 2
+
+        runner = Runner()
+        runner.add(job1)
+        runner.add(make_b, lazy=True)
+        runner.add(make_c, lazy=True)
+        runner.add(job2)
+        sliced = runner.slice('d')
+        compare([type(p.obj).__name__ for p in
+                 (sliced.start, sliced.start.next, sliced.end)],
+                expected=['function', 'Factory', 'function'])
+        compare(sliced(), expected=4)
+        compare(m.mock_calls, expected=[call.make_b(1)])
+
+    def test_subclass(self):
+        class MyRunner(Runner):
+            pass
+        self.assertTrue(isinstance(MyRunner().slice(), MyRunner))
+
+
+class ScopeTests(TestCase):
+
+    def make_runner(self, m, scope_name, lazy=False):
+        @scope(scope_name)
+        @returns('conn')
+        def connect():
+            m.connect()
+            return 'conn'
+
+        @requires('conn')
+        def job(conn):
+            m.job(conn)
+            return conn + ' used'
+
+        runner = Runner()
+        runner.add(connect, lazy=lazy)
+        runner.add(job)
+        return runner
+
+    def test_process(self):
+        m = Mock()
+        runner = self.make_runner(m, 'process')
+        compare(runner(), expected='conn used')
+        compare(runner(), expected='conn used')
+        compare(m.mock_calls, expected=[
+            call.connect(), call.job('conn'), call.job('conn'),
+        ])
+
+    def test_process_close(self):
+        m = Mock()
+        runner = self.make_runner(m, 'process')
+        runner()
+        runner.close()
+        runner()
+        compare(m.mock_calls, expected=[
+            call.connect(), call.job('conn'),
+            call.connect(), call.job('conn'),
+        ])
+
+    def test_close_not_called(self):
+        Runner().close()
+
+    def test_batch(self):
+        m = Mock()
+        runner = self.make_runner(m, 'batch')
+        with runner.batch() as batch:
+            compare(batch(), expected='conn used')
+            compare(batch(), expected='conn used')
+        with runner.batch() as batch:
+            batch()
+        compare(m.mock_calls, expected=[
+            call.connect(), call.job('conn'), call.job('conn'),
+            call.connect(), call.job('conn'),
+        ])
+
+    def test_batch_outside_batch(self):
+        m = Mock()
+        runner = self.make_runner(m, 'batch')
+        runner()
+        runner()
+        compare(m.mock_calls, expected=[
+            call.connect(), call.job('conn'),
+            call.connect(), call.job('conn'),
+        ])
+
+    def test_run(self):
+        m = Mock()
+        runner = self.make_runner(m, 'run')
+        with runner.batch() as batch:
+            batch()
+            batch()
+        compare(m.mock_calls, expected=[
+            call.connect(), call.job('conn'),
+            call.connect(), call.job('conn'),
+        ])
+
+    def test_lazy(self):
+        m = Mock()
+        runner = self.make_runner(m, 'process', lazy=True)
+        runner()
+        runner()
+        compare(m.mock_calls, expected=[
+            call.connect(), call.job('conn'), call.job('conn'),
+        ])
+
+    def test_lazy_not_needed(self):
+        m = Mock()
+        @scope('batch')
+        @lazy
+        @returns('conn')
+        def connect():
+            m.connect()  # pragma: no cover
+        runner = Runner(connect, m.job)
+        with runner.batch() as batch:
+            batch()
+        compare(m.mock_calls, expected=[call.job()])
+
+    def test_context_manager(self):
+        m = Mock()
+
+        class Connection(object):
+            pass
+
+        class Pool(object):
+            def __enter__(self):
+                m.enter()
+                return Connection()
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+
+        @requires(Connection)
+        def job(conn):
+            m.job(type(conn))
+
+        runner = Runner()
+        runner.add(Pool, scope='batch')
+        runner.add(job)
+        with runner.batch() as batch:
+            compare(batch(), expected=None)
+            batch()
+            compare(m.mock_calls, expected=[
+                call.enter(), call.job(Connection), call.job(Connection),
+            ])
+        compare(m.mock_calls[-1], expected=call.exit(None))
+
+    def test_context_manager_outside_batch(self):
+        m = Mock()
+
+        class Pool(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+
+        runner = Runner()
+        runner.add(Pool, scope='batch')
+        runner.add(m.job)
+        runner()
+        compare(m.mock_calls, expected=[
+            call.enter(), call.job(), call.exit(None),
+        ])
+
+    def test_context_manager_closed_after_exception(self):
+        m = Mock()
+
+        class Pool(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+
+        @requires(Pool)
+        def bad(pool):
+            raise ValueError('boom')
+
+        runner = Runner()
+        runner.add(Pool, scope='process')
+        runner.add(bad)
+        with ShouldRaise(ValueError('boom')):
+            runner()
+        runner.close()
+        compare(m.mock_calls, expected=[call.enter(), call.exit(None)])
+
+    def test_failure_not_kept(self):
+        m = Mock(side_effect=[ValueError('boom'), 'conn'])
+        runner = Runner()
+        runner.add(m, returns='conn', scope='process')
+        with ShouldRaise(ValueError('boom')):
+            runner()
+        compare(runner(), expected='conn')
+        compare(runner(), expected='conn')
+        compare(len(m.mock_calls), expected=2)
+
+    def test_generated_process(self):
+        m = Mock()
+        runner = self.make_runner(m, 'process')
+        generated = runner.generate()
+        compare(generated(), expected='conn used')
+        compare(generated(), expected='conn used')
+        runner()
+        compare(m.mock_calls, expected=[
+            call.connect(), call.job('conn'), call.job('conn'),
+            call.job('conn'),
+        ])
+
+    def test_generated_context_manager(self):
+        m = Mock()
+
+        class Pool(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+
+        runner = Runner()
+        runner.add(Pool, scope='process')
+        runner.add(m.job)
+        generated = runner.generate()
+        generated(Context())
+        generated()
+        compare(m.mock_calls, expected=[
+            call.enter(), call.job(), call.job(),
+        ])
+        runner.close()
+        compare(m.mock_calls[-1], expected=call.exit(None))
+
+    def test_generated_batch_closed(self):
+        m = Mock()
+
+        class Pool(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+
+        runner = Runner()
+        runner.add(Pool, scope='batch')
+        runner.add(m.job)
+        runner.generate()()
+        compare(m.mock_calls, expected=[
+            call.enter(), call.job(), call.exit(None),
+        ])
+
+    def test_generated_source(self):
+        runner = self.make_runner(Mock(), 'process')
+        self.assertTrue(runner.source().startswith('def run(context=None):'))
+
+    def test_generated(self):
+        m = Mock()
+        runner = self.make_runner(m, 'batch')
+        with runner.batch() as batch:
+            generated = runner.generate()
+            for _ in range(2):
+                context = runner.compile().context()
+                context.scopes = {'batch': batch.scope}
+                compare(generated(context), expected='conn used')
+        compare(m.mock_calls, expected=[
+            call.connect(), call.job('conn'), call.job('conn'),
+        ])
+
+    def test_clone(self):
+        m = Mock()
+        runner = self.make_runner(m, 'process')
+        runner()
+        clone = runner.clone()
+        compare(clone.start.scope, expected='process')
+        clone()
+        compare(m.mock_calls, expected=[
+            call.connect(), call.job('conn'),
+            call.connect(), call.job('conn'),
+        ])
+
+
+class MapTests(TestCase):
+
+    def make_runner(self, m):
+        @returns('config')
+        def setup():
+            m.setup()
+            return 10
+
+        @requires('config', 'x')
+        @returns('y')
+        def job(config, x):
+            m.job(x)
+            if x is None:
+                raise ValueError('boom')
+            return config * x
+
+        return Runner(setup, job)
+
+    def test_serial(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        compare(list(runner.map([1, 2, 3], 'x')), expected=[10, 20, 30])
+        compare(m.mock_calls, expected=[
+            call.setup(), call.job(1), call.job(2), call.job(3),
+        ])
+
+    def test_lazy_iteration(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        results = runner.map([1, 2], 'x')
+        compare(m.mock_calls, expected=[])
+        compare(next(results), expected=10)
+        compare(m.mock_calls, expected=[call.setup(), call.job(1)])
+
+    def test_empty(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        compare(list(runner.map([], 'x')), expected=[])
+        compare(m.mock_calls, expected=[call.setup()])
+
+    def test_context_error(self):
+        @requires('x', 'y')
+        @returns('z')
+        def job(x, y):
+            pass  # pragma: no cover
+        results = list(Runner(job).map([1], 'x'))
+        compare(len(results), expected=1)
+        error = results[0]
+        self.assertTrue(isinstance(error, ContextError))
+        compare(error.text, expected="No 'y' in context")
+
+    def test_other_exception(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        results = runner.map([1, None, 3], 'x')
+        compare(next(results), expected=10)
+        with ShouldRaise(ValueError('boom')):
+            next(results)
+
+    def test_prefix_fails(self):
+        @requires('y')
+        @returns('a')
+        def job(y):
+            pass  # pragma: no cover
+        with ShouldRaise(ContextError):
+            list(Runner(job).map([1], 'x'))
+
+    def test_context_manager_per_item(self):
+        m = Mock()
+
+        class CM(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit()
+
+        @requires('x')
+        @returns('y')
+        def job(x):
+            m.job(x)
+            return x
+
+        runner = Runner(CM, job)
+        compare(list(runner.map([1, 2], 'x')), expected=[1, 2])
+        compare(m.mock_calls, expected=[
+            call.enter(), call.job(1), call.exit(),
+            call.enter(), call.job(2), call.exit(),
+        ])
+
+    def test_context_manager_returned_by_shared(self):
+        m = Mock()
+
+        class Sink(object):
+            def __enter__(self):
+                m.enter()
+                return self
+            def __exit__(self, type, obj, tb):
+                m.exit()
+
+        @returns('sink')
+        def open_sink():
+            return Sink()
+
+        @requires('sink', 'x')
+        @returns('y')
+        def job(sink, x):
+            m.job(x)
+            return x
+
+        runner = Runner(open_sink, job)
+        compare(list(runner.map([1, 2], 'x')), expected=[1, 2])
+        # the sink is kept open for all the runs:
+        compare(m.mock_calls, expected=[
+            call.enter(), call.job(1), call.job(2), call.exit(),
+        ])
+
+    def test_context_manager_returned_by_shared_adds(self):
+        m = Mock()
+
+        class Connection(object):
+            pass
+
+        class Pool(object):
+            def __enter__(self):
+                return Connection()
+            def __exit__(self, type, obj, tb):
+                m.exit()
+
+        def make_pool():
+            return Pool()
+
+        runner = Runner()
+        runner.add(make_pool, returns=nothing)
+        runner.add(lambda c, x: type(c), requires=(Connection, 'x'),
+                   returns='y')
+        compare(list(runner.map([1], 'x')), expected=[Connection])
+        compare(m.mock_calls, expected=[call.exit()])
+
+    def test_lazy_invariant(self):
+        m = Mock()
+
+        @lazy
+        @returns('config')
+        def config():
+            m.config()
+            return 2
+
+        @requires('config')
+        @returns('setting')
+        def setting(config):
+            return config
+
+        @requires('setting', 'x')
+        @returns('y')
+        def job(setting, x):
+            return setting * x
+
+        runner = Runner(config, setting, job)
+        compare(list(runner.map([1, 2], 'x')), expected=[2, 4])
+        compare(m.mock_calls, expected=[call.config()])
+
+    def test_scoped(self):
+        m = Mock()
+
+        class Pool(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit()
+
+        @requires('x')
+        @returns('y')
+        def job(x):
+            m.job(x)
+            return x
+
+        runner = Runner()
+        runner.add(job)
+        runner.add(Pool, scope='batch')
+        compare(list(runner.map([1, 2], 'x')), expected=[None, None])
+        compare(m.mock_calls, expected=[
+            call.job(1), call.enter(), call.job(2), call.exit(),
+        ])
+
+    def test_executor(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        runner.map_window = 2
+        with ThreadPoolExecutor(2) as executor:
+            compare(list(runner.map(range(5), 'x', executor=executor)),
+                    expected=[0, 10, 20, 30, 40])
+        compare(m.mock_calls[0], expected=call.setup())
+        compare(len(m.mock_calls), expected=6)
+
+    def test_executor_unordered(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        runner.map_window = 2
+        with ThreadPoolExecutor(2) as executor:
+            results = runner.map(range(5), 'x', executor=executor,
+                                 ordered=False)
+            compare(sorted(results), expected=[0, 10, 20, 30, 40])
+
+    def test_validate_on_call(self):
+        @requires('x', 'y')
+        @returns('z')
+        def job(x, y):
+            pass  # pragma: no cover
+        runner = Runner(job)
+        runner.validate_on_call = True
+        with ShouldRaise(ContextError):
+            list(runner.map([1], 'x'))
+
+
+class StreamTests(TestCase):
+
+    def make_runner(self, m):
+        @requires('path')
+        @streams('line')
+        def read(path):
+            m.open(path)
+            for line in ('a', 'b', 'c'):
+                yield line
+            m.close(path)
+
+        @requires('line')
+        @returns('upper')
+        def upper(line):
+            m.upper(line)
+            return line.upper()
+
+        @requires('path', 'upper')
+        @returns('result')
+        def report(path, upper):
+            return path + ':' + upper
+
+        return Runner(read, upper, report)
+
+    def test_stream(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        results = runner.stream(resources={'path': 'f'})
+        compare(m.mock_calls, expected=[])
+        compare(next(results), expected='f:A')
+        compare(m.mock_calls, expected=[call.open('f'), call.upper('a')])
+        compare(list(results), expected=['f:B', 'f:C'])
+        compare(m.mock_calls[-1], expected=call.close('f'))
+
+    def test_call(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        compare(runner(resources={'path': 'f'}), expected='f:C')
+        compare(m.mock_calls, expected=[
+            call.open('f'), call.upper('a'), call.upper('b'),
+            call.upper('c'), call.close('f'),
+        ])
+
+    def test_empty(self):
+        runner = Runner()
+        runner.add(lambda: iter(()), returns=streams('x'))
+        runner.add(lambda x: x, requires='x', returns='y')
+        compare(list(runner.stream()), expected=[])
+        compare(runner(), expected=None)
+
+    def test_no_streams(self):
+        compare(list(Runner(lambda: 1).stream()), expected=[1])
+
+    def test_child_contexts(self):
+        @requires('x')
+        @returns('y')
+        def job(x):
+            return x * 2
+
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        runner.add(lambda: [1, 2], returns=streams('x'))
+        runner.add(job)
+        context = Context()
+        runner(context)
+        compare(context, expected={'a': 1})
+
+    def test_nested(self):
+        runner = Runner()
+        runner.add(lambda: ['a', 'b'], returns=streams('x'))
+        runner.add(lambda x: [x + '1', x + '2'], requires='x',
+                   returns=streams('y'))
+        runner.add(lambda y: y, requires='y', returns='z')
+        compare(list(runner.stream()), expected=['a1', 'a2', 'b1', 'b2'])
+
+    def test_context_manager_around(self):
+        m = Mock()
+
+        class CM(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+
+        runner = Runner()
+        runner.add(CM)
+        runner.add(lambda: [1, 2], returns=streams('x'))
+        runner.add(lambda x: m.job(x) and x, requires='x', returns=nothing)
+        compare(list(runner.stream()), expected=[1, 2])
+        compare(m.mock_calls, expected=[
+            call.enter(), call.job(1), call.job(2), call.exit(None),
+        ])
+
+    def test_context_manager_per_item(self):
+        m = Mock()
+
+        class CM(object):
+            def __init__(self, x):
+                self.x = x
+            def __enter__(self):
+                m.enter(self.x)
+            def __exit__(self, type, obj, tb):
+                m.exit(self.x)
+
+        runner = Runner()
+        runner.add(lambda: [1, 2], returns=streams('x'))
+        runner.add(CM, requires='x')
+        runner.add(lambda x: m.job(x), requires='x', returns=nothing)
+        runner()
+        compare(m.mock_calls, expected=[
+            call.enter(1), call.job(1), call.exit(1),
+            call.enter(2), call.job(2), call.exit(2),
+        ])
+
+    def test_stream_closed_early(self):
+        m = Mock()
+
+        class CM(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit()
+
+        runner = Runner()
+        runner.add(CM)
+        runner.add(lambda: [1, 2], returns=streams('x'))
+        runner.add(lambda x: x, requires='x', returns='y')
+        results = runner.stream()
+        compare(next(results), expected=1)
+        results.close()
+        compare(m.mock_calls, expected=[call.enter(), call.exit()])
+
+    def test_key_clash(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='x')
+        runner.add(lambda: [1], returns=streams('x'))
+        with ShouldRaise(ContextError) as s:
+            runner()
+        compare(s.raised.text, expected="Context already contains 'x'")
+
+    def test_generated(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        function = runner.generate()
+        context = Context()
+        context['path'] = 'f'
+        compare(function(context), expected='f:C')
+        compare(len(m.mock_calls), expected=5)
+
+    def test_generated_within_context_manager(self):
+        m = Mock()
+
+        class CM(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit()
+
+        runner = Runner()
+        runner.add(CM)
+        runner.add(lambda: [1, 2], returns=streams('x'))
+        runner.add(lambda x: x * 10, requires='x', returns='y')
+        compare(runner.generate()(), expected=20)
+        compare(m.mock_calls, expected=[call.enter(), call.exit()])
+
+    def test_executor(self):
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        runner.add(lambda: [1, 2], returns=streams('x'))
+        runner.add(lambda a, x: a + x, requires=('a', 'x'), returns='y')
+        runner.add(lambda a, x: a * x, requires=('a', 'x'), returns='z')
+        runner.add(lambda y, z: (y, z), requires=('y', 'z'), returns='r')
+        with ThreadPoolExecutor(2) as executor:
+            compare(runner(executor=executor), expected=(3, 2))
+
+    def test_validate(self):
+        runner = Runner()
+        runner.add(lambda: [1], returns=streams('x'))
+        runner.add(lambda x: x, requires='x', returns='y')
+        runner.validate()
+
+    def test_map(self):
+        runner = Runner()
+        runner.add(lambda: [1, 2], returns=streams('x'))
+        runner.add(lambda x, s: x * s, requires=('x', 's'), returns='y')
+        compare(list(runner.map([1, 10], 's')), expected=[2, 20])
+
+
+class Big(object):
+    pass
+
+
+class ReleaseTests(TestCase):
+
+    def make_runner(self, m):
+        def parse():
+            big = Big()
+            m.parsed = weakref.ref(big)
+            return big
+
+        def summarise(big):
+            return 2
+
+        def report(size):
+            # parse's result is no longer referenced by the context:
+            m.report(size, m.parsed())
+            return size * 10
+
+        runner = Runner()
+        runner.add(parse, returns='big')
+        runner.add(summarise, requires='big', returns='size')
+        runner.add(report, requires='size', returns='report')
+        return runner
+
+    def test_call(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        runner.release()
+        context = Context()
+        compare(runner(context), expected=20)
+        compare(m.mock_calls, expected=[call.report(2, None)])
+        compare(context, expected={})
+
+    def test_not_releasing(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        context = Context()
+        runner(context)
+        self.assertTrue(isinstance(m.report.call_args[0][1], Big))
+        compare(sorted(context), expected=['big', 'report', 'size'])
+
+    def test_results(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        runner.release('size', 'report')
+        context = Context()
+        runner(context)
+        compare(context, expected={'size': 2, 'report': 20})
+
+    def test_generate(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        runner.release('report')
+        context = Context()
+        compare(runner.generate()(context), expected=20)
+        compare(m.mock_calls, expected=[call.report(2, None)])
+        compare(context, expected={'report': 20})
+
+    def test_executor(self):
+        m = Mock()
+        runner = self.make_runner(m)
+        runner.release('report')
+        context = Context()
+        with ThreadPoolExecutor(2) as executor:
+            compare(runner(context, executor=executor), expected=20)
+        compare(context, expected={'report': 20})
+
+    def test_lazy(self):
+        m = Mock()
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        runner.add(lambda: 2, returns='b')
+        runner.add(lambda a: a + 1, requires='a', returns='c', lazy=True)
+        runner.add(lambda b: b, requires='b', returns='d')
+        runner.add(lambda c: c, requires='c', returns='e')
+        runner.release()
+        context = Context()
+        compare(runner(context), expected=2)
+        compare(context, expected={})
+        with ThreadPoolExecutor(2) as executor:
+            compare(runner(executor=executor), expected=2)
+        compare(runner.generate()(), expected=2)
+
+    def test_context_manager(self):
+        m = Mock()
+
+        class Transaction(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit()
+
+        runner = Runner()
+        runner.add(lambda: 1, returns='a')
+        runner.add(Transaction)
+        runner.add(lambda a: a + 1, requires='a', returns='b')
+        runner.add(lambda b: m.b(b), requires='b', returns=nothing)
+        runner.release()
+        context = Context()
+        runner(context)
+        compare(m.mock_calls, expected=[call.enter(), call.b(2), call.exit()])
+        # the key with which the transaction is added is not known in
+        # advance, so it is not released:
+        compare(list(context), expected=[Transaction])
+
+    def test_stream(self):
+        runner = Runner()
+        runner.add(lambda: 10, returns='a')
+        runner.add(lambda: [1, 2], returns=streams('x'))
+        runner.add(lambda x, a: x + a, requires=('x', 'a'), returns='y')
+        runner.add(lambda y: y * 2, requires='y', returns='z')
+        runner.release('z')
+        compare(list(runner.stream()), expected=[22, 24])
+        compare(runner(), expected=24)
+        with ThreadPoolExecutor(2) as executor:
+            compare(runner(executor=executor), expected=24)
+
+    def test_map(self):
+        runner = Runner()
+        runner.add(lambda: 10, returns='a')
+        runner.add(lambda: 2, returns='b')
+        runner.add(lambda b: b, requires='b', returns='c')
+        runner.add(lambda x, a: x + a, requires=('x', 'a'), returns='y')
+        runner.release()
+        compare(list(runner.map([1, 2], 'x')), expected=[11, 12])
+
+    def test_scope(self):
+        m = Mock()
+
+        @scope('batch')
+        def connect():
+            m.connect()
+            return 'connection'
+
+        runner = Runner()
+        runner.add(connect, returns='connection')
+        runner.add(lambda connection, x: connection + x,
+                   requires=('connection', 'x'))
+        runner.release()
+        with runner.batch() as batch:
+            compare(batch(resources={'x': '1'}), expected='connection1')
+            compare(batch(resources={'x': '2'}), expected='connection2')
+        compare(m.mock_calls, expected=[call.connect()])
@@ -0,0 +1,165 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import TestCase
+
+from mock import Mock
+from testfixtures import Replace, ShouldRaise, compare
+
+from mush.context import ContextError
+from mush.runner import Runner
+from mush.sampling import Sampler, Trace
+from mush.tests.helpers import count, double, fetch, make_runner
+
+
+class TestSampler(TestCase):
+
+    def test_every(self):
+        sampler = Sampler(every=3, errors=())
+        runner = make_runner(sampler)
+        for _ in range(7):
+            runner()
+        traces = sampler.dump()
+        compare(len(traces), expected=2)
+        compare(sampler.runs, expected=7)
+        compare(sampler.sampled, expected=2)
+        compare(sampler.kept, expected=2)
+        trace = traces[0]
+        compare(trace.reason, expected='sampled')
+        compare([point for point, _, _, _ in trace.points],
+                expected=[runner.start, runner.start.next])
+        self.assertFalse(sampler.tail)
+        compare(sampler.active, expected={})
+
+    def test_not_recorded(self):
+        sampler = Sampler(every=1000, errors=())
+        runner = make_runner(sampler)
+        runner()
+        compare(sampler.active, expected={})
+        compare(sampler.dump(), expected=[])
+
+    def test_not_recorded_not_traced(self):
+        sampler = Sampler(every=1000, errors=())
+        runner = make_runner(sampler)
+        with Replace('mush.sampling.Sampler.point_end', Mock()) as point_end:
+            runner()
+        point_end.assert_not_called()
+
+    def test_tail_traced(self):
+        sampler = Sampler(every=1000)
+        runner = make_runner(sampler)
+        with Replace('mush.sampling.Sampler.point_end', Mock()) as point_end:
+            runner()
+        compare(point_end.call_count, expected=2)
+
+    def test_rate(self):
+        with Replace('mush.sampling.monotonic',
+                     Mock(side_effect=[0, 0.1, 0.2, 0.3, 1.3])):
+            sampler = Sampler(rate=1, errors=())
+            compare([sampler.sample() for _ in range(4)],
+                    expected=[True, False, False, True])
+        compare(sampler.sampled, expected=2)
+
+    def test_rate_below_one(self):
+        with Replace('mush.sampling.monotonic',
+                     Mock(side_effect=[0, 0, 1, 10])):
+            sampler = Sampler(rate=0.1, errors=())
+            compare([sampler.sample() for _ in range(3)],
+                    expected=[True, False, True])
+
+    def test_every_and_rate(self):
+        with Replace('mush.sampling.monotonic', Mock(return_value=0)):
+            sampler = Sampler(every=2, rate=1, errors=())
+            compare([sampler.sample() for _ in range(4)],
+                    expected=[False, True, False, False])
+
+    def test_context_error_kept(self):
+        sampler = Sampler()
+        runner = Runner()
+        runner.add(fetch, returns='page')
+        runner.add(count, requires='missing')
+        runner.instrument(sampler)
+        with ShouldRaise(ContextError) as s:
+            runner()
+        trace, = sampler.dump()
+        compare(trace.reason, expected='error')
+        self.assertTrue(trace.error is s.raised)
+        compare(len(trace.points), expected=1)
+
+    def test_other_error_not_kept(self):
+        sampler = Sampler()
+        runner = Runner(Mock(side_effect=ValueError()))
+        runner.instrument(sampler)
+        with ShouldRaise(ValueError):
+            runner()
+        compare(sampler.dump(), expected=[])
+        compare(sampler.active, expected={})
+
+    def test_slow(self):
+        sampler = Sampler(slower_than=0, errors=())
+        runner = make_runner(sampler)
+        runner()
+        trace, = sampler.dump()
+        compare(trace.reason, expected='slow')
+        compare(len(trace.points), expected=2)
+
+    def test_ring_buffer(self):
+        sampler = Sampler(every=1, size=2)
+        runner = make_runner(sampler)
+        for _ in range(3):
+            runner()
+        compare(len(sampler.dump(clear=False)), expected=2)
+        compare(sampler.kept, expected=3)
+        compare(len(sampler.dump()), expected=2)
+        compare(sampler.dump(), expected=[])
+
+    def test_nested_runs(self):
+        sampler = Sampler(every=2, errors=())
+        inner = make_runner(sampler)
+        outer = Runner()
+        outer.add(lambda: inner(), returns='x')
+        outer.instrument(sampler)
+        outer()  # run 1 not sampled, inner run 2 sampled
+        outer()  # run 3 not sampled, inner run 4 sampled
+        traces = sampler.dump()
+        compare([len(trace.points) for trace in traces], expected=[2, 2])
+        sampler.sample()  # skip to an odd count
+        outer()  # run 6 sampled, inner run 7 not
+        trace, = sampler.dump()
+        # the calls made by the inner run are not part of the outer run:
+        compare(len(trace.points), expected=1)
+        compare(sampler.active, expected={})
+
+    def test_executor(self):
+        sampler = Sampler(every=1)
+        runner = make_runner(sampler)
+        with ThreadPoolExecutor(2) as executor:
+            runner(executor=executor)
+        trace, = sampler.dump()
+        compare(len(trace.points), expected=2)
+
+    def test_process_executor(self):
+        sampler = Sampler(every=1)
+        runner = Runner()
+        runner.add(lambda: 3, returns='x')
+        runner.add(double, requires='x', returns='y', runs_in='process')
+        runner.instrument(sampler)
+        with ProcessPoolExecutor(1) as executor:
+            compare(runner(process_executor=executor), expected=6)
+        trace, = sampler.dump()
+        compare(len(trace.points), expected=2)
+
+    def test_as_dict(self):
+        sampler = Sampler(every=1)
+        make_runner(sampler)()
+        trace, = sampler.dump()
+        actual = trace.as_dict()
+        compare(actual['reason'], expected='sampled')
+        compare(actual['error'], expected=None)
+        compare([(p['name'], p['labels'], p['error'])
+                 for p in actual['points']],
+                expected=[('fetch', ['fetch'], None), ('count', [], None)])
+
+    def test_repr(self):
+        trace = Trace(True, None)
+        trace.reason = 'slow'
+        trace.elapsed = 1.5
+        compare(repr(trace), expected='<Trace: slow, 0 points, 1.500000s>')
@@ -0,0 +1,218 @@
+import os
+from tempfile import mkdtemp
+from shutil import rmtree
+from unittest import TestCase
+
+from mock import Mock
+from testfixtures import compare
+
+from mush.callpoints import CallPoint
+from mush.declarations import memoize, returns, streams
+from mush.runner import Runner
+from mush.stats import Histogram, Stats
+from mush.tests.helpers import fetch, make_runner
+
+
+def noop():
+    pass
+
+
+def rounded(stats):
+    if isinstance(stats, float):
+        return float('%.12g' % stats)
+    if isinstance(stats, dict):
+        return dict((key, rounded(value)) for key, value in stats.items())
+    return stats
+
+
+class TestHistogram(TestCase):
+
+    def test_empty(self):
+        compare(Histogram().as_dict(), expected={
+            'count': 0, 'sum': 0.0, 'max': 0.0,
+            'p50': None, 'p95': None, 'p99': None,
+        })
+
+    def test_fixed_size(self):
+        histogram = Histogram()
+        size = len(histogram.counts)
+        for i in range(1000):
+            histogram.add(i / 1000.0)
+        compare(len(histogram.counts), expected=size)
+        compare(histogram.count, expected=1000)
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        for _ in range(98):
+            histogram.add(1.5e-6)
+        histogram.add(5.0)
+        histogram.add(5.0)
+        # interpolated across the 1-2 microsecond bucket:
+        self.assertAlmostEqual(histogram.percentile(49), 1.5e-6, places=12)
+        self.assertAlmostEqual(histogram.percentile(98), 2e-6, places=12)
+        compare(histogram.percentile(100), expected=5.0)
+        compare(histogram.max, expected=5.0)
+
+    def test_interpolated_within_max(self):
+        histogram = Histogram()
+        histogram.add(3e-6)
+        # the bucket is 2-4 microseconds but nothing above 3 was added:
+        compare(histogram.percentile(100), expected=3e-6)
+
+    def test_overflow(self):
+        histogram = Histogram()
+        histogram.add(1e6)
+        compare(histogram.counts[-1], expected=1)
+        lower = Histogram.bounds[-1]
+        compare(histogram.percentile(50), expected=lower + (1e6 - lower) / 2)
+
+
+class TestStats(TestCase):
+
+    def test_point_and_run(self):
+        stats = Stats()
+        point = CallPoint(fetch)
+        stats.point_end(point, 0, 1e-6, None)
+        stats.point_end(point, 0, 1e-6, ValueError())
+        stats.run_end(None, 0, 2e-6, None)
+        stats.run_end(None, 0, 2e-6, ValueError())
+        compare(rounded(stats.as_dict()), expected={
+            'runs': 2,
+            'errors': 1,
+            'latency': {
+                'count': 2, 'sum': 4e-6, 'max': 2e-6,
+                'p50': 1.5e-6, 'p95': 1.95e-6, 'p99': 1.99e-6,
+            },
+            'points': {
+                'fetch': {
+                    'labels': [],
+                    'calls': 2,
+                    'errors': 1,
+                    'latency': {
+                        'count': 2, 'sum': 2e-6, 'max': 1e-6,
+                        'p50': 0.5e-6, 'p95': 0.95e-6, 'p99': 0.99e-6,
+                    },
+                },
+            },
+        })
+
+    def test_runner(self):
+        stats = Stats()
+        runner = make_runner(stats)
+        runner()
+        runner()
+        actual = stats.as_dict()
+        compare(actual['runs'], expected=2)
+        compare(list(actual['points']), expected=['fetch', 'count'])
+        compare(actual['points']['fetch']['labels'], expected=['fetch'])
+        compare(actual['points']['count']['calls'], expected=2)
+
+    def test_stream(self):
+        stats = Stats()
+        runner = make_runner(stats)
+        runner.add(lambda words: range(words), requires='words',
+                   returns=streams('item'))
+        runner.add(noop)
+        list(runner.stream())
+        actual = stats.as_dict()
+        compare(actual['runs'], expected=1)
+        compare(actual['points']['noop']['calls'], expected=2)
+
+    def test_duplicate_names(self):
+        stats = Stats()
+        runner = Runner(noop, noop)
+        runner.instrument(stats)
+        runner()
+        compare(list(stats.as_dict()['points']), expected=['noop', 'noop:2'])
+
+    def test_lazy(self):
+        stats = Stats()
+        make_runner(stats, lazy=True)()
+        compare(stats.as_dict()['points']['fetch']['resolved'], expected=1.0)
+        # a run in which the lazy resource was not needed:
+        stats.run_end(None, 0, 0, None)
+        compare(stats.as_dict()['points']['fetch']['resolved'], expected=0.5)
+
+    def test_memoized(self):
+        stats = Stats()
+
+        @memoize()
+        @returns('page')
+        def cached():
+            return 'a'
+
+        runner = Runner(cached)
+        runner.instrument(stats)
+        runner()
+        runner()
+        compare(stats.as_dict()['points']['cached']['cache'],
+                expected={'hits': 1, 'misses': 1})
+
+
+class TestPrometheus(TestCase):
+
+    def make_stats(self):
+        stats = Stats()
+        point = CallPoint(fetch)
+        stats.point_end(point, 0, 1e-6, None)
+        stats.run_end(None, 0, 1e-6, None)
+        return stats
+
+    def test_text(self):
+        lines = self.make_stats().prometheus().splitlines()
+        self.assertTrue('# TYPE mush_runs_total counter' in lines)
+        self.assertTrue('mush_runs_total 1' in lines)
+        self.assertTrue('mush_point_calls_total{point="fetch"} 1' in lines)
+        self.assertTrue('mush_point_errors_total{point="fetch"} 0' in lines)
+        self.assertTrue(
+            'mush_point_seconds_bucket{point="fetch",le="1e-06"} 1' in lines
+        )
+        self.assertTrue(
+            'mush_point_seconds_bucket{point="fetch",le="+Inf"} 1' in lines
+        )
+        self.assertTrue('mush_point_seconds_count{point="fetch"} 1' in lines)
+        self.assertTrue('mush_point_max_seconds{point="fetch"} 1e-06' in lines)
+        self.assertFalse([line for line in lines if 'cache' in line])
+
+    def test_prefix(self):
+        text = self.make_stats().prometheus(prefix='app')
+        self.assertTrue('\napp_runs_total 1\n' in text)
+
+    def test_escaping(self):
+        stats = Stats()
+        point = CallPoint(Mock(__name__='a "b"\\c'))
+        stats.point_end(point, 0, 1e-6, None)
+        self.assertTrue(
+            'mush_point_calls_total{point="a \\"b\\"\\\\c"} 1'
+            in stats.prometheus().splitlines()
+        )
+
+    def test_lazy_and_memoized(self):
+        stats = Stats()
+
+        @memoize()
+        @returns('words')
+        def cached(page):
+            return 'a'
+
+        runner = Runner()
+        runner.add(fetch, returns='page', lazy=True)
+        runner.add(cached, requires='page')
+        runner.instrument(stats)
+        runner()
+        lines = stats.prometheus().splitlines()
+        self.assertTrue('mush_point_resolved_ratio{point="fetch"} 1.0' in lines)
+        self.assertTrue('mush_point_cache_hits_total{point="cached"} 0' in lines)
+        self.assertTrue(
+            'mush_point_cache_misses_total{point="cached"} 1' in lines
+        )
+
+    def test_write(self):
+        stats = self.make_stats()
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        path = os.path.join(directory, 'mush.prom')
+        stats.write_prometheus(path)
+        with open(path) as source:
+            compare(source.read(), expected=stats.prometheus())
+        compare(os.listdir(directory), expected=['mush.prom'])
@@ -0,0 +1,112 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Event
+from unittest import TestCase
+
+from testfixtures import ShouldRaise, compare
+
+from mush.callpoints import CallPoint
+from mush.runner import Runner
+from mush.tests.helpers import fetch, make_runner
+from mush.timeline import ChromeTrace, lane
+
+
+class Transaction(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, type, obj, tb):
+        pass
+
+
+def summary(trace):
+    return [(event['name'], event['cat'], event.get('args'))
+            for event in trace.as_dict()['traceEvents']]
+
+
+class TestChromeTrace(TestCase):
+
+    def test_events(self):
+        trace = ChromeTrace()
+        make_runner(trace, lazy=True, between=[Transaction])()
+        compare(summary(trace), expected=[
+            ('Transaction', 'point', None),
+            ('fetch', 'lazy', {'labels': ['fetch']}),
+            ('count', 'point', None),
+            ('Transaction', 'scope', None),
+            ('run', 'run', None),
+        ])
+
+    def test_complete_events(self):
+        trace = ChromeTrace()
+        make_runner(trace, lazy=True, between=[Transaction])()
+        events = trace.as_dict()['traceEvents']
+        for event in events:
+            compare(event['ph'], expected='X')
+            compare(event['pid'], expected=os.getpid())
+            compare(event['tid'], expected=lane())
+            self.assertTrue(event['dur'] >= 0)
+        scope, run = events[-2:]
+        self.assertTrue(run['ts'] <= scope['ts'])
+        self.assertTrue(scope['ts'] + scope['dur'] <= run['ts'] + run['dur'])
+
+    def test_error(self):
+        trace = ChromeTrace()
+
+        def fail():
+            raise ValueError('boom')
+
+        runner = Runner(fail)
+        runner.instrument(trace)
+        with ShouldRaise(ValueError):
+            runner()
+        error = {'error': "ValueError('boom')"}
+        compare(summary(trace), expected=[
+            ('fail', 'point', error), ('run', 'run', error),
+        ])
+
+    def test_concurrent(self):
+        trace = ChromeTrace()
+        both = Event()
+        started = []
+
+        def wait(x):
+            started.append(x)
+            if len(started) == 2:
+                both.set()
+            both.wait(5)
+
+        runner = Runner()
+        runner.add(wait, requires='a', returns='x')
+        runner.add(wait, requires='b', returns='y')
+        runner.instrument(trace)
+        with ThreadPoolExecutor(2) as executor:
+            runner(executor=executor, resources={'a': 1, 'b': 2})
+        first, second, run = trace.as_dict()['traceEvents']
+        self.assertFalse(first['tid'] == second['tid'])
+        # the calls overlap:
+        self.assertTrue(first['ts'] < second['ts'] + second['dur'])
+        self.assertTrue(second['ts'] < first['ts'] + first['dur'])
+
+    def test_write_and_clear(self):
+        trace = ChromeTrace()
+        trace.point_end(CallPoint(fetch), 1.0, 0.5, None)
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        path = os.path.join(directory, 'trace.json')
+        trace.write(path)
+        with open(path) as source:
+            compare(json.load(source), expected={
+                'traceEvents': [{
+                    'name': 'fetch', 'cat': 'point', 'ph': 'X',
+                    'ts': 1000000.0, 'dur': 500000.0,
+                    'pid': os.getpid(), 'tid': lane(),
+                }],
+                'displayTimeUnit': 'ms',
+            })
+        trace.clear()
+        compare(trace.as_dict()['traceEvents'], expected=[])
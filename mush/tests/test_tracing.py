@@ -0,0 +1,471 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import ShouldRaise, compare
+
+from mush.context import Context, ContextError, SlotContext
+from mush.declarations import streams
+from mush.runner import Runner
+from mush.tracing import (
+    Traced, Tracer, call_from, lane, origin, skipping, trace_run
+)
+from mush.tests.helpers import double
+
+
+class Recorder(Tracer):
+
+    def __init__(self):
+        self.events = []
+        self.elapsed = []
+
+    def run_start(self, context):
+        self.events.append(('run_start', type(context)))
+
+    def run_end(self, context, start, elapsed, error):
+        self.elapsed.append(elapsed)
+        self.events.append(('run_end', error))
+
+    def point_start(self, point):
+        self.events.append(('start', point.obj))
+
+    def point_end(self, point, start, elapsed, error):
+        self.elapsed.append(elapsed)
+        self.events.append(('end', point.obj, error))
+
+    def scope_start(self, manager):
+        self.events.append(('scope_start', type(manager)))
+
+    def scope_end(self, manager, start, elapsed, error):
+        self.elapsed.append(elapsed)
+        self.events.append(('scope_end', type(manager), error))
+
+
+class Skipper(Recorder):
+
+    def run_start(self, context):
+        super(Skipper, self).run_start(context)
+        return False
+
+
+class CM(object):
+
+    def __init__(self, m):
+        self.m = m
+
+    def __enter__(self):
+        self.m.enter()
+
+    def __exit__(self, type, obj, tb):
+        self.m.exit()
+        return True
+
+
+class TestTracer(TestCase):
+
+    def test_hooks_do_nothing(self):
+        tracer = Tracer()
+        tracer.run_start(None)
+        tracer.run_end(None, 0, 0, None)
+        tracer.point_start(None)
+        tracer.point_end(None, 0, 0, None)
+        tracer.scope_start(None)
+        tracer.scope_end(None, 0, 0, None)
+
+
+class TestTraced(TestCase):
+
+    def test_call(self):
+        m = Mock()
+        m.obj.return_value = 'r'
+        traced = Traced(m.obj, m.point, m.tracer)
+        compare(traced(1, x=2), expected='r')
+        compare(m.mock_calls[:2], expected=[
+            call.tracer.point_start(m.point), call.obj(1, x=2),
+        ])
+        (_, (point, start, elapsed, error), _), = m.tracer.point_end.mock_calls
+        self.assertTrue(point is m.point)
+        self.assertTrue(elapsed >= 0)
+        compare(error, expected=None)
+
+    def test_exception(self):
+        m = Mock()
+        e = ValueError('boom')
+        m.obj.side_effect = e
+        traced = Traced(m.obj, m.point, m.tracer)
+        with ShouldRaise(e):
+            traced()
+        self.assertTrue(m.tracer.point_end.call_args[0][3] is e)
+
+    def test_repr(self):
+        compare(repr(Traced(double, None, None)), expected=repr(double))
+
+    def test_trace_run_exception(self):
+        tracer = Recorder()
+        e = ValueError('boom')
+        with ShouldRaise(e):
+            trace_run(tracer, Context(), Mock(side_effect=e))
+        compare(tracer.events, expected=[('run_start', Context), ('run_end', e)])
+
+
+class TestOrigin(TestCase):
+
+    def test_same_thread(self):
+        compare(origin(), expected=lane())
+
+    def test_call_from(self):
+        here = origin()
+        with ThreadPoolExecutor(1) as executor:
+            there, owner = executor.submit(
+                call_from, here, lambda: (lane(), origin()), (), {}
+            ).result()
+        self.assertFalse(there == here)
+        compare(owner, expected=here)
+        compare(origin(), expected=here)
+
+
+class TestRunner(TestCase):
+
+    def make_runner(self):
+        m = Mock()
+        m.a.return_value = 1
+        m.b.return_value = 2
+        runner = Runner()
+        runner.add(m.a, returns='a')
+        runner.add(m.b, requires='a', returns='b')
+        return m, runner
+
+    def test_no_tracer(self):
+        m, runner = self.make_runner()
+        compare(runner(), expected=2)
+        for step in runner.compile().steps:
+            self.assertFalse(isinstance(step.obj, Traced))
+
+    def test_serial(self):
+        m, runner = self.make_runner()
+        tracer = Recorder()
+        runner.instrument(tracer)
+        compare(runner(), expected=2)
+        compare(tracer.events[1:], expected=[
+            ('start', m.a), ('end', m.a, None),
+            ('start', m.b), ('end', m.b, None),
+            ('run_end', None),
+        ])
+        for elapsed in tracer.elapsed:
+            self.assertTrue(elapsed >= 0)
+
+    def test_instrument_after_compile(self):
+        m, runner = self.make_runner()
+        runner()
+        tracer = Recorder()
+        runner.instrument(tracer)
+        runner()
+        compare(len(tracer.events), expected=6)
+
+    def test_uninstrument(self):
+        m, runner = self.make_runner()
+        tracer = Recorder()
+        runner.instrument(tracer)
+        runner()
+        runner.instrument(None)
+        runner()
+        compare(len(tracer.events), expected=6)
+
+    def test_error(self):
+        m, runner = self.make_runner()
+        e = ValueError('boom')
+        m.b.side_effect = e
+        tracer = Recorder()
+        runner.instrument(tracer)
+        with ShouldRaise(e):
+            runner()
+        compare(tracer.events[-2:], expected=[
+            ('end', m.b, e), ('run_end', e),
+        ])
+
+    def test_context_error(self):
+        runner = Runner()
+        runner.add(double, requires='x')
+        tracer = Recorder()
+        runner.instrument(tracer)
+        with ShouldRaise(ContextError) as s:
+            runner()
+        compare(tracer.events[1:], expected=[('run_end', s.raised)])
+
+    def test_lazy(self):
+        m = Mock()
+        m.a.return_value = 1
+        runner = Runner()
+        runner.add(m.a, returns='a', lazy=True)
+        runner.add(m.b, requires='a')
+        tracer = Recorder()
+        runner.instrument(tracer)
+        runner()
+        factory = runner.start.obj
+        compare(factory.__wrapped__, expected=m.a)
+        compare(tracer.events[1:], expected=[
+            ('start', factory), ('end', factory, None),
+            ('start', m.b), ('end', m.b, None),
+            ('run_end', None),
+        ])
+
+    def test_context_manager(self):
+        m = Mock()
+        runner = Runner()
+        runner.add(CM, requires=Mock)
+        runner.add(m.job)
+        tracer = Recorder()
+        runner.instrument(tracer)
+        runner(resources={Mock: m})
+        compare(m.mock_calls, expected=[call.enter(), call.job(), call.exit()])
+        compare(tracer.events[1:], expected=[
+            ('start', CM), ('end', CM, None),
+            ('scope_start', CM),
+            ('start', m.job), ('end', m.job, None),
+            ('scope_end', CM, None),
+            ('run_end', None),
+        ])
+
+    def test_context_manager_suppresses(self):
+        m = Mock()
+        e = ValueError('boom')
+        m.job.side_effect = e
+        runner = Runner()
+        runner.add(CM, requires=Mock)
+        runner.add(m.job)
+        tracer = Recorder()
+        runner.instrument(tracer)
+        runner(resources={Mock: m})
+        compare(tracer.events[-3:], expected=[
+            ('end', m.job, e), ('scope_end', CM, None), ('run_end', None),
+        ])
+
+    def test_context_manager_generated(self):
+        m = Mock()
+        runner = Runner()
+        runner.add(CM, requires=Mock)
+        runner.add(m.job)
+        tracer = Recorder()
+        runner.instrument(tracer)
+        context = Context()
+        context.add(m, Mock)
+        runner.generate()(context)
+        compare([event[0] for event in tracer.events], expected=[
+            'run_start', 'start', 'end',
+            'scope_start', 'start', 'end', 'scope_end',
+            'run_end',
+        ])
+
+    def test_context_manager_streamed(self):
+        m = Mock()
+        runner = Runner()
+        runner.add(CM, requires=Mock)
+        runner.add(m.job)
+        tracer = Recorder()
+        runner.instrument(tracer)
+        list(runner.stream(resources={Mock: m}))
+        compare([event[0] for event in tracer.events], expected=[
+            'run_start', 'start', 'end',
+            'scope_start', 'start', 'end', 'scope_end',
+            'run_end',
+        ])
+
+    def test_stream(self):
+        m, runner = self.make_runner()
+        runner.add(lambda b: [b, b], requires='b', returns=streams('item'))
+        runner.add(m.c, requires='item')
+        tracer = Recorder()
+        runner.instrument(tracer)
+        results = runner.stream()
+        next(results)
+        compare(skipping.get(), expected=False)
+        list(results)
+        compare([event[0] for event in tracer.events], expected=[
+            'run_start', 'start', 'end', 'start', 'end', 'start', 'end',
+            'start', 'end', 'start', 'end', 'run_end',
+        ])
+
+    def test_stream_error(self):
+        m, runner = self.make_runner()
+        e = ValueError('boom')
+        m.b.side_effect = e
+        tracer = Recorder()
+        runner.instrument(tracer)
+        with ShouldRaise(e):
+            list(runner.stream())
+        compare(tracer.events[-1], expected=('run_end', e))
+
+    def test_stream_not_consumed(self):
+        m, runner = self.make_runner()
+        runner.add(lambda b: [b, b], requires='b', returns=streams('item'))
+        tracer = Recorder()
+        runner.instrument(tracer)
+        results = runner.stream()
+        next(results)
+        results.close()
+        compare(tracer.events[-1], expected=('run_end', None))
+
+    def test_stream_skipped(self):
+        m, runner = self.make_runner()
+        runner.add(lambda b: [b, b], requires='b', returns=streams('item'))
+        tracer = Skipper()
+        runner.instrument(tracer)
+        list(runner.stream())
+        compare([event[0] for event in tracer.events],
+                expected=['run_start', 'run_end'])
+        compare(skipping.get(), expected=False)
+
+    def test_context_manager_executor(self):
+        m = Mock()
+        runner = Runner()
+        runner.add(CM, requires=Mock)
+        runner.add(m.job)
+        tracer = Recorder()
+        runner.instrument(tracer)
+        with ThreadPoolExecutor(2) as executor:
+            runner(executor=executor, resources={Mock: m})
+        compare([event[0] for event in tracer.events], expected=[
+            'run_start', 'start', 'end', 'scope_start', 'start', 'end',
+            'scope_end', 'run_end',
+        ])
+
+    def test_executor(self):
+        m, runner = self.make_runner()
+        tracer = Recorder()
+        runner.instrument(tracer)
+        with ThreadPoolExecutor(2) as executor:
+            compare(runner(executor=executor), expected=2)
+        compare(tracer.events[1:], expected=[
+            ('start', m.a), ('end', m.a, None),
+            ('start', m.b), ('end', m.b, None),
+            ('run_end', None),
+        ])
+
+    def test_process_executor(self):
+        runner = Runner()
+        runner.add(lambda: 3, returns='x')
+        runner.add(double, requires='x', returns='y', runs_in='process')
+        tracer = Recorder()
+        runner.instrument(tracer)
+        with ProcessPoolExecutor(1) as executor:
+            compare(runner(process_executor=executor), expected=6)
+        compare(tracer.events[3:], expected=[
+            ('start', double), ('end', double, None), ('run_end', None),
+        ])
+
+    def test_map(self):
+        runner = Runner()
+        runner.add(double, requires='x', returns='y')
+        tracer = Recorder()
+        runner.instrument(tracer)
+        compare(list(runner.map([1, 2], 'x')), expected=[2, 4])
+        compare([event[0] for event in tracer.events], expected=[
+            'run_start', 'start', 'end', 'run_end',
+            'run_start', 'start', 'end', 'run_end',
+        ])
+
+    def test_generate(self):
+        m, runner = self.make_runner()
+        tracer = Recorder()
+        runner.instrument(tracer)
+        compare(runner.generate()(Context()), expected=2)
+        compare(tracer.events, expected=[
+            ('run_start', Context),
+            ('start', m.a), ('end', m.a, None),
+            ('start', m.b), ('end', m.b, None),
+            ('run_end', None),
+        ])
+
+    def test_generate_no_context(self):
+        m, runner = self.make_runner()
+        tracer = Recorder()
+        runner.instrument(tracer)
+        compare(runner.generate()(), expected=2)
+        compare([event[0] for event in tracer.events], expected=[
+            'run_start', 'start', 'end', 'start', 'end', 'run_end',
+        ])
+
+    def test_generate_error(self):
+        m, runner = self.make_runner()
+        e = ValueError('boom')
+        m.b.side_effect = e
+        tracer = Recorder()
+        runner.instrument(tracer)
+        with ShouldRaise(e):
+            runner.generate()()
+        compare(tracer.events[-1], expected=('run_end', e))
+
+    def test_generate_skipped(self):
+        m, runner = self.make_runner()
+        tracer = Skipper()
+        runner.instrument(tracer)
+        compare(runner.generate()(), expected=2)
+        compare([event[0] for event in tracer.events],
+                expected=['run_start', 'run_end'])
+
+    def test_skipped(self):
+        m, runner = self.make_runner()
+        runner.add(CM, requires=Mock)
+        runner.add(m.job)
+        tracer = Skipper()
+        runner.instrument(tracer)
+        runner(resources={Mock: m})
+        compare(tracer.events, expected=[
+            ('run_start', SlotContext), ('run_end', None),
+        ])
+        compare(m.mock_calls, expected=[
+            call.a(), call.b(1), call.enter(), call.job(), call.exit(),
+        ])
+
+    def test_skipped_lazy(self):
+        m = Mock()
+        runner = Runner()
+        runner.add(m.a, returns='a', lazy=True)
+        runner.add(m.b, requires='a')
+        tracer = Skipper()
+        runner.instrument(tracer)
+        runner()
+        compare([event[0] for event in tracer.events],
+                expected=['run_start', 'run_end'])
+
+    def test_skipped_executor(self):
+        m, runner = self.make_runner()
+        tracer = Skipper()
+        runner.instrument(tracer)
+        with ThreadPoolExecutor(2) as executor:
+            compare(runner(executor=executor), expected=2)
+        compare([event[0] for event in tracer.events],
+                expected=['run_start', 'run_end'])
+
+    def test_skipped_process_executor(self):
+        runner = Runner()
+        runner.add(double, requires='x', returns='y', runs_in='process')
+        tracer = Skipper()
+        runner.instrument(tracer)
+        with ProcessPoolExecutor(1) as executor:
+            compare(runner(process_executor=executor, resources={'x': 3}),
+                    expected=6)
+        compare([event[0] for event in tracer.events],
+                expected=['run_start', 'run_end'])
+
+    def test_skipped_only_for_run(self):
+        m, runner = self.make_runner()
+        runner.instrument(Skipper())
+        runner()
+        compare(skipping.get(), expected=False)
+
+    def test_skipped_error(self):
+        m, runner = self.make_runner()
+        m.b.side_effect = ValueError('boom')
+        tracer = Skipper()
+        runner.instrument(tracer)
+        with ShouldRaise(ValueError):
+            runner()
+        compare([event[0] for event in tracer.events],
+                expected=['run_start', 'run_end'])
+        compare(skipping.get(), expected=False)
+
+    def test_not_cloned(self):
+        m, runner = self.make_runner()
+        runner.instrument(Recorder())
+        compare(runner.clone().tracer, expected=None)
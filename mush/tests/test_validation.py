@@ -0,0 +1,333 @@
+from unittest import TestCase
+
+from testfixtures import ShouldRaise, compare
+
+from mush.context import Context, ContextError
+from mush.declarations import (
+    requires, returns, returns_mapping, returns_sequence, optional, attr,
+    item, nothing
+)
+from mush.runner import Runner
+from mush.validation import Validation, is_optional
+
+
+class T1(object): pass
+class T2(object): pass
+
+
+class TestIsOptional(TestCase):
+
+    def test_plain(self):
+        compare(is_optional('foo'), expected=False)
+
+    def test_optional(self):
+        compare(is_optional(optional('foo')), expected=True)
+
+    def test_nested(self):
+        compare(is_optional(attr(optional('foo'), 'bar')), expected=True)
+
+    def test_other_how(self):
+        compare(is_optional(item('foo', 'bar')), expected=False)
+
+
+class TestValidate(TestCase):
+
+    def test_empty(self):
+        validation = Runner().validate()
+        compare(validation.unsatisfied, expected=[])
+        compare(validation.dynamic, expected=[])
+        self.assertTrue(validation)
+
+    def test_satisfied(self):
+        @returns('x')
+        def job1():
+            pass  # pragma: no cover
+
+        @requires('x', item('x', 'y'), attr(T1, 'z'))
+        def job2(x, y, z):
+            pass  # pragma: no cover
+
+        runner = Runner(T1, job1, job2)
+        compare(runner.validate().unsatisfied, expected=[])
+
+    def test_unsatisfied(self):
+        called = []
+
+        @requires('x')
+        @returns('y')
+        def job1(x):
+            called.append(1)  # pragma: no cover
+
+        @requires(T1, 'y', optional('z'))
+        def job2(t, y, z=None):
+            called.append(2)  # pragma: no cover
+
+        runner = Runner(job1, job2)
+        with ShouldRaise(ContextError) as s:
+            runner.validate()
+        compare(s.raised.text, expected=(
+            "No 'x' in context for %r\n"
+            "No %r in context for %r" % (runner.start, T1, runner.end)
+        ))
+        compare(called, expected=[])
+
+    def test_required_later(self):
+        @requires('x')
+        def job1(x):
+            pass  # pragma: no cover
+
+        @returns('x')
+        def job2():
+            pass  # pragma: no cover
+
+        runner = Runner(job1, job2)
+        with ShouldRaise(ContextError("No 'x' in context for %r" % (
+            runner.start
+        ))):
+            runner.validate()
+
+    def test_supplied_context(self):
+        @requires('x')
+        def job(x):
+            pass  # pragma: no cover
+
+        context = Context()
+        context.add(1, 'x')
+        compare(Runner(job).validate(context).unsatisfied, expected=[])
+
+    def test_class_result_type(self):
+        @requires(T1)
+        def job(t):
+            pass  # pragma: no cover
+
+        validation = Runner(T1, job).validate()
+        compare(validation.dynamic, expected=[])
+
+    def test_function_result_type(self):
+        def job1():
+            pass  # pragma: no cover
+
+        @requires(T1)
+        def job2(t):
+            pass  # pragma: no cover
+
+        @requires('x')
+        def job3(x):
+            pass  # pragma: no cover
+
+        runner = Runner(job1, job2, job3)
+        with ShouldRaise(ContextError(
+            "No 'x' in context for %r" % runner.end
+        )):
+            runner.validate()
+
+    def test_sequence(self):
+        @returns_sequence()
+        def job1():
+            pass  # pragma: no cover
+
+        @requires(T1)
+        def job2(t):
+            pass  # pragma: no cover
+
+        runner = Runner()
+        runner.add(job1)
+        runner.add(job2, returns=nothing)
+        compare(runner.validate().dynamic, expected=[runner.start])
+
+    def test_sequence_with_string(self):
+        @returns_sequence()
+        def job1():
+            pass  # pragma: no cover
+
+        @requires('x')
+        def job2(x):
+            pass  # pragma: no cover
+
+        runner = Runner(job1, job2)
+        with ShouldRaise(ContextError) as s:
+            runner.validate()
+        compare(s.raised.text, expected=(
+            "No 'x' in context for %r\n"
+            "\n"
+            "The following may add resources that could not be checked:\n"
+            "%r" % (runner.end, runner.start)
+        ))
+
+    def test_mapping(self):
+        @returns_mapping()
+        def job1():
+            pass  # pragma: no cover
+
+        @requires(T1, 'x')
+        def job2(t, x):
+            pass  # pragma: no cover
+
+        runner = Runner()
+        runner.add(job1)
+        runner.add(job2, returns=nothing)
+        validation = runner.validate()
+        compare(validation.unsatisfied, expected=[])
+        compare(validation.dynamic, expected=[runner.start])
+        compare(str(validation), expected=(
+            "\n"
+            "The following may add resources that could not be checked:\n"
+            "%r" % runner.start
+        ))
+
+    def test_returns_nothing(self):
+        def job1():
+            pass  # pragma: no cover
+
+        @requires(T1)
+        def job2(t):
+            pass  # pragma: no cover
+
+        runner = Runner()
+        runner.add(job1, returns=nothing)
+        runner.add(job2)
+        with ShouldRaise(ContextError):
+            runner.validate()
+
+    def test_context_manager(self):
+        class CM(object):
+            def __enter__(self):
+                pass  # pragma: no cover
+            def __exit__(self, *args):
+                pass  # pragma: no cover
+
+        @requires(CM, T1)
+        def job(cm, t):
+            pass  # pragma: no cover
+
+        compare(Runner(CM, job).validate().unsatisfied, expected=[])
+
+    def test_lazy(self):
+        @requires('x')
+        @returns('y')
+        def make(x):
+            pass  # pragma: no cover
+
+        @returns('x')
+        def job1():
+            pass  # pragma: no cover
+
+        @requires('y')
+        def job2(y):
+            pass  # pragma: no cover
+
+        runner = Runner()
+        runner.add(make, lazy=True)
+        runner.add(job1)
+        runner.add(job2)
+        compare(runner.validate().unsatisfied, expected=[])
+
+    def test_lazy_unsatisfied(self):
+        @requires('x')
+        @returns('y')
+        def make(x):
+            pass  # pragma: no cover
+
+        @requires('y')
+        def job(y):
+            pass  # pragma: no cover
+
+        runner = Runner()
+        runner.add(make, lazy=True)
+        runner.add(job)
+        with ShouldRaise(ContextError("No 'x' in context for %r" % (
+            runner.start
+        ))):
+            runner.validate()
+
+    def test_lazy_not_required(self):
+        @requires('x')
+        @returns('y')
+        def make(x):
+            pass  # pragma: no cover
+
+        runner = Runner()
+        runner.add(make, lazy=True)
+        compare(runner.validate().unsatisfied, expected=[])
+
+
+class TestValidateOnCall(TestCase):
+
+    def test_off_by_default(self):
+        @requires('x')
+        def job(x):
+            pass  # pragma: no cover
+
+        runner = Runner()
+        runner.add(lambda: None, returns=nothing)
+        runner.add(job)
+        with ShouldRaise(ContextError) as s:
+            runner()
+        compare(s.raised.text, expected="No 'x' in context")
+
+    def test_nothing_called(self):
+        called = []
+
+        def job1():
+            called.append(1)  # pragma: no cover
+
+        @requires('x')
+        def job2(x):
+            pass  # pragma: no cover
+
+        runner = Runner(job1, job2)
+        runner.validate_on_call = True
+        with ShouldRaise(ContextError):
+            runner()
+        compare(called, expected=[])
+
+    def test_generated(self):
+        called = []
+
+        def job1():
+            called.append(1)  # pragma: no cover
+
+        @requires('x')
+        def job2(x):
+            pass  # pragma: no cover
+
+        runner = Runner(job1, job2)
+        runner.validate_on_call = True
+        function = runner.generate()
+        with ShouldRaise(ContextError):
+            function()
+        compare(called, expected=[])
+
+    def test_generated_with_context(self):
+        @requires('x')
+        def job(x):
+            return x
+
+        runner = Runner(job)
+        runner.validate_on_call = True
+        context = Context()
+        context.add(1, 'x')
+        compare(runner.generate()(context), expected=1)
+        self.assertTrue(isinstance(runner.compile().validation, Validation))
+
+    def test_generated_not_validated(self):
+        runner = Runner(requires('x')(lambda x: x))
+        function = runner.generate()
+        compare(function.__name__, expected='run')
+
+    def test_only_first_call(self):
+        @requires('x')
+        def job(x):
+            return x
+
+        runner = Runner(job)
+        runner.validate_on_call = True
+        context = Context()
+        context.add(1, 'x')
+        compare(runner(context), expected=1)
+        validation = runner.compile().validation
+        self.assertTrue(isinstance(validation, Validation))
+        context = Context()
+        context.add(2, 'x')
+        compare(runner(context), expected=2)
+        self.assertTrue(runner.compile().validation is validation)
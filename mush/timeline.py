@@ -0,0 +1,86 @@
+"""
+.. currentmodule:: mush
+
+A :class:`~.tracing.Tracer` that records the runs of a :class:`Runner`, the
+calls of the callables in it and the context managers they return as
+Chrome trace events, which can be loaded into a trace viewer such as
+Perfetto or ``chrome://tracing``.
+"""
+import json
+from os import getpid
+from threading import Lock
+
+from .factory import Factory
+from .tracing import Tracer, lane, point_name
+
+
+class ChromeTrace(Tracer):
+    """
+    A :class:`~.tracing.Tracer` that records a complete event for each run,
+    each call of a callable, including lazy callables when their resources
+    are first needed, and each context manager returned by a callable.
+    Events are recorded against the thread, or :mod:`asyncio` task, in
+    which they ended, so that concurrent execution shows up as overlapping
+    tracks. See :ref:`timelines`.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.pid = getpid()
+        #: The events recorded so far.
+        self.events = []
+
+    def event(self, name, category, start, elapsed, error, **args):
+        if error is not None:
+            args['error'] = repr(error)
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start * 1e6,
+            'dur': elapsed * 1e6,
+            'pid': self.pid,
+            'tid': lane(),
+        }
+        if args:
+            event['args'] = args
+        with self.lock:
+            self.events.append(event)
+
+    def run_end(self, context, start, elapsed, error):
+        self.event('run', 'run', start, elapsed, error)
+
+    def point_end(self, point, start, elapsed, error):
+        category = 'lazy' if isinstance(point.obj, Factory) else 'point'
+        labels = sorted(point.labels)
+        if labels:
+            self.event(point_name(point), category, start, elapsed, error,
+                       labels=labels)
+        else:
+            self.event(point_name(point), category, start, elapsed, error)
+
+    def scope_end(self, manager, start, elapsed, error):
+        self.event(type(manager).__name__, 'scope', start, elapsed, error)
+
+    def as_dict(self):
+        """
+        Return the events recorded so far in the Chrome trace event format.
+        """
+        with self.lock:
+            events = list(self.events)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        """
+        Write the events recorded so far, in the Chrome trace event format,
+        as JSON to the file at the supplied path.
+        """
+        with open(path, 'w') as output:
+            json.dump(self.as_dict(), output)
+
+    def clear(self):
+        """
+        Forget the events recorded so far.
+        """
+        with self.lock:
+            self.events = []
@@ -0,0 +1,335 @@
+"""
+.. currentmodule:: mush
+
+Hooks, installed using :meth:`Runner.instrument`, that are called around
+each run of a :class:`Runner` and each call of the callables in it.
+"""
+from threading import local
+
+from .compat import PY2, perf_counter
+from .declarations import name_or_repr
+from .factory import Factory
+
+try:
+    from threading import get_ident
+except ImportError:  # pragma: no cover
+    from thread import get_ident
+
+if PY2:  # pragma: no cover
+    # an implicit relative import would find mush.asyncio:
+    current_task = None
+else:
+    try:
+        from asyncio import current_task
+    except ImportError:  # pragma: no cover
+        current_task = None
+
+try:
+    from contextvars import ContextVar
+except ImportError:  # pragma: no cover
+    ContextVar = None
+
+state = local()
+
+
+class Flag(local):
+    """
+    A flag with the same interface as a :class:`contextvars.ContextVar`,
+    for where they are not available, that is local to each thread.
+    """
+
+    value = False
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        previous = self.value
+        self.value = value
+        return previous
+
+    def reset(self, previous):
+        self.value = previous
+
+
+#: Whether the calls made in the current run should not be traced, as its
+#: tracer's :meth:`~Tracer.run_start` hook returned ``False``. This is local
+#: to each :mod:`asyncio` task, where possible, as well as each thread.
+if ContextVar is None:  # pragma: no cover
+    skipping = Flag()
+else:
+    skipping = ContextVar('mush_skipping', default=False)
+
+
+def lane():
+    """
+    Return an identifier for the thread or, if there is one, the
+    :mod:`asyncio` task that the current code is running in.
+    """
+    if current_task is not None:
+        try:
+            task = current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            return id(task)
+    return get_ident()
+
+
+def origin():
+    """
+    Return the identifier, as returned by :func:`lane`, of the thread or
+    task that started the run that the current code is part of. This
+    differs from :func:`lane` while a callable is called in an executor's
+    thread on behalf of a run.
+    """
+    owner = getattr(state, 'origin', None)
+    if owner is None:
+        return lane()
+    return owner
+
+
+def call_from(owner, obj, args, kw):
+    """
+    Call the supplied callable with the supplied arguments and keyword
+    parameters such that :func:`origin` returns the supplied identifier
+    while it is called.
+    """
+    previous = getattr(state, 'origin', None)
+    state.origin = owner
+    try:
+        return obj(*args, **kw)
+    finally:
+        state.origin = previous
+
+
+def point_name(point):
+    """
+    Return a name for the supplied :class:`~.callpoints.CallPoint` based on
+    its callable.
+    """
+    obj = point.obj
+    if isinstance(obj, Factory):
+        obj = obj.__wrapped__
+    return name_or_repr(obj)
+
+
+def unique_names(points):
+    """
+    Return a list of names for the supplied points, as returned by
+    :func:`point_name`, with a suffix added to the names of any points after
+    the first with the same name.
+    """
+    seen = {}
+    names = []
+    for point in points:
+        name = point_name(point)
+        count = seen[name] = seen.get(name, 0) + 1
+        if count > 1:
+            name = '%s:%i' % (name, count)
+        names.append(name)
+    return names
+
+
+class Tracer(object):
+    """
+    The base class for objects that can be installed on a :class:`Runner`
+    using :meth:`Runner.instrument`. Each of the hooks below does nothing
+    unless overridden by a subclass.
+
+    Times are in seconds, as returned by :func:`time.perf_counter`, so only
+    differences between them are meaningful.
+    Hooks may be called concurrently from multiple threads when a runner is
+    called with an executor or from multiple threads at once.
+    """
+
+    def run_start(self, context):
+        """
+        Called when a run of the runner starts, with the
+        :class:`~.context.Context` in which it will take place.
+
+        If this returns ``False``, the point and scope hooks are not called
+        for the calls made during the run, so that runs that will not be
+        recorded cost little more than they would without a tracer.
+        The :meth:`run_end` hook is still called.
+        """
+
+    def run_end(self, context, start, elapsed, error):
+        """
+        Called when a run of the runner ends, with the time it started,
+        the number of seconds it took and the exception it raised, which
+        is ``None`` if it succeeded.
+        """
+
+    def point_start(self, point):
+        """
+        Called immediately before the callable of the supplied
+        :class:`~.callpoints.CallPoint` is called.
+        """
+
+    def point_end(self, point, start, elapsed, error):
+        """
+        Called immediately after the callable of the supplied
+        :class:`~.callpoints.CallPoint` has returned, with the time it was
+        called, the number of seconds it took and the exception it raised,
+        which is ``None`` if it succeeded.
+        """
+
+    def scope_start(self, manager):
+        """
+        Called immediately before a context manager returned by a callable
+        is entered, with the remaining callables of the run to be called
+        within it.
+        """
+
+    def scope_end(self, manager, start, elapsed, error):
+        """
+        Called once a context manager returned by a callable has exited,
+        with the time it was entered, the number of seconds spent within it
+        and the exception that propagated out of it, which is ``None`` if
+        there was none.
+        """
+
+
+class Traced(object):
+    """
+    A callable that calls the :meth:`~Tracer.point_start` and
+    :meth:`~Tracer.point_end` hooks of a :class:`Tracer` around each call
+    to the wrapped callable of a point.
+    """
+
+    def __init__(self, obj, point, tracer):
+        self.__wrapped__ = obj
+        self.point = point
+        self.tracer = tracer
+
+    def __call__(self, *args, **kw):
+        if skipping.get():
+            return self.__wrapped__(*args, **kw)
+        tracer = self.tracer
+        point = self.point
+        tracer.point_start(point)
+        start = perf_counter()
+        try:
+            result = self.__wrapped__(*args, **kw)
+        except Exception as e:
+            tracer.point_end(point, start, perf_counter() - start, e)
+            raise
+        tracer.point_end(point, start, perf_counter() - start, None)
+        return result
+
+    def __repr__(self):
+        return repr(self.__wrapped__)
+
+
+class Span(object):
+    """
+    A context manager that calls the :meth:`~Tracer.scope_start` and
+    :meth:`~Tracer.scope_end` hooks of a :class:`Tracer` around the use of a
+    context manager returned by a callable.
+    """
+
+    start = None
+
+    def __init__(self, tracer, manager):
+        self.tracer = tracer
+        self.manager = manager
+
+    def __enter__(self):
+        self.tracer.scope_start(self.manager)
+        self.start = perf_counter()
+
+    def __exit__(self, type, obj, tb):
+        self.tracer.scope_end(self.manager, self.start,
+                              perf_counter() - self.start, obj)
+
+
+class NoSpan(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, type, obj, tb):
+        pass
+
+
+no_span = NoSpan()
+
+
+def span(tracer, manager):
+    """
+    Return a :class:`Span` for the supplied context manager or, if there is
+    no tracer or the current run is not being traced, a context manager that
+    does nothing.
+    """
+    if tracer is None or skipping.get():
+        return no_span
+    return Span(tracer, manager)
+
+
+def trace_future(tracer, point, future, start):
+    """
+    Call the :meth:`~Tracer.point_end` hook of the supplied tracer once the
+    supplied :class:`~concurrent.futures.Future` for a call to the callable
+    of the supplied point has completed.
+    """
+    owner = origin()
+
+    def done(future):
+        error = None if future.cancelled() else future.exception()
+        call_from(owner, tracer.point_end,
+                  (point, start, perf_counter() - start, error), {})
+    future.add_done_callback(done)
+    return future
+
+
+def trace_run(tracer, context, run, *args):
+    """
+    Call the supplied function to perform a run in the supplied context,
+    calling the :meth:`~Tracer.run_start` and :meth:`~Tracer.run_end` hooks
+    of the supplied tracer around it.
+    """
+    token = skipping.set(tracer.run_start(context) is False)
+    start = perf_counter()
+    try:
+        result = run(*args)
+    except Exception as e:
+        tracer.run_end(context, start, perf_counter() - start, e)
+        raise
+    else:
+        tracer.run_end(context, start, perf_counter() - start, None)
+    finally:
+        skipping.reset(token)
+    return result
+
+
+def trace_iterator(tracer, context, results):
+    """
+    Yield from the supplied iterator of the results of a run in the supplied
+    context, calling the :meth:`~Tracer.run_start` and
+    :meth:`~Tracer.run_end` hooks of the supplied tracer around the whole
+    iteration. Whether the calls made are traced is only set while the
+    iterator is being advanced, so that it does not apply to the code
+    consuming the results.
+    """
+    skip = tracer.run_start(context) is False
+    start = perf_counter()
+    error = None
+    try:
+        while True:
+            token = skipping.set(skip)
+            try:
+                result = next(results)
+            except StopIteration:
+                return
+            finally:
+                skipping.reset(token)
+            yield result
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        close = getattr(results, 'close', None)
+        if close is not None:
+            close()
+        tracer.run_end(context, start, perf_counter() - start, error)
@@ -0,0 +1,126 @@
+"""
+.. currentmodule:: mush
+
+Checking, before anything is called, that the requirements of each step in a
+:class:`~.plan.Plan` can be satisfied by the steps before it.
+"""
+from inspect import isclass
+
+from .context import ContextError
+from .declarations import (
+    how, optional, returns_result_type, returns_sequence
+)
+from .plan import FactoryStep, is_context_manager_class, requirements_for
+from .pool import Pool
+
+
+def is_optional(required):
+    while isinstance(required, how):
+        if isinstance(required, optional):
+            return True
+        required = required.type
+    return False
+
+
+class Validation(object):
+    """
+    The result of checking the steps of a :class:`~.plan.Plan`.
+
+    :param keys: The keys of any resources that will be in the context before
+                 the first step is executed.
+    """
+
+    def __init__(self, plan, keys=()):
+        #: Pairs of ``(point, required)`` for each requirement that cannot be
+        #: satisfied.
+        self.unsatisfied = []
+        #: The points, other than those using the default
+        #: :class:`~.declarations.returns_result_type`, that may add resources
+        #: to the context that cannot be known before they are called.
+        self.dynamic = []
+
+        self.available = set(keys)
+        self.factories = {}
+        # whether any type, or any key at all, may have been added by
+        # dynamic points:
+        self.any_type = False
+        self.any_key = False
+
+        for step in plan.steps:
+            if isinstance(step, FactoryStep):
+                self.factories[step.key] = step
+                self.available.add(step.key)
+                continue
+            for requirement in step.requirements:
+                self.check(step.point, requirement.key, requirement.required)
+            self.provide(step)
+
+    def possible(self, key):
+        return self.any_key or (self.any_type and not isinstance(key, str))
+
+    def check(self, point, key, required):
+        if key in self.available:
+            factory = self.factories.pop(key, None)
+            if factory is not None:
+                # lazy callables are called when first required:
+                for requirement in requirements_for(factory.obj.requires):
+                    self.check(factory.point,
+                               requirement.key, requirement.required)
+        elif not (self.possible(key) or is_optional(required)):
+            self.unsatisfied.append((point, required))
+
+    def provide(self, step):
+        obj = step.point.obj
+        returns = step.point.returns
+        if is_context_manager_class(obj):
+            # whatever is returned by __enter__ is added using its type:
+            self.any_type = True
+        if isinstance(obj, Pool):
+            # the resource lent by a pool is added using its type:
+            if isclass(obj.factory):
+                self.available.add(obj.factory)
+            else:
+                self.any_type = True
+        if step.provides is not None:
+            self.available.update(step.provides)
+        elif type(returns) is returns_result_type:
+            # this is the default, so don't report it:
+            if isclass(obj):
+                self.available.add(obj)
+            else:
+                self.any_type = True
+        elif type(returns) is returns_sequence:
+            self.any_type = True
+            self.dynamic.append(step.point)
+        else:
+            self.any_key = True
+            self.dynamic.append(step.point)
+
+    def __bool__(self):
+        return not self.unsatisfied
+
+    __nonzero__ = __bool__
+
+    def __str__(self):
+        rows = []
+        for point, required in self.unsatisfied:
+            rows.append('No %r in context for %r' % (required, point))
+        if self.dynamic:
+            rows.append('')
+            rows.append('The following may add resources that could not '
+                        'be checked:')
+            for point in self.dynamic:
+                rows.append(repr(point))
+        return '\n'.join(rows)
+
+
+def validate(plan, keys=()):
+    """
+    Check that the requirements of each step in the supplied
+    :class:`~.plan.Plan` can be satisfied by the steps before it, raising a
+    :class:`~.context.ContextError` listing every requirement that cannot be.
+    """
+    validation = Validation(plan, keys)
+    if not validation:
+        raise ContextError(str(validation))
+    return validation
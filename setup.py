@@ -32,6 +32,8 @@ setup(
     zip_safe=False,
     include_package_data=True,
     extras_require=dict(
-        test=['pytest', 'pytest-cov', 'mock', 'sybil<3', 'testfixtures'],
+        test=['pytest', 'pytest-cov', 'mock', 'sybil<3', 'testfixtures',
+              # the tests use concurrent.futures executors:
+              'futures; python_version < "3"'],
         build=['sphinx', 'setuptools-git', 'wheel', 'twine']
     ))